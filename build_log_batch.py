@@ -0,0 +1,271 @@
+#! /usr/bin/python3
+
+# batch analysis of many build logs, e.g. all nightly builds
+#
+# every log is scanned in a worker process and reduced to per-target statistics,
+# which are cached per log (keyed by path, size and mtime) so only new logs are
+# scanned on the next run. the statistics of all logs are merged into one report:
+# in how many builds each target was seen / remade / failed, with the log lines
+# leading to its failures.
+
+import sys, os
+import glob
+import json
+import time
+import hashlib
+import logging
+import argparse
+import collections
+import concurrent.futures
+from io import StringIO
+
+from fwtools import init_logging, get_verbose_level
+from build_log_scan import BuildLogScanner, ScanStateError, MTST_NAMES, MTST_REMAKING, MTST_REMADE, MTST_REMAKE_FAILED, \
+    iter_make_targets, INDENTION
+from build_log_graph import get_target_key
+from build_log_io import iter_build_log_lines
+
+BATCH_CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = '.build_log_batch'
+DEFAULT_SNIPPET_LINES = 5
+MAX_SNIPPETS = 3  # failure snippets kept per target in the report
+DEFAULT_TOP_COUNT = 20
+
+REMADE_STATES = {MTST_REMAKING, MTST_REMADE, MTST_REMAKE_FAILED}
+
+
+def get_state_name(state):
+    return MTST_NAMES.get(state, '<unknown>')[1:-1]
+
+
+def scan_build_log_stats(log_file, snippet_lines=DEFAULT_SNIPPET_LINES, timestamps=False):
+    # runs in a worker process, returns the per-target statistics of one build log
+    recent = collections.deque(maxlen=snippet_lines)
+    snippets = {}  # id(target) -> lines up to the failure
+
+    def on_target_failed(target):
+        snippets[id(target)] = [raw.decode('utf-8', errors='replace').rstrip('\n') for raw in recent]
+
+    def iter_lines():
+        for raw in iter_build_log_lines(log_file):
+            recent.append(raw)
+            yield raw
+
+    scanner = BuildLogScanner(log_file, timestamps)
+    scanner.on_target_failed = on_target_failed
+    error = None
+    try:
+        scanner.scan(iter_lines())
+    except ScanStateError as e:
+        error = str(e)
+    except (AssertionError, RuntimeError, OSError) as e:
+        # keep what was scanned so far
+        error = '{} at line {}'.format(type(e).__name__, scanner.line_num)
+
+    targets = {}
+    if scanner.top_level_invocation is not None:
+        for target in iter_make_targets(scanner.top_level_invocation):
+            key = ':'.join(get_target_key(target))
+            stats = targets.get(key)
+            if stats is None:
+                stats = targets[key] = {'states': [], 'failures': []}
+            state = get_state_name(target.state)
+            if state not in stats['states']:
+                stats['states'].append(state)
+            if target.state == MTST_REMAKE_FAILED:
+                stats['failures'].append({'line': target.failed_pos,
+                                          'text': snippets.get(id(target), [])})
+
+    return {
+        'complete': error is None and scanner.is_finished(),
+        'error': error,
+        'lines': scanner.line_num,
+        'targets': targets
+    }
+
+
+class BatchCache(object):
+    # per build log statistics, one JSON file per log
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_file(self, log_file):
+        return os.path.join(self.cache_dir, hashlib.sha1(log_file.encode()).hexdigest() + '.json')
+
+    def load(self, log_file, timestamps=False):
+        stat = os.stat(log_file)
+        try:
+            with open(self._get_file(log_file)) as fp:
+                entry = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if entry.get('version') != BATCH_CACHE_VERSION or entry.get('log') != log_file or \
+                entry.get('size') != stat.st_size or entry.get('mtime') != stat.st_mtime_ns or \
+                entry.get('timestamps') != timestamps:
+            return None
+        return entry['stats']
+
+    def save(self, log_file, stats, timestamps=False):
+        stat = os.stat(log_file)
+        entry = {
+            'version': BATCH_CACHE_VERSION,
+            'log': log_file,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'timestamps': timestamps,
+            'stats': stats
+        }
+        tmp_file = self._get_file(log_file) + '.tmp'
+        with open(tmp_file, 'w') as fp:
+            json.dump(entry, fp, separators=(',', ':'))
+        os.replace(tmp_file, self._get_file(log_file))
+
+
+class BatchReport(object):
+    def __init__(self):
+        self.logs = []  # per log summary
+        self.targets = {}  # key -> merged statistics
+
+    def add(self, log_file, stats):
+        failed = 0
+        for key, target_stats in stats['targets'].items():
+            merged = self.targets.get(key)
+            if merged is None:
+                merged = self.targets[key] = {'builds': 0, 'remade': 0, 'failed': 0,
+                                              'states': {}, 'snippets': []}
+            merged['builds'] += 1
+            for state in target_stats['states']:
+                merged['states'][state] = merged['states'].get(state, 0) + 1
+            if any(state in target_stats['states'] for state in
+                   (get_state_name(s) for s in REMADE_STATES)):
+                merged['remade'] += 1
+            if target_stats['failures']:
+                merged['failed'] += 1
+                failed += 1
+                for failure in target_stats['failures']:
+                    if len(merged['snippets']) < MAX_SNIPPETS:
+                        merged['snippets'].append(dict(failure, log=log_file))
+
+        self.logs.append({
+            'log': log_file,
+            'complete': stats['complete'],
+            'error': stats['error'],
+            'lines': stats['lines'],
+            'targets': len(stats['targets']),
+            'failed': failed
+        })
+
+    def save(self, report_file):
+        with open(report_file, 'w') as fp:
+            json.dump({'builds': len(self.logs), 'logs': self.logs, 'targets': self.targets},
+                      fp, separators=(',', ':'))
+
+    def dump(self, top_count=DEFAULT_TOP_COUNT):
+        logger = logging.getLogger('BATCH')
+        builds = len(self.logs)
+
+        buffer = StringIO()
+        buffer.write('{} builds, {} targets, {} incomplete logs\n'.format(
+            builds, len(self.targets), sum(1 for log in self.logs if not log['complete'])))
+        for log in self.logs:
+            if log['error']:
+                buffer.write(INDENTION + 'log <{}>: {}\n'.format(log['log'], log['error']))
+        logger.info(buffer.getvalue())
+
+        failing = sorted((key for key, stats in self.targets.items() if stats['failed']),
+                         key=lambda key: -self.targets[key]['failed'])
+        buffer = StringIO()
+        buffer.write('most often failed targets:\n')
+        for key in failing[:top_count]:
+            stats = self.targets[key]
+            buffer.write(INDENTION + '<{}>, failed in {} of {} builds\n'.format(key, stats['failed'], stats['builds']))
+            for snippet in stats['snippets'][:1]:
+                buffer.write(2 * INDENTION + '{}, line {}:\n'.format(snippet['log'], snippet['line']))
+                for text in snippet['text']:
+                    buffer.write(3 * INDENTION + text + '\n')
+        logger.info(buffer.getvalue())
+
+        always_remade = sorted(key for key, stats in self.targets.items()
+                               if builds > 1 and stats['remade'] == builds)
+        buffer = StringIO()
+        buffer.write('targets remade in every build: {}\n'.format(len(always_remade)))
+        for key in always_remade[:top_count]:
+            buffer.write(INDENTION + '<{}>\n'.format(key))
+        logger.info(buffer.getvalue())
+
+
+def batch_scan(log_files, cache_dir=DEFAULT_CACHE_DIR, jobs=None, snippet_lines=DEFAULT_SNIPPET_LINES,
+               timestamps=False):
+    logger = logging.getLogger('BATCH')
+    cache = BatchCache(cache_dir)
+    results = {}
+    pending = []
+    for log_file in log_files:
+        stats = cache.load(log_file, timestamps)
+        if stats is not None:
+            results[log_file] = stats
+        else:
+            pending.append(log_file)
+    logger.info('%d build logs cached, %d to scan', len(results), len(pending))
+
+    if pending:
+        start = time.monotonic()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(scan_build_log_stats, log_file, snippet_lines, timestamps): log_file
+                       for log_file in pending}
+            for future in concurrent.futures.as_completed(futures):
+                log_file = futures[future]
+                stats = future.result()
+                cache.save(log_file, stats, timestamps)
+                results[log_file] = stats
+                logger.debug('build log <%s> scanned, %d lines', log_file, stats['lines'])
+        logger.info('%d build logs scanned in %.1fs', len(pending), time.monotonic() - start)
+
+    report = BatchReport()
+    for log_file in log_files:
+        report.add(log_file, results[log_file])
+    return report
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('-g', '--glob', action='append', default=None)
+    parser.add_argument('-c', '--cache', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('-j', '--jobs', type=int, default=None)
+    parser.add_argument('-o', '--output', default=None)
+    parser.add_argument('-n', '--top', type=int, default=DEFAULT_TOP_COUNT)
+    parser.add_argument('--snippet-lines', type=int, default=DEFAULT_SNIPPET_LINES)
+    parser.add_argument('-T', '--timestamps', action='store_true', default=False)
+    parser.add_argument('-v', '--verbose', default=None)
+    parser.add_argument('logs', nargs='*')
+
+    options = parser.parse_args(argv)
+
+    init_logging(get_verbose_level(options.verbose))
+
+    logger = logging.getLogger('APP')
+    log_files = list(options.logs)
+    for pattern in options.glob or []:
+        log_files.extend(sorted(glob.glob(pattern)))
+    log_files = [os.path.abspath(log_file) for log_file in log_files
+                 if not log_file.endswith('.idx')]
+    missing = [log_file for log_file in log_files if not os.path.isfile(log_file)]
+    if missing:
+        logger.error('build log <%s> does not exist', missing[0])
+        sys.exit(-1)
+    if not log_files:
+        logger.error('no build logs specified')
+        sys.exit(-1)
+    # each log once, in the given order
+    log_files = list(dict.fromkeys(log_files))
+
+    report = batch_scan(log_files, options.cache, options.jobs, options.snippet_lines, options.timestamps)
+    if options.output:
+        report.save(options.output)
+        logger.info('report saved to <%s>', options.output)
+    report.dump(options.top)
+
+
+if __name__ == '__main__':
+    main()
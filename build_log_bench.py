@@ -0,0 +1,162 @@
+#! /usr/bin/python3
+
+# benchmark of build_log_scan on a generated (or given) build log
+#
+# reports scan speed (lines/s, MiB/s), peak RSS of the scan, make database save
+# and load time, and find_target latency on the in-memory index and on the make
+# database file. results are appended as one JSON line to the output file, so
+# performance can be tracked over time.
+#
+#   build_log_bench.py -o bench.jsonl --depth 3 --submakes 4 --targets 500
+
+import os
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import concurrent.futures
+from io import StringIO
+
+from fwtools import init_logging, get_verbose_level
+from build_log_scan import ScanStats, build_log_scan, save_make_database, open_make_database, \
+    get_target_filter, get_target_index, find_target, iter_make_targets, INDENTION
+from build_log_gen import add_generator_arguments, get_generator_params, generate_build_log
+
+DEFAULT_QUERY_COUNT = 20
+
+
+def bench_scan(log_file, mkdb_file):
+    # runs in a fresh worker process, so that peak RSS is the one of the scan
+    stats = ScanStats()
+    stats.on_progress = None
+    mk = build_log_scan(log_file, stats=stats)
+
+    start = time.perf_counter()
+    save_make_database(mkdb_file, mk)
+    save_time = time.perf_counter() - start
+
+    lines_per_sec, bytes_per_sec = stats.get_rates()
+    return {
+        'lines': stats.lines,
+        'bytes': stats.bytes,
+        'nodes': stats.nodes,
+        'scan_time': stats.elapsed,
+        'lines_per_sec': lines_per_sec,
+        'bytes_per_sec': bytes_per_sec,
+        'peak_rss_kib': stats.peak_memory,
+        'save_time': save_time
+    }
+
+
+def get_latency(mkdb, target_filter, count):
+    # median seconds of count find_target queries, and the number of results
+    times = []
+    results = 0
+    for _ in range(count):
+        start = time.perf_counter()
+        results = sum(1 for _ in find_target(mkdb, target_filter))
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), results
+
+
+def bench_queries(mkdb_file, query_count=DEFAULT_QUERY_COUNT, seed=0):
+    store = open_make_database(mkdb_file)
+    start = time.perf_counter()
+    root = store.load_tree()[0]
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    get_target_index(root)
+    index_time = time.perf_counter() - start
+
+    names = sorted(set(target.name for target in iter_make_targets(root)))
+    name = random.Random(seed).choice(names) if names else 'all'
+    queries = {
+        'exact': {'target': '^{}$'.format(name)},
+        'prefix': {'target': '^' + name[:2]},
+        'regex': {'target': r'\.o$'},
+        'state': {'state': 'failed'},
+        'all': {'target': '.'}
+    }
+
+    results = {'load_time': load_time, 'index_time': index_time, 'queries': {}}
+    for query_name, query in queries.items():
+        target_filter = get_target_filter(query.get('target'), query.get('state'))
+        memory_latency, count = get_latency(root, target_filter, query_count)
+        # the make database file is queried directly, without loading the tree
+        stored_latency, _ = get_latency(store.get_root(), target_filter, query_count)
+        results['queries'][query_name] = {
+            'results': count,
+            'memory_latency': memory_latency,
+            'stored_latency': stored_latency
+        }
+    return results
+
+
+def dump_results(results):
+    logger = logging.getLogger('BENCH')
+    scan = results['scan']
+    buffer = StringIO()
+    buffer.write('{} lines, {:.1f} MiB, {} nodes\n'.format(scan['lines'], scan['bytes'] / 1048576, scan['nodes']))
+    buffer.write('scan: {:.3f}s, {:.0f} lines/s, {:.1f} MiB/s'.format(
+        scan['scan_time'], scan['lines_per_sec'], scan['bytes_per_sec'] / 1048576))
+    if scan['peak_rss_kib'] is not None:
+        buffer.write(', peak RSS {:.1f} MiB'.format(scan['peak_rss_kib'] / 1024))
+    buffer.write('\n')
+    buffer.write('save: {:.3f}s, load: {:.3f}s, index: {:.3f}s\n'.format(
+        scan['save_time'], results['load_time'], results['index_time']))
+    buffer.write('find_target median latency, in memory / make database file:\n')
+    for name, query in results['queries'].items():
+        buffer.write(INDENTION + '{:<8} {:>10.3f}ms {:>10.3f}ms, {} results\n'.format(
+            name, query['memory_latency'] * 1000, query['stored_latency'] * 1000, query['results']))
+    logger.info(buffer.getvalue())
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('-l', '--log', default=None)
+    parser.add_argument('-o', '--output', default=None)
+    parser.add_argument('-n', '--queries', type=int, default=DEFAULT_QUERY_COUNT)
+    parser.add_argument('-v', '--verbose', default=None)
+    add_generator_arguments(parser)
+
+    options = parser.parse_args(argv)
+
+    init_logging(get_verbose_level(options.verbose))
+
+    logger = logging.getLogger('APP')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        results = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+        }
+        if options.log:
+            log_file = options.log
+            results['log'] = os.path.abspath(log_file)
+        else:
+            log_file = os.path.join(temp_dir, 'build.log')
+            params = get_generator_params(options)
+            start = time.perf_counter()
+            lines = generate_build_log(log_file, params)
+            logger.info('%d lines generated in %.3fs', lines, time.perf_counter() - start)
+            results['generator'] = vars(params)
+
+        mkdb_file = os.path.join(temp_dir, 'build.mkdb')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+            results['scan'] = executor.submit(bench_scan, log_file, mkdb_file).result()
+        results.update(bench_queries(mkdb_file, options.queries, options.seed))
+
+    dump_results(results)
+    if options.output:
+        with open(options.output, 'a') as fp:
+            fp.write(json.dumps(results, separators=(',', ':')))
+            fp.write('\n')
+        logger.info('results appended to <%s>', options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,359 @@
+#! /usr/bin/python3
+
+# structured make database ("make -p") of a make invocation
+#
+# the database dump of an invocation is read back from build log and parsed on
+# first access into variables (with origin), pattern rules and file entries; the
+# result is kept as long as the invocation, so queries over all invocations of a
+# build, e.g. every value of CFLAGS by makefile, parse each dump at most once.
+
+import re
+import sys
+import logging
+import argparse
+import weakref
+from io import StringIO
+
+from fwtools import init_logging, get_verbose_level
+from build_log_scan import MakeDatabaseError, LOAD_BUILD_ERRORS, MK_DB_PRINT_BEGIN, TIMESTAMP_PATTERN, \
+    load_build, iter_make_invocations, INDENTION
+
+SECTION_VARIABLES = '# Variables'
+SECTION_PATTERN_VARIABLES = '# Pattern-specific Variable Values'
+SECTION_DIRECTORIES = '# Directories'
+SECTION_IMPLICIT_RULES = '# Implicit Rules'
+SECTION_FILES = '# Files'
+SECTION_VPATH = '# VPATH Search Paths'
+SECTIONS = {SECTION_VARIABLES, SECTION_PATTERN_VARIABLES, SECTION_DIRECTORIES,
+            SECTION_IMPLICIT_RULES, SECTION_FILES, SECTION_VPATH}
+
+ORIGIN_PATTERN = re.compile(r"^# (?P<origin>default|environment(?: override)?|automatic|makefile|"
+                            r"command line|override|'override' directive)"
+                            r"(?: \(from [`'](?P<file>.*)', line (?P<line>[0-9]+)\))?[ \t]*$")
+VARIABLE_PATTERN = re.compile(r"^(?P<name>[^\s#:=]+) (?P<flavor>::?=|\+=|\?=|!=|=) ?(?P<value>.*)$")
+DEFINE_PATTERN = re.compile(r"^define (?P<name>\S+)(?: (?P<flavor>::?=|\+=|\?=|!=|=))?[ \t]*$")
+RULE_PATTERN = re.compile(r"^(?P<targets>[^#\t:][^:]*?)(?P<colon>::?)(?: (?P<prereqs>.*))?$")
+TARGET_VARIABLE_PATTERN = re.compile(r"^(?P<target>[^#\t:][^:]*?): (?P<name>[^\s#:=]+) "
+                                     r"(?P<flavor>::?=|\+=|\?=|!=|=) ?(?P<value>.*)$")
+RECIPE_PATTERN = re.compile(r"^#  recipe to execute \((?:from [`'](?P<file>.*)', line (?P<line>[0-9]+)|built-in)\):")
+NOT_A_TARGET = '# Not a target:'
+PHONY_NOTE = '#  Phony target'
+
+# invocation -> MakeDatabase, an entry goes away with its make tree, so a tree
+# scanned again from a rewritten build log never sees a stale database
+PARSED_DATABASES = weakref.WeakKeyDictionary()
+
+
+class MakeVariable(object):
+    def __init__(self, name, value, flavor, origin, location=None):
+        self.name = name
+        self.value = value
+        self.flavor = flavor  # assignment operator, "=" for recursive, ":=" for simple
+        self.origin = origin  # default, environment, makefile, command line, override, automatic ...
+        self.location = location  # (makefile, line) of the definition
+
+
+class MakeRule(object):
+    # explicit rule / file entry or pattern rule
+    def __init__(self, targets, double_colon=False):
+        self.targets = targets
+        self.double_colon = double_colon
+        self.prereqs = []
+        self.order_only = []
+        self.recipe = []  # recipe lines, without the leading tab
+        self.recipe_location = None  # (makefile, line), None for built-in recipes
+        self.is_target = True  # False for "# Not a target:" entries
+        self.phony = False
+        self.variables = {}  # target specific variables
+        self.notes = []  # comment lines of the entry
+
+    def get_name(self):
+        return ' '.join(self.targets)
+
+
+class MakeDatabase(object):
+    def __init__(self):
+        self.variables = {}  # name -> MakeVariable
+        self.pattern_rules = []  # implicit rules, in database order
+        self.files = {}  # name -> MakeRule, double colon entries -> list of MakeRule
+        self.pattern_rules_by_target = {}  # target pattern -> [MakeRule]
+
+    def get_explicit_rules(self):
+        for rules in self.files.values():
+            for rule in rules if isinstance(rules, list) else [rules]:
+                if rule.is_target:
+                    yield rule
+
+    def get_rules(self, name):
+        # file entries of a target, [] if none
+        rules = self.files.get(name)
+        if rules is None:
+            return []
+        return rules if isinstance(rules, list) else [rules]
+
+
+def get_location(m):
+    if m.group('file') is None:
+        return None
+    return m.group('file'), int(m.group('line'))
+
+
+def split_prereqs(text):
+    if not text:
+        return [], []
+    normal, _, order_only = text.partition(' | ')
+    return normal.split(), order_only.split()
+
+
+def iter_database_lines(text):
+    # lines of a database dump, time stamp prefixes stripped
+    timestamps = not text.startswith(MK_DB_PRINT_BEGIN)
+    for ln in StringIO(text):
+        ln = ln.rstrip('\n')
+        if timestamps:
+            m = TIMESTAMP_PATTERN.match(ln)
+            if m:
+                ln = ln[m.end():]
+        yield ln
+
+
+def parse_make_database(text):
+    db = MakeDatabase()
+    section = None
+    origin = None  # origin comment of the next variable
+    rule = None  # entry being parsed, until an empty line
+    not_a_target = False
+    define = None  # (name, flavor, origin, lines) of a multi-line variable
+    for ln in iter_database_lines(text):
+        if define is not None:
+            if ln == 'endef':
+                name, flavor, var_origin, lines = define
+                variable = MakeVariable(name, '\n'.join(lines), flavor, *var_origin)
+                db.variables[name] = variable
+                define = None
+            else:
+                define[3].append(ln)
+            continue
+
+        if ln in SECTIONS:
+            section = ln
+            rule = None
+            origin = None
+            continue
+
+        if rule is not None:
+            if ln.startswith('\t'):
+                rule.recipe.append(ln[1:])
+                continue
+            if ln.startswith('#'):
+                m = RECIPE_PATTERN.match(ln)
+                if m:
+                    rule.recipe_location = get_location(m)
+                elif ln.startswith(PHONY_NOTE):
+                    rule.phony = True
+                elif not ln.startswith('# ') or not ORIGIN_PATTERN.match(ln):
+                    rule.notes.append(ln)
+                continue
+            rule = None
+            if not ln:
+                continue
+
+        if not ln:
+            origin = None
+            continue
+
+        m = ORIGIN_PATTERN.match(ln)
+        if m:
+            origin = (m.group('origin'), get_location(m))
+            continue
+
+        if section == SECTION_VARIABLES:
+            if origin is None:
+                continue
+            m = DEFINE_PATTERN.match(ln)
+            if m:
+                define = (m.group('name'), m.group('flavor') or '=', origin, [])
+                origin = None
+                continue
+            m = VARIABLE_PATTERN.match(ln)
+            if m:
+                db.variables[m.group('name')] = MakeVariable(m.group('name'), m.group('value'),
+                                                             m.group('flavor'), *origin)
+            origin = None
+        elif section in (SECTION_IMPLICIT_RULES, SECTION_FILES):
+            if ln == NOT_A_TARGET:
+                not_a_target = True
+                continue
+            if ln.startswith('#'):
+                continue
+            if origin is not None and section == SECTION_FILES:
+                # target specific variable, precedes the file entry
+                m = TARGET_VARIABLE_PATTERN.match(ln)
+                var_origin, origin = origin, None
+                if m:
+                    target = m.group('target')
+                    entry = db.files.get(target)
+                    if entry is None:
+                        entry = db.files[target] = MakeRule([target])
+                        entry.is_target = False  # until its entry is parsed
+                    entry = entry[-1] if isinstance(entry, list) else entry
+                    entry.variables[m.group('name')] = MakeVariable(m.group('name'), m.group('value'),
+                                                                    m.group('flavor'), *var_origin)
+                    continue
+            m = RULE_PATTERN.match(ln)
+            if not m:
+                continue
+            rule = MakeRule(m.group('targets').split(), m.group('colon') == '::')
+            rule.prereqs, rule.order_only = split_prereqs(m.group('prereqs'))
+            rule.is_target = not not_a_target
+            not_a_target = False
+            if section == SECTION_IMPLICIT_RULES:
+                db.pattern_rules.append(rule)
+                for target in rule.targets:
+                    db.pattern_rules_by_target.setdefault(target, []).append(rule)
+            else:
+                name = rule.targets[0]
+                entry = db.files.get(name)
+                if rule.double_colon and entry is not None:
+                    if not isinstance(entry, list):
+                        entry = db.files[name] = [entry]
+                    entry.append(rule)
+                else:
+                    if isinstance(entry, MakeRule):
+                        # keep target specific variables parsed before the entry
+                        rule.variables = entry.variables
+                    db.files[name] = rule
+    return db
+
+
+def get_make_database(invocation):
+    # parsed make database of an invocation, None if it has no database dump,
+    # MakeDatabaseError if its build log is gone or changed since the scan
+    db = PARSED_DATABASES.get(invocation)
+    if db is None:
+        text = invocation.get_database()
+        if text is None:
+            return None
+        db = PARSED_DATABASES[invocation] = parse_make_database(text)
+    return db
+
+
+def get_variables(db, name):
+    if name in db.variables:
+        yield db.variables[name]
+
+
+def get_rules(db, name):
+    # file entries and pattern rules for the target
+    yield from db.get_rules(name)
+    yield from db.pattern_rules_by_target.get(name, [])
+
+
+def find_variable(mkdb, name):
+    # (invocation, MakeVariable) of every invocation defining the variable
+    for invocation in iter_make_invocations(mkdb):
+        db = get_make_database(invocation)
+        if db is not None:
+            for variable in get_variables(db, name):
+                yield invocation, variable
+
+
+def find_rules(mkdb, name):
+    # (invocation, MakeRule) of every file entry or pattern rule for the target
+    for invocation in iter_make_invocations(mkdb):
+        db = get_make_database(invocation)
+        if db is not None:
+            for rule in get_rules(db, name):
+                yield invocation, rule
+
+
+def dump_variable(invocation, variable, buffer):
+    buffer.write('[{}] {} {} {}\n'.format(invocation.get_makefile(), variable.name, variable.flavor,
+                                          variable.value.replace('\n', '\\n')))
+    buffer.write(INDENTION + 'origin: {}'.format(variable.origin))
+    if variable.location:
+        buffer.write(", from '{}', line {}".format(*variable.location))
+    buffer.write('\n')
+
+
+def dump_rule(invocation, rule, buffer):
+    buffer.write('[{}] {}{}'.format(invocation.get_makefile(), rule.get_name(),
+                                    '::' if rule.double_colon else ':'))
+    if rule.prereqs:
+        buffer.write(' ' + ' '.join(rule.prereqs))
+    if rule.order_only:
+        buffer.write(' | ' + ' '.join(rule.order_only))
+    buffer.write('\n')
+    if not rule.is_target:
+        buffer.write(INDENTION + 'not a target\n')
+    if rule.phony:
+        buffer.write(INDENTION + 'phony\n')
+    for variable in rule.variables.values():
+        buffer.write(INDENTION + '{} {} {}\n'.format(variable.name, variable.flavor, variable.value))
+    if rule.recipe:
+        if rule.recipe_location:
+            buffer.write(INDENTION + "recipe, from '{}', line {}:\n".format(*rule.recipe_location))
+        else:
+            buffer.write(INDENTION + 'recipe, built-in:\n')
+        for ln in rule.recipe:
+            buffer.write(2 * INDENTION + ln + '\n')
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('-l', '--log', default=None)
+    parser.add_argument('-L', '--load', default=None)
+    parser.add_argument('-V', '--variable', action='append', default=None)
+    parser.add_argument('-r', '--rule', action='append', default=None)
+    parser.add_argument('-T', '--timestamps', action='store_true', default=False)
+    parser.add_argument('-v', '--verbose', default=None)
+
+    options = parser.parse_args(argv)
+
+    init_logging(get_verbose_level(options.verbose))
+
+    logger = logging.getLogger('APP')
+    if not options.log and not options.load:
+        logger.error('no build log or make database file specified')
+        sys.exit(-1)
+    try:
+        mk = load_build(options.log or options.load, timestamps=options.timestamps)
+    except LOAD_BUILD_ERRORS as e:
+        logger.error('%s', e)
+        sys.exit(-1)
+
+    # (get items of a database, dump an item, name, buffer) of each query, all
+    # answered in one pass over the invocations, so each dump is parsed once
+    queries = []
+    for name in options.variable or []:
+        buffer = StringIO()
+        buffer.write('variable <{}>:\n'.format(name))
+        queries.append((get_variables, dump_variable, name, buffer))
+    for name in options.rule or []:
+        buffer = StringIO()
+        buffer.write('rules of <{}>:\n'.format(name))
+        queries.append((get_rules, dump_rule, name, buffer))
+    if not queries:
+        return
+
+    try:
+        for invocation in iter_make_invocations(mk):
+            db = get_make_database(invocation)
+            if db is None:
+                continue
+            for get_items, dump_item, name, buffer in queries:
+                for item in get_items(db, name):
+                    dump_item(invocation, item, buffer)
+            # not needed once all queries are answered
+            PARSED_DATABASES.pop(invocation, None)
+    except MakeDatabaseError as e:
+        logger.error('%s', e)
+        sys.exit(-1)
+
+    logger = logging.getLogger('DATABASE')
+    for _, _, _, buffer in queries:
+        logger.info(buffer.getvalue())
+
+
+if __name__ == '__main__':
+    main()
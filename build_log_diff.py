@@ -0,0 +1,150 @@
+#! /usr/bin/python3
+
+# differences between two builds, each given as build log or saved make database
+#
+# targets are aligned by key (invocation key, target name), the invocation key is
+# (parent invocation key, makefile, target the make was invoked for, occurrence),
+# so the same target built by two different sub makes of one makefile is not mixed
+# up. both trees are walked once and the keys are hashed into dicts, the diff is
+# linear in the number of targets.
+
+import sys
+import logging
+import argparse
+from io import StringIO
+
+from fwtools import init_logging, get_verbose_level
+from build_log_scan import MakeInvocation, LOAD_BUILD_ERRORS, \
+    MTST_REMAKING, MTST_REMADE, MTST_REMAKE_FAILED, MTST_UP_TO_DATE, load_build, INDENTION
+
+# target summary of all occurrences under one key, ordered by precedence
+TARGET_OTHER = 0  # only considered, e.g. considered already
+TARGET_UP_TO_DATE = 1
+TARGET_REMADE = 2
+TARGET_FAILED = 3
+TARGET_SUMMARY_NAMES = {
+    None: 'absent',
+    TARGET_OTHER: 'considered',
+    TARGET_UP_TO_DATE: 'up to date',
+    TARGET_REMADE: 'remade',
+    TARGET_FAILED: 'failed'
+}
+STATE_TO_SUMMARY = {
+    MTST_UP_TO_DATE: TARGET_UP_TO_DATE,
+    MTST_REMAKING: TARGET_REMADE,
+    MTST_REMADE: TARGET_REMADE,
+    MTST_REMAKE_FAILED: TARGET_FAILED
+}
+
+
+class BuildKeys(object):
+    # keyed invocations and target summaries of one build
+    def __init__(self, root):
+        self.invocations = {}  # invocation key -> MakeInvocation
+        self.targets = {}  # (invocation key, target name) -> summary
+        occurrences = {}
+        stack = [(root, None)]
+        while stack:
+            node, key = stack.pop()
+            if isinstance(node, MakeInvocation):
+                for_target = node.for_target.name if node.for_target is not None else None
+                base = (key, node.get_makefile(), for_target)
+                count = occurrences.get(base, 0)
+                occurrences[base] = count + 1
+                key = base + (count,)
+                self.invocations[key] = node
+                children = node.targets + node.submakes
+            else:
+                target_key = (key, node.name)
+                summary = STATE_TO_SUMMARY.get(node.state, TARGET_OTHER)
+                if summary > self.targets.get(target_key, -1):
+                    self.targets[target_key] = summary
+                children = node.prereqs + node.submakes
+            # the key of the enclosing invocation is passed down
+            stack.extend((child, key) for child in reversed(children))
+
+
+def get_invocation_label(key):
+    # makefile chain of an invocation key
+    makefiles = []
+    while key is not None:
+        parent, makefile, for_target, count = key
+        makefiles.append('{}{}'.format(makefile, ' <{}>'.format(for_target) if for_target else ''))
+        key = parent
+    return ' <- '.join(makefiles)
+
+
+class BuildDiff(object):
+    def __init__(self, old, new):
+        self.newly_remade = []  # (key, old summary)
+        self.newly_failed = []
+        self.newly_up_to_date = []
+        self.added_submakes = [key for key in new.invocations if key not in old.invocations]
+        self.removed_submakes = [key for key in old.invocations if key not in new.invocations]
+        self.added_targets = 0
+        self.removed_targets = sum(1 for key in old.targets if key not in new.targets)
+
+        for key, summary in new.targets.items():
+            old_summary = old.targets.get(key)
+            if old_summary is None:
+                self.added_targets += 1
+            if summary == old_summary:
+                continue
+            if summary == TARGET_FAILED:
+                self.newly_failed.append((key, old_summary))
+            elif summary == TARGET_REMADE:
+                self.newly_remade.append((key, old_summary))
+            elif summary == TARGET_UP_TO_DATE and old_summary in (TARGET_REMADE, TARGET_FAILED):
+                self.newly_up_to_date.append((key, old_summary))
+
+    def dump(self):
+        logger = logging.getLogger('DIFF')
+        for title, changes in (('newly failed', self.newly_failed),
+                               ('newly remade', self.newly_remade),
+                               ('newly up to date', self.newly_up_to_date)):
+            buffer = StringIO()
+            buffer.write('{} targets: {}\n'.format(title, len(changes)))
+            for (invocation_key, name), old_summary in changes:
+                buffer.write(INDENTION + '<{}> [{}], was {}\n'.format(
+                    name, invocation_key[1], TARGET_SUMMARY_NAMES[old_summary]))
+            logger.info(buffer.getvalue())
+
+        for title, keys in (('added sub makes', self.added_submakes),
+                            ('removed sub makes', self.removed_submakes)):
+            buffer = StringIO()
+            buffer.write('{}: {}\n'.format(title, len(keys)))
+            for key in keys:
+                buffer.write(INDENTION + '[{}]\n'.format(get_invocation_label(key)))
+            logger.info(buffer.getvalue())
+
+        logger.info('targets added: %d, removed: %d', self.added_targets, self.removed_targets)
+
+
+def diff_builds(old_root, new_root):
+    return BuildDiff(BuildKeys(old_root), BuildKeys(new_root))
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('-T', '--timestamps', action='store_true', default=False)
+    parser.add_argument('-v', '--verbose', default=None)
+    parser.add_argument('old', help='old build log or make database')
+    parser.add_argument('new', help='new build log or make database')
+
+    options = parser.parse_args(argv)
+
+    init_logging(get_verbose_level(options.verbose))
+
+    logger = logging.getLogger('APP')
+    try:
+        old_root = load_build(options.old, options.timestamps, plain=True)
+        new_root = load_build(options.new, options.timestamps, plain=True)
+    except LOAD_BUILD_ERRORS as e:
+        logger.error('%s', e)
+        sys.exit(-1)
+
+    diff_builds(old_root, new_root).dump()
+
+
+if __name__ == '__main__':
+    main()
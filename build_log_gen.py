@@ -0,0 +1,293 @@
+#! /usr/bin/python3
+
+# synthetic "make -d -p" build logs for testing and benchmarking build_log_scan
+#
+# every makefile builds <targets> objects into lib.a, each object depends on its
+# source and <fanout> headers, and recurses into <submakes> sub directories down
+# to <depth> levels. like make without -k, the build stops at the first failed
+# recipe, the failure propagates up through the sub makes.
+#
+#   build_log_gen.py -o build.log --depth 3 --submakes 4 --targets 200 --make-version 3.82
+
+import sys
+import random
+import logging
+import argparse
+import posixpath
+
+from fwtools import init_logging, get_verbose_level
+
+MAKE_VERSIONS = ['3.82', '4.1']
+DB_DATE = 'Mon Jan  1 00:00:00 2024'
+NOISE_LINES = [
+    "{source}: In function 'init':",
+    "{source}:{line}:5: warning: unused variable 'tmp' [-Wunused-variable]",
+    "{source}:{line}:12: warning: implicit declaration of function 'helper' [-Wimplicit-function-declaration]",
+    "{source}:{line}:1: note: in expansion of macro 'CHECK'",
+    "In file included from {source}:{line}:",
+]
+VARIABLE_ORIGINS = ['environment', 'default', 'makefile', 'automatic']
+GENERATOR_OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+
+class LogParams(object):
+    def __init__(self):
+        self.make_version = '4.1'
+        self.depth = 2  # levels of recursive sub makes below the top level make
+        self.submakes = 3  # sub makes invoked by each makefile
+        self.targets = 20  # objects per makefile
+        self.fanout = 4  # header prereqs per object
+        self.headers = 16  # headers per makefile the prereqs are picked from
+        self.remake_rate = 0.5  # fraction of objects out of date
+        self.failure_rate = 0.0  # probability that a recipe fails
+        self.db_variables = 200  # variables per make database dump
+        self.noise = 2.0  # mean recipe output lines per remade object
+        self.root = '/build/src'
+        self.seed = 0
+
+
+class BuildLogGenerator(object):
+    def __init__(self, fp, params):
+        self.fp = fp
+        self.params = params
+        self.random = random.Random(params.seed)
+        self.major = int(params.make_version.split('.')[0])
+        self.quote = '`' if self.major < 4 else "'"  # make 3.x quotes as `name'
+        self.pid = 1000
+        self.lines = 0
+
+    def q(self, name):
+        return "{}{}'".format(self.quote, name)
+
+    def write(self, text):
+        self.fp.write(text)
+        self.fp.write('\n')
+        self.lines += 1
+
+    def write_header(self):
+        if self.major < 4:
+            self.write('# GNU Make {}'.format(self.params.make_version))
+            self.write('# Built for x86_64-unknown-linux-gnu')
+            self.write('# Copyright (C) 2010  Free Software Foundation, Inc.')
+        else:
+            self.write('# GNU Make {}'.format(self.params.make_version))
+            self.write('# Built for x86_64-pc-linux-gnu')
+            self.write('# Copyright (C) 1988-2014 Free Software Foundation, Inc.')
+        self.write('# License GPLv3+: GNU GPL version 3 or later <http://gnu.org/licenses/gpl.html>')
+        self.write('# This is free software: you are free to change and redistribute it.')
+        self.write('# There is NO WARRANTY, to the extent permitted by law.')
+
+    def consider_leaf(self, name, indent):
+        # a source file or header without rule, always up to date
+        self.write('{}Considering target file {}.'.format(' ' * indent, self.q(name)))
+        self.write('{} Looking for an implicit rule for {}.'.format(' ' * indent, self.q(name)))
+        self.write('{} No implicit rule found for {}.'.format(' ' * indent, self.q(name)))
+        self.write('{} Finished prerequisites of target file {}.'.format(' ' * indent, self.q(name)))
+        self.write('{}No need to remake target {}.'.format(' ' * indent, self.q(name)))
+
+    def run_recipe(self, name, recipe, noise=0, source=None):
+        # starts the child process of a recipe, returns its address and PID. the noise
+        # lines are compiler messages about the source
+        self.pid += 1
+        child = '0x{:012x}'.format(0x55d0c0de0000 + self.pid * 0x40)
+        self.write('Putting child {} ({}) PID {} on the chain.'.format(child, name, self.pid))
+        self.write('Live child {} ({}) PID {} '.format(child, name, self.pid))
+        self.write(recipe)
+        for _ in range(noise):
+            self.write(self.random.choice(NOISE_LINES).format(source=source, line=self.random.randint(1, 999)))
+        return child, self.pid
+
+    def finish_recipe(self, name, child, level, makefile_line, failed, status=1):
+        # child is the address and PID returned by run_recipe, a sub make started other
+        # children since
+        child, pid = child
+        if failed:
+            self.write('Reaping losing child {} PID {} '.format(child, pid))
+            self.write('Makefile:{}: recipe for target {} failed'.format(makefile_line, self.q(name)))
+            self.write('make{}: *** [{}] Error {}'.format('[{}]'.format(level - 1) if level > 1 else '', name, status))
+        else:
+            self.write('Reaping winning child {} PID {} '.format(child, pid))
+        self.write('Removing child {} PID {} from chain.'.format(child, pid))
+
+    def get_noise_count(self):
+        # poisson-like number of recipe output lines with the configured mean
+        count = 0
+        mean = self.params.noise
+        while mean > 0:
+            if self.random.random() < min(mean, 1.0):
+                count += 1
+            mean -= 1.0
+        return count
+
+    def invocation(self, level, directory):
+        # one make invocation including its sub makes, returns False if the build failed
+        params = self.params
+        self.write_header()
+        self.write('Reading makefiles...')
+        self.write('Reading makefile {}...'.format(self.q('Makefile')))
+        self.write('Updating makefiles....')
+        self.consider_leaf('Makefile', 1)
+        self.write('Updating goal targets....')
+
+        self.write('Considering target file {}.'.format(self.q('all')))
+        self.write(' File {} does not exist.'.format(self.q('all')))
+        ok = True
+        if level <= params.depth:
+            for n in range(params.submakes):
+                subdir = 'sub{}'.format(n)
+                self.write('  Considering target file {}.'.format(self.q(subdir)))
+                self.write('   File {} does not exist.'.format(self.q(subdir)))
+                self.write('   Finished prerequisites of target file {}.'.format(self.q(subdir)))
+                self.write('  Must remake target {}.'.format(self.q(subdir)))
+                child = self.run_recipe(subdir, 'make -C {}'.format(subdir))
+                ok = self.invocation(level + 1, posixpath.join(directory, subdir))
+                self.finish_recipe(subdir, child, level, 4, not ok, status=2)
+                if not ok:
+                    break
+                self.write('  Successfully remade target file {}.'.format(self.q(subdir)))
+
+        if ok:
+            ok = self.build_library(level)
+        if ok:
+            self.write(' Finished prerequisites of target file {}.'.format(self.q('all')))
+            self.write('Must remake target {}.'.format(self.q('all')))
+            self.write('Successfully remade target file {}.'.format(self.q('all')))
+
+        self.write_database(level, directory)
+        if level > 1:
+            self.write("# make[{}]: Leaving directory '{}'".format(level - 1, directory))
+        return ok
+
+    def build_library(self, level):
+        # returns False if a recipe failed
+        params = self.params
+        self.write(' Considering target file {}.'.format(self.q('lib.a')))
+        headers = ['h{}.h'.format(n) for n in range(params.headers)]
+        considered = set()
+        remade = False
+        for n in range(params.targets):
+            obj = 'f{}.o'.format(n)
+            source = 'f{}.c'.format(n)
+            self.write('  Considering target file {}.'.format(self.q(obj)))
+            self.consider_leaf(source, 3)
+            for header in self.random.sample(headers, min(params.fanout, len(headers))):
+                if header not in considered:
+                    considered.add(header)
+                    self.consider_leaf(header, 3)
+                elif self.major < 4:
+                    self.write('   Considering target file {}.'.format(self.q(header)))
+                    self.write('    File {} was considered already.'.format(self.q(header)))
+                else:
+                    self.write('   Pruning file {}.'.format(self.q(header)))
+            self.write('  Finished prerequisites of target file {}.'.format(self.q(obj)))
+            if self.random.random() >= params.remake_rate:
+                self.write('  Prerequisite {} is older than target {}.'.format(self.q(source), self.q(obj)))
+                self.write('  No need to remake target {}.'.format(self.q(obj)))
+                continue
+
+            self.write('  Must remake target {}.'.format(self.q(obj)))
+            child = self.run_recipe(obj, 'cc -O2 -c {} -o {}'.format(source, obj), self.get_noise_count(),
+                                    source)
+            failed = self.random.random() < params.failure_rate
+            self.finish_recipe(obj, child, level, 8, failed)
+            if failed:
+                return False
+            self.write('  Successfully remade target file {}.'.format(self.q(obj)))
+            remade = True
+
+        self.write(' Finished prerequisites of target file {}.'.format(self.q('lib.a')))
+        if remade:
+            self.write(' Must remake target {}.'.format(self.q('lib.a')))
+            child = self.run_recipe('lib.a', 'ar rcs lib.a')
+            self.finish_recipe('lib.a', child, level, 6, False)
+            self.write(' Successfully remade target file {}.'.format(self.q('lib.a')))
+        else:
+            self.write(' No need to remake target {}.'.format(self.q('lib.a')))
+        return True
+
+    def write_database(self, level, directory):
+        params = self.params
+        self.write('')
+        self.write('# Make data base, printed on {}'.format(DB_DATE))
+        self.write('')
+        self.write('# Variables')
+        self.write('')
+        for n in range(params.db_variables):
+            self.write('# {}'.format(VARIABLE_ORIGINS[n % len(VARIABLE_ORIGINS)]))
+            self.write('VAR_{} = value_{} $(CC) -O{}'.format(n, n, n % 4))
+        self.write("# makefile (from {}, line 1)".format(self.q('Makefile')))
+        self.write('CFLAGS = -O2 -DLEVEL={}'.format(level))
+        self.write('# makefile')
+        self.write('.DEFAULT_GOAL := all')
+        self.write('# makefile')
+        self.write('CURDIR := {}'.format(directory))
+        self.write('# variable set hash-table stats:')
+        self.write('# Load={}/1024=1%, Rehash=0, Collisions=0/{}=0%'.format(params.db_variables, params.db_variables))
+        self.write('')
+        self.write('# Files')
+        self.write('')
+        for n in range(params.targets):
+            self.write('f{}.o: f{}.c'.format(n, n))
+            self.write('#  Implicit rule search has been done.')
+            self.write('#  File has been updated.')
+            self.write("#  recipe to execute (from {}, line 8):".format(self.q('Makefile')))
+            self.write('\tcc -O2 -c $< -o $@')
+            self.write('')
+        self.write('# files hash-table stats:')
+        self.write('# Finished Make data base on {}'.format(DB_DATE))
+        self.write('')
+
+    def generate(self):
+        self.invocation(1, self.params.root)
+        return self.lines
+
+
+def generate_build_log(log_file, params):
+    # returns the number of lines written
+    with open(log_file, 'w', buffering=GENERATOR_OUTPUT_BUFFER_SIZE) as fp:
+        return BuildLogGenerator(fp, params).generate()
+
+
+def add_generator_arguments(parser):
+    defaults = LogParams()
+    parser.add_argument('--make-version', choices=MAKE_VERSIONS, default=defaults.make_version)
+    parser.add_argument('--depth', type=int, default=defaults.depth)
+    parser.add_argument('--submakes', type=int, default=defaults.submakes)
+    parser.add_argument('--targets', type=int, default=defaults.targets)
+    parser.add_argument('--fanout', type=int, default=defaults.fanout)
+    parser.add_argument('--headers', type=int, default=defaults.headers)
+    parser.add_argument('--remake-rate', type=float, default=defaults.remake_rate)
+    parser.add_argument('--failure-rate', type=float, default=defaults.failure_rate)
+    parser.add_argument('--db-variables', type=int, default=defaults.db_variables)
+    parser.add_argument('--noise', type=float, default=defaults.noise)
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+
+
+def get_generator_params(options):
+    params = LogParams()
+    for name in ('make_version', 'depth', 'submakes', 'targets', 'fanout', 'headers', 'remake_rate',
+                 'failure_rate', 'db_variables', 'noise', 'seed'):
+        setattr(params, name, getattr(options, name))
+    return params
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('-o', '--output', default=None)
+    parser.add_argument('-v', '--verbose', default=None)
+    add_generator_arguments(parser)
+
+    options = parser.parse_args(argv)
+
+    init_logging(get_verbose_level(options.verbose))
+
+    logger = logging.getLogger('APP')
+    if not options.output:
+        logger.error('no output file specified')
+        sys.exit(-1)
+    lines = generate_build_log(options.output, get_generator_params(options))
+    logger.info('%d lines written to <%s>', lines, options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+#! /usr/bin/python3
+
+# dependency graph of a scanned build
+#
+# the make tree of build_log_scan has a separate node for every time a target is
+# considered. here all occurrences of (makefile directory, target) are merged into
+# one node of a DAG. edges are "target -> prereq" and "target -> goal of a submake
+# invoked for the target". adjacency is kept in compressed arrays (offsets + targets)
+# for both directions, so transitive queries and exports scale to millions of edges.
+
+import re
+import sys
+import array
+import logging
+import argparse
+import posixpath
+from xml.sax.saxutils import escape
+
+from fwtools import init_logging, get_verbose_level
+from build_log_scan import MTST_REMAKE_FAILED, LOAD_BUILD_ERRORS, load_build, iter_make_targets
+
+EDGE_PREREQ = 0
+EDGE_SUBMAKE = 1
+
+GRAPH_FORMATS = ['dot', 'graphml']
+
+
+def get_target_key(target):
+    return posixpath.dirname(target.invocation.get_makefile()), target.name
+
+
+class CompressedAdjacency(object):
+    # edges of each node are targets[offsets[node]:offsets[node + 1]]
+    def __init__(self, node_count, sources, targets):
+        counts = array.array('l', bytes(array.array('l').itemsize * (node_count + 1)))
+        for src in sources:
+            counts[src + 1] += 1
+        for node in range(node_count):
+            counts[node + 1] += counts[node]
+        self.offsets = counts
+
+        fill = array.array('l', counts)
+        self.targets = array.array('l', bytes(array.array('l').itemsize * len(sources)))
+        self.edges = array.array('l', self.targets)  # edge number of each entry
+        for edge, (src, dst) in enumerate(zip(sources, targets)):
+            pos = fill[src]
+            self.targets[pos] = dst
+            self.edges[pos] = edge
+            fill[src] = pos + 1
+
+    def remove_duplicates(self):
+        # sorts the edges of each node by target and keeps the first edge to each target,
+        # returns the edge numbers kept, in the new order of the entries
+        offsets = self.offsets
+        targets = self.targets
+        edges = self.edges
+        pos = 0
+        start = 0
+        for node in range(len(offsets) - 1):
+            end = offsets[node + 1]
+            if end - start > 1:
+                last = -1
+                for dst, edge in sorted(zip(targets[start:end], edges[start:end])):
+                    if dst != last:
+                        targets[pos] = dst
+                        edges[pos] = edge
+                        pos += 1
+                        last = dst
+            elif end > start:
+                targets[pos] = targets[start]
+                edges[pos] = edges[start]
+                pos += 1
+            offsets[node + 1] = pos
+            start = end
+        del targets[pos:]
+        del edges[pos:]
+        kept = array.array('l', edges)
+        for idx in range(pos):
+            edges[idx] = idx
+        return kept
+
+    def neighbors(self, node):
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+
+class DependencyGraph(object):
+    def __init__(self):
+        self.keys = {}  # (makefile dir, target) -> node
+        self.node_dirs = []
+        self.node_names = []
+        self.node_failed = bytearray()  # target failed in at least one occurrence
+        self.edge_sources = array.array('l')
+        self.edge_targets = array.array('l')
+        self.edge_kinds = array.array('b')
+        self.forward = None  # type: CompressedAdjacency
+        self.reverse = None  # type: CompressedAdjacency
+
+    def get_node(self, key):
+        node = self.keys.get(key)
+        if node is None:
+            node = len(self.node_names)
+            self.keys[key] = node
+            self.node_dirs.append(key[0])
+            self.node_names.append(key[1])
+            self.node_failed.append(0)
+        return node
+
+    def add_make_tree(self, mkdb):
+        for target in iter_make_targets(mkdb):
+            node = self.get_node(get_target_key(target))
+            if target.state == MTST_REMAKE_FAILED:
+                self.node_failed[node] = 1
+
+            children = [(prereq, EDGE_PREREQ) for prereq in target.prereqs]
+            for submake in target.submakes:
+                children.extend((goal, EDGE_SUBMAKE) for goal in submake.targets)
+            for child, kind in children:
+                child_node = self.get_node(get_target_key(child))
+                if child_node != node:
+                    self.edge_sources.append(node)
+                    self.edge_targets.append(child_node)
+                    self.edge_kinds.append(kind)
+
+        # a target considered several times, or a prereq listed twice, repeats edges.
+        # they are removed in the adjacency arrays, the edges are renumbered in their order
+        self.forward = CompressedAdjacency(len(self.node_names), self.edge_sources, self.edge_targets)
+        kept = self.forward.remove_duplicates()
+        self.edge_sources = array.array('l', (self.edge_sources[edge] for edge in kept))
+        self.edge_targets = array.array('l', self.forward.targets)
+        self.edge_kinds = array.array('b', (self.edge_kinds[edge] for edge in kept))
+        self.reverse = CompressedAdjacency(len(self.node_names), self.edge_targets, self.edge_sources)
+
+    def get_node_count(self):
+        return len(self.node_names)
+
+    def get_edge_count(self):
+        return len(self.edge_sources)
+
+    def get_label(self, node):
+        if self.node_dirs[node]:
+            return '{}:{}'.format(self.node_dirs[node], self.node_names[node])
+        return self.node_names[node]
+
+    def find_nodes(self, pattern):
+        # nodes whose "dir:name" label matches
+        return [node for node in range(len(self.node_names)) if pattern.search(self.get_label(node))]
+
+    def closure(self, nodes, reverse=False):
+        # nodes reachable from nodes (included), breadth first.
+        # forward: everything the nodes depend on, reverse: everything that pulled them in
+        adjacency = self.reverse if reverse else self.forward
+        offsets = adjacency.offsets
+        targets = adjacency.targets
+        visited = bytearray(len(self.node_names))
+        queue = []
+        for node in nodes:
+            if not visited[node]:
+                visited[node] = 1
+                queue.append(node)
+        pos = 0
+        while pos < len(queue):
+            node = queue[pos]
+            pos += 1
+            for idx in range(offsets[node], offsets[node + 1]):
+                child = targets[idx]
+                if not visited[child]:
+                    visited[child] = 1
+                    queue.append(child)
+        return queue
+
+    def iter_edges(self, nodes=None):
+        # (source, target, kind) of all edges, or of the edges between the given nodes
+        if nodes is None:
+            yield from zip(self.edge_sources, self.edge_targets, self.edge_kinds)
+            return
+        selected = bytearray(len(self.node_names))
+        for node in nodes:
+            selected[node] = 1
+        for node in nodes:
+            offsets = self.forward.offsets
+            for idx in range(offsets[node], offsets[node + 1]):
+                child = self.forward.targets[idx]
+                if selected[child]:
+                    yield node, child, self.edge_kinds[self.forward.edges[idx]]
+
+    def write_dot(self, fp, nodes=None):
+        if nodes is None:
+            nodes = range(len(self.node_names))
+        fp.write('digraph make {\n')
+        for node in nodes:
+            fp.write('  n{} [label={}{}];\n'.format(
+                node, quote_dot(self.get_label(node)), ', color=red' if self.node_failed[node] else ''))
+        for src, dst, kind in self.iter_edges(nodes if not isinstance(nodes, range) else None):
+            fp.write('  n{} -> n{}{};\n'.format(src, dst, ' [style=dashed]' if kind == EDGE_SUBMAKE else ''))
+        fp.write('}\n')
+
+    def write_graphml(self, fp, nodes=None):
+        if nodes is None:
+            nodes = range(len(self.node_names))
+        fp.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+                 '  <key id="dir" for="node" attr.name="dir" attr.type="string"/>\n'
+                 '  <key id="name" for="node" attr.name="name" attr.type="string"/>\n'
+                 '  <key id="failed" for="node" attr.name="failed" attr.type="boolean"/>\n'
+                 '  <key id="kind" for="edge" attr.name="kind" attr.type="string"/>\n'
+                 '  <graph id="make" edgedefault="directed">\n')
+        for node in nodes:
+            fp.write('    <node id="n{}"><data key="dir">{}</data><data key="name">{}</data>'
+                     '<data key="failed">{}</data></node>\n'.format(
+                         node, escape(self.node_dirs[node]), escape(self.node_names[node]),
+                         'true' if self.node_failed[node] else 'false'))
+        for src, dst, kind in self.iter_edges(nodes if not isinstance(nodes, range) else None):
+            fp.write('    <edge source="n{}" target="n{}"><data key="kind">{}</data></edge>\n'.format(
+                src, dst, 'submake' if kind == EDGE_SUBMAKE else 'prereq'))
+        fp.write('  </graph>\n'
+                 '</graphml>\n')
+
+
+def quote_dot(text):
+    return '"{}"'.format(text.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def build_dependency_graph(mkdb):
+    graph = DependencyGraph()
+    graph.add_make_tree(mkdb)
+    return graph
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('-l', '--log', default=None)
+    parser.add_argument('-L', '--load', default=None)
+    parser.add_argument('-t', '--target', default=None)
+    parser.add_argument('-r', '--reverse', action='store_true', default=False)
+    parser.add_argument('-o', '--output', default=None)
+    parser.add_argument('-F', '--format', choices=GRAPH_FORMATS, default='dot')
+    parser.add_argument('-v', '--verbose', default=None)
+
+    options = parser.parse_args(argv)
+
+    init_logging(get_verbose_level(options.verbose))
+
+    logger = logging.getLogger('APP')
+    if not options.log and not options.load:
+        logger.error('no build log or make database file specified')
+        sys.exit(-1)
+    try:
+        mk = load_build(options.log or options.load)
+    except LOAD_BUILD_ERRORS as e:
+        logger.error('%s', e)
+        sys.exit(-1)
+
+    graph = build_dependency_graph(mk)
+    logger.info('dependency graph: %d nodes, %d edges', graph.get_node_count(), graph.get_edge_count())
+
+    nodes = None
+    if options.target:
+        start = graph.find_nodes(re.compile(options.target))
+        if not start:
+            logger.error('no target matches <%s>', options.target)
+            sys.exit(-1)
+        nodes = graph.closure(start, options.reverse)
+        if not options.output:
+            for node in nodes:
+                sys.stdout.write(graph.get_label(node))
+                sys.stdout.write('\n')
+
+    if options.output:
+        with open(options.output, 'w', buffering=1024 * 1024) as fp:
+            if options.format == 'graphml':
+                graph.write_graphml(fp, nodes)
+            else:
+                graph.write_dot(fp, nodes)
+        logger.info('dependency graph saved to <%s>', options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,380 @@
+#! /usr/bin/python3
+
+# build log access for build_log_scan, plain or compressed (gzip, xz, zstd)
+#
+# compressed logs are decompressed in a separate thread which feeds complete
+# lines to the scanner through a bounded queue. while decompressing, the start
+# of every gzip member / xz stream / zstd frame is recorded in a seek index,
+# so byte ranges (e.g. make database dumps) can be read back without
+# decompressing the log from the beginning. logs archived by compress_build_log()
+# consist of many small members and are therefore cheap to seek in.
+
+import os, sys
+import io
+import json
+import bisect
+import queue
+import threading
+import zlib
+import lzma
+import gzip
+import logging
+import argparse
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from fwtools import init_logging
+
+LOG_FORMAT_PLAIN = 'plain'
+LOG_FORMAT_GZIP = 'gzip'
+LOG_FORMAT_XZ = 'xz'
+LOG_FORMAT_ZSTD = 'zstd'
+
+LOG_FORMAT_MAGICS = [
+    (b'\x1f\x8b', LOG_FORMAT_GZIP),
+    (b'\xfd7zXZ\x00', LOG_FORMAT_XZ),
+    (b'\x28\xb5\x2f\xfd', LOG_FORMAT_ZSTD),
+]
+
+LOG_FORMAT_SUFFIXES = {
+    '.gz': LOG_FORMAT_GZIP,
+    '.xz': LOG_FORMAT_XZ,
+    '.zst': LOG_FORMAT_ZSTD,
+}
+
+READ_SIZE = 256 * 1024  # compressed bytes per read
+QUEUE_SIZE = 16  # decompressed chunks buffered between the threads
+DEFAULT_MEMBER_SIZE = 4 * 1024 * 1024  # uncompressed bytes per member when archiving
+
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+
+
+class BuildLogFormatError(RuntimeError):
+    pass
+
+
+def get_build_log_format(log_file):
+    with open(log_file, 'rb') as fp:
+        magic = fp.read(8)
+    for prefix, log_format in LOG_FORMAT_MAGICS:
+        if magic.startswith(prefix):
+            return log_format
+    return LOG_FORMAT_PLAIN
+
+
+def new_decompressor(log_format):
+    if log_format == LOG_FORMAT_GZIP:
+        return zlib.decompressobj(wbits=31)
+    elif log_format == LOG_FORMAT_XZ:
+        return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+    elif log_format == LOG_FORMAT_ZSTD:
+        if zstandard is None:
+            raise BuildLogFormatError('python module <zstandard> is required for zstd compressed build logs')
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise BuildLogFormatError('unsupported build log format <%s>' % log_format)
+
+
+def compress_member(log_format, data):
+    if log_format == LOG_FORMAT_GZIP:
+        return gzip.compress(data, mtime=0)
+    elif log_format == LOG_FORMAT_XZ:
+        return lzma.compress(data, format=lzma.FORMAT_XZ)
+    elif log_format == LOG_FORMAT_ZSTD:
+        if zstandard is None:
+            raise BuildLogFormatError('python module <zstandard> is required for zstd compressed build logs')
+        return zstandard.ZstdCompressor().compress(data)
+    raise BuildLogFormatError('unsupported build log format <%s>' % log_format)
+
+
+def iter_decompressed(fp, log_format, offsets=(0, 0), members=None):
+    # decompress from the member starting at offsets (uncompressed, compressed),
+    # fp must be positioned there. the start of each member is appended to members
+    uncompressed_pos, compressed_pos = offsets
+    decompressor = None
+    while True:
+        data = fp.read(READ_SIZE)
+        if not data:
+            break
+        while data:
+            if decompressor is None:
+                # zero padding between or after members
+                stripped = data.lstrip(b'\x00')
+                compressed_pos += len(data) - len(stripped)
+                data = stripped
+                if not data:
+                    break
+                decompressor = new_decompressor(log_format)
+                if members is not None:
+                    members.append((uncompressed_pos, compressed_pos))
+
+            out = decompressor.decompress(data)
+            if out:
+                uncompressed_pos += len(out)
+                yield out
+
+            if decompressor.eof:
+                unused = decompressor.unused_data
+                compressed_pos += len(data) - len(unused)
+                data = unused
+                decompressor = None
+            else:
+                compressed_pos += len(data)
+                data = b''
+
+    if decompressor is not None:
+        raise BuildLogFormatError('unexpected end of compressed build log')
+
+
+class BuildLogIndex(object):
+    # seek index of a compressed build log: (uncompressed, compressed) offsets of member starts
+    def __init__(self, log_file, log_format, members):
+        self.log_file = log_file
+        self.log_format = log_format
+        self.members = members
+        self.starts = [member[0] for member in members]
+
+    def locate(self, offset):
+        # offsets of the member containing the uncompressed offset
+        idx = bisect.bisect_right(self.starts, offset) - 1
+        if idx < 0:
+            return 0, 0
+        return self.members[idx]
+
+    def save(self):
+        stat = os.stat(self.log_file)
+        try:
+            with open(self.log_file + INDEX_SUFFIX, 'w') as fp:
+                json.dump({
+                    'version': INDEX_VERSION,
+                    'format': self.log_format,
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime_ns,
+                    'members': self.members
+                }, fp)
+        except OSError:
+            # the archive directory may be read-only, the index is kept in memory then
+            logging.getLogger('BUILD_LOG').debug('unable to save seek index for <%s>', self.log_file)
+
+    @staticmethod
+    def load(log_file):
+        try:
+            with open(log_file + INDEX_SUFFIX) as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        stat = os.stat(log_file)
+        if data.get('version') != INDEX_VERSION or \
+                data.get('size') != stat.st_size or data.get('mtime') != stat.st_mtime_ns:
+            return None
+        return BuildLogIndex(log_file, data['format'], [tuple(member) for member in data['members']])
+
+    @staticmethod
+    def build(log_file, log_format):
+        members = []
+        with open(log_file, 'rb') as fp:
+            for _ in iter_decompressed(fp, log_format, members=members):
+                pass
+        return BuildLogIndex(log_file, log_format, members)
+
+
+# seek indexes of compressed build logs seen by this process
+BUILD_LOG_INDEXES = {}
+BUILD_LOG_INDEXES_LOCK = threading.Lock()
+
+
+def get_build_log_index(log_file, log_format=None):
+    log_file = os.path.abspath(log_file)
+    with BUILD_LOG_INDEXES_LOCK:
+        index = BUILD_LOG_INDEXES.get(log_file)
+    if index is None:
+        index = BuildLogIndex.load(log_file)
+        if index is None:
+            index = BuildLogIndex.build(log_file, log_format or get_build_log_format(log_file))
+            index.save()
+        with BUILD_LOG_INDEXES_LOCK:
+            BUILD_LOG_INDEXES[log_file] = index
+    return index
+
+
+class DecompressingLineReader(object):
+    # decompresses a build log in a separate thread, lines are handed over in
+    # batches through a bounded queue so decompression and scanning overlap
+    def __init__(self, log_file, log_format, offset=0):
+        self.log_file = os.path.abspath(log_file)
+        self.log_format = log_format
+        self.offset = offset
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._decompress, name='decompress', daemon=True)
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decompress(self):
+        try:
+            if self.offset > 0:
+                index = get_build_log_index(self.log_file, self.log_format)
+                start = index.locate(self.offset)
+                members = None
+            else:
+                start = (0, 0)
+                members = []
+
+            skip = self.offset - start[0]
+            pending = b''
+            with open(self.log_file, 'rb') as fp:
+                fp.seek(start[1])
+                for chunk in iter_decompressed(fp, self.log_format, start, members):
+                    if skip:
+                        if len(chunk) <= skip:
+                            skip -= len(chunk)
+                            continue
+                        chunk = chunk[skip:]
+                        skip = 0
+                    if pending:
+                        chunk = pending + chunk
+                    end = chunk.rfind(b'\n') + 1
+                    pending = chunk[end:]
+                    if end and not self._put(list(io.BytesIO(chunk[:end]))):
+                        return
+                if pending and not self._put([pending]):
+                    return
+
+            if members is not None:
+                # a complete pass, keep the seek index for later range reads
+                index = BuildLogIndex(self.log_file, self.log_format, members)
+                index.save()
+                with BUILD_LOG_INDEXES_LOCK:
+                    BUILD_LOG_INDEXES[self.log_file] = index
+            self._put(None)
+        except BaseException as e:
+            self._put(e)
+
+    def __iter__(self):
+        self.thread.start()
+        try:
+            while True:
+                lines = self.queue.get()
+                if lines is None:
+                    break
+                if isinstance(lines, BaseException):
+                    raise lines
+                yield from lines
+        finally:
+            self.stopped.set()
+
+
+def iter_build_log_lines(log_file, offset=0):
+    # raw lines (bytes, with line ending) of a build log from an uncompressed byte offset
+    log_format = get_build_log_format(log_file)
+    if log_format == LOG_FORMAT_PLAIN:
+        with open(log_file, 'rb') as fp:
+            fp.seek(offset)
+            yield from fp
+    else:
+        yield from DecompressingLineReader(log_file, log_format, offset)
+
+
+def read_build_log_range(log_file, start, end):
+    # bytes [start, end) of the uncompressed build log
+    log_format = get_build_log_format(log_file)
+    if log_format == LOG_FORMAT_PLAIN:
+        with open(log_file, 'rb') as fp:
+            fp.seek(start)
+            return fp.read(end - start)
+
+    index = get_build_log_index(log_file, log_format)
+    member = index.locate(start)
+    buffer = io.BytesIO()
+    with open(log_file, 'rb') as fp:
+        fp.seek(member[1])
+        pos = member[0]
+        for chunk in iter_decompressed(fp, log_format, member):
+            chunk_end = pos + len(chunk)
+            if chunk_end > start:
+                buffer.write(chunk[max(0, start - pos):end - pos])
+            pos = chunk_end
+            if pos >= end:
+                break
+    return buffer.getvalue()
+
+
+def compress_build_log(log_file, archive_file, log_format=None, member_size=DEFAULT_MEMBER_SIZE):
+    # compress a build log as a sequence of independent members, so that
+    # the archive stays seekable for read_build_log_range()
+    if log_format is None:
+        suffix = os.path.splitext(archive_file)[1]
+        if suffix not in LOG_FORMAT_SUFFIXES:
+            raise BuildLogFormatError('unknown archive suffix <%s>' % suffix)
+        log_format = LOG_FORMAT_SUFFIXES[suffix]
+
+    members = []
+    uncompressed_pos = 0
+    with open(log_file, 'rb') as infp, open(archive_file, 'wb') as outfp:
+        while True:
+            data = infp.read(member_size)
+            if not data:
+                break
+            members.append((uncompressed_pos, outfp.tell()))
+            outfp.write(compress_member(log_format, data))
+            uncompressed_pos += len(data)
+
+    index = BuildLogIndex(os.path.abspath(archive_file), log_format, members)
+    index.save()
+    return index
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('-a', '--action', default=None)
+    parser.add_argument('-i', '--input', default=None)
+    parser.add_argument('-o', '--output', default=None)
+    parser.add_argument('-m', '--member-size', type=int, default=DEFAULT_MEMBER_SIZE)
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+
+    options = parser.parse_args(argv)
+
+    init_logging(logging.DEBUG if options.verbose else logging.INFO)
+    logger = logging.getLogger('MAIN')
+
+    if not options.input or not os.path.isfile(options.input):
+        logger.error('please specify an existing build log')
+        sys.exit(-1)
+
+    try:
+        if options.action == 'compress':
+            if not options.output:
+                logger.error('please specify the archive file name')
+                sys.exit(-1)
+            index = compress_build_log(options.input, options.output, member_size=options.member_size)
+            logger.info('build log archived to <%s>, %d members', options.output, len(index.members))
+
+        elif options.action == 'index':
+            log_format = get_build_log_format(options.input)
+            if log_format == LOG_FORMAT_PLAIN:
+                logger.info('<%s> is not compressed, no index needed', options.input)
+                sys.exit(0)
+            index = BuildLogIndex.build(os.path.abspath(options.input), log_format)
+            index.save()
+            logger.info('seek index of <%s>: %d members', options.input, len(index.members))
+
+        else:
+            logger.error('unknown action <%s>', options.action)
+            sys.exit(-1)
+    except BuildLogFormatError as e:
+        logger.error('%s', e)
+        sys.exit(-1)
+
+
+if __name__ == '__main__':
+    main()
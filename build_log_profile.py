@@ -0,0 +1,226 @@
+#! /usr/bin/python3
+
+# build profile from a time stamped build log, e.g. "make -d -p 2>&1 | ts '%.s' > build.log"
+#
+# - self time of a target: its duration minus the time covered by its prereqs and submakes
+# - critical path: the chain of prereqs/submakes from the top level make with the largest
+#   sum of self times, i.e. the shortest possible build time with unlimited parallelism
+# - parallelism per make level: self times of all targets of the level divided by
+#   the wall clock time the make invocations of the level were running while no
+#   deeper submake was, the time of nested submakes belongs to their own level
+
+import sys
+import heapq
+import logging
+import argparse
+from io import StringIO
+
+from fwtools import init_logging, get_verbose_level
+from build_log_scan import MakeInvocation, MakeTarget, LOAD_BUILD_ERRORS, get_make_target_state, \
+    load_build, iter_make_invocations, iter_make_targets, INDENTION
+
+DEFAULT_TOP_COUNT = 20
+
+
+def get_children(node):
+    if isinstance(node, MakeInvocation):
+        return node.targets + node.submakes
+    return node.prereqs + node.submakes
+
+
+def get_interval(node):
+    if node.start_time is None or node.end_time is None or node.end_time < node.start_time:
+        return None
+    return node.start_time, node.end_time
+
+
+def get_covered_time(intervals, start, end):
+    # total length of the union of intervals, clipped to [start, end]
+    covered = 0.0
+    covered_end = start
+    for child_start, child_end in sorted(intervals):
+        child_start = max(child_start, covered_end)
+        child_end = min(child_end, end)
+        if child_end > child_start:
+            covered += child_end - child_start
+            covered_end = child_end
+    return covered
+
+
+def iter_post_order(root):
+    # invocations and targets, children before their parent, without recursion
+    stack = [(root, False)]
+    while stack:
+        node, leaving = stack.pop()
+        if leaving:
+            yield node
+            continue
+        stack.append((node, True))
+        stack.extend((child, False) for child in reversed(get_children(node)))
+
+
+class BuildProfile(object):
+    def __init__(self, root):
+        self.root = root
+        self.self_times = {}  # id(node) -> self time
+        self.path_times = {}  # id(node) -> self time of the heaviest chain below and including node
+        self.path_next = {}  # id(node) -> next node on that chain
+        self.intervals = {}  # id(node) -> (start, end), spanning the children if not finished
+        self.nodes = {}  # id(node) -> node
+
+        for node in iter_post_order(root):
+            self.nodes[id(node)] = node
+            children = get_children(node)
+            child_intervals = [self.intervals[id(child)] for child in children
+                               if id(child) in self.intervals]
+
+            interval = get_interval(node)
+            if interval is not None:
+                self_time = interval[1] - interval[0] - get_covered_time(child_intervals, *interval)
+                self.intervals[id(node)] = interval
+            else:
+                # e.g. a goal whose prereq failed, it has no end time
+                self_time = 0.0
+                if child_intervals:
+                    self.intervals[id(node)] = (min(i[0] for i in child_intervals),
+                                                max(i[1] for i in child_intervals))
+            self.self_times[id(node)] = self_time
+
+            heaviest = None
+            for child in children:
+                if heaviest is None or self.path_times[id(child)] > self.path_times[id(heaviest)]:
+                    heaviest = child
+            if heaviest is not None:
+                self.path_times[id(node)] = self_time + self.path_times[id(heaviest)]
+                self.path_next[id(node)] = heaviest
+            else:
+                self.path_times[id(node)] = self_time
+
+    def has_timestamps(self):
+        return get_interval(self.root) is not None or \
+            any(get_interval(target) is not None for target in iter_make_targets(self.root))
+
+    def get_critical_path(self):
+        path = []
+        node = self.root
+        while node is not None:
+            path.append(node)
+            node = self.path_next.get(id(node))
+        return path
+
+    def get_top_targets(self, count):
+        targets = (node for node in self.nodes.values() if isinstance(node, MakeTarget))
+        return heapq.nlargest(count, targets, key=lambda target: self.self_times[id(target)])
+
+    def get_level_parallelism(self):
+        # level -> (busy time, wall clock time, number of invocations)
+        busy = {}
+        intervals = {}
+        counts = {}
+        for invocation in iter_make_invocations(self.root):
+            level = invocation.level
+            counts[level] = counts.get(level, 0) + 1
+            busy.setdefault(level, 0.0)
+            interval = get_interval(invocation)
+            if interval is not None:
+                intervals.setdefault(level, []).append(interval)
+        for node in self.nodes.values():
+            if isinstance(node, MakeTarget):
+                busy[node.invocation.level] += self.self_times[id(node)]
+
+        # wall clock time of a level: covered by the level or deeper ones minus
+        # covered by deeper ones, i.e. the level runs and none of its submakes
+        levels = {}
+        deeper_intervals = []
+        deeper_covered = 0.0
+        for level in sorted(counts, reverse=True):
+            deeper_intervals.extend(intervals.get(level, []))
+            if deeper_intervals:
+                start = min(i[0] for i in deeper_intervals)
+                end = max(i[1] for i in deeper_intervals)
+                covered = get_covered_time(deeper_intervals, start, end)
+            else:
+                covered = 0.0
+            levels[level] = (busy[level], covered - deeper_covered, counts[level])
+            deeper_covered = covered
+        return dict(sorted(levels.items()))
+
+
+def get_node_name(node):
+    if isinstance(node, MakeInvocation):
+        return 'make [{}]'.format(node.get_makefile())
+    return '<{}> ({})'.format(node.name, node.invocation.get_makefile())
+
+
+def format_seconds(seconds):
+    return '{:,.3f}s'.format(seconds)
+
+
+def dump_profile(profile, top_count=DEFAULT_TOP_COUNT):
+    logger = logging.getLogger('PROFILE')
+
+    root_interval = get_interval(profile.root)
+    buffer = StringIO()
+    if root_interval is not None:
+        buffer.write('build time: {}\n'.format(format_seconds(root_interval[1] - root_interval[0])))
+    buffer.write('critical path: {}\n'.format(format_seconds(profile.path_times[id(profile.root)])))
+    for node in profile.get_critical_path():
+        level = node.level if isinstance(node, MakeInvocation) else node.invocation.level
+        buffer.write(INDENTION * level)
+        buffer.write('{}, self time {}'.format(get_node_name(node),
+                                               format_seconds(profile.self_times[id(node)])))
+        if isinstance(node, MakeTarget):
+            buffer.write(', state {}'.format(get_make_target_state(node)))
+        buffer.write('\n')
+    logger.info(buffer.getvalue())
+
+    buffer = StringIO()
+    buffer.write('top {} targets by self time:\n'.format(top_count))
+    for target in profile.get_top_targets(top_count):
+        buffer.write(INDENTION)
+        buffer.write('{} {}, state {}\n'.format(format_seconds(profile.self_times[id(target)]),
+                                                get_node_name(target), get_make_target_state(target)))
+    logger.info(buffer.getvalue())
+
+    buffer = StringIO()
+    buffer.write('parallelism per make level:\n')
+    for level, (busy, wall, count) in profile.get_level_parallelism().items():
+        buffer.write(INDENTION)
+        buffer.write('level {}: {} invocations, target time {}, wall time {}'.format(
+            level, count, format_seconds(busy), format_seconds(wall)))
+        if wall > 0:
+            buffer.write(', parallelism {:.2f}'.format(busy / wall))
+        buffer.write('\n')
+    logger.info(buffer.getvalue())
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('-l', '--log', default=None)
+    parser.add_argument('-L', '--load', default=None)
+    parser.add_argument('-n', '--top', type=int, default=DEFAULT_TOP_COUNT)
+    parser.add_argument('-v', '--verbose', default=None)
+
+    options = parser.parse_args(argv)
+
+    init_logging(get_verbose_level(options.verbose))
+
+    logger = logging.getLogger('APP')
+    if not options.log and not options.load:
+        logger.error('no build log or make database file specified')
+        sys.exit(-1)
+    try:
+        mk = load_build(options.log or options.load, timestamps=True)
+    except LOAD_BUILD_ERRORS as e:
+        logger.error('%s', e)
+        sys.exit(-1)
+
+    profile = BuildProfile(mk)
+    if not profile.has_timestamps():
+        logger.error('no time stamps found, please prefix the build log lines with time stamps')
+        sys.exit(-1)
+    dump_profile(profile, options.top)
+
+
+if __name__ == '__main__':
+    main()
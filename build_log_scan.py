@@ -4,27 +4,80 @@
 # - collect build logs, separate them from make database dup
 
 import re
-from io import StringIO
+from io import StringIO, BytesIO
 import logging
 import argparse
 import sys, os
-import pickle
+import sqlite3
+import urllib.parse
 import posixpath
+import bisect
+import weakref
+import json
+import time
+import zlib
+import calendar
+import functools
+import mmap
+from array import array
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from fwtools import LogWithIndent, init_logging, get_verbose_level, VERBOSE_LEVEL, DEFAULT_VERBOSE_LEVEL
+from build_log_io import BuildLogFormatError, LOG_FORMAT_PLAIN, get_build_log_format, \
+    iter_build_log_lines, read_build_log_range
 
 MK_DB_PRINT_BEGIN = '# Make data base, printed on'
 MK_DB_PRINT_END = '# Finished Make data base on'
 DEFAULT_GOAL_PATTERN = re.compile(r'\.DEFAULT_GOAL[ \t]*.?=[ \t]*(?P<target>[a-zA-Z0-9\-_.]+)')
-CONSIDERING_PATTERN = re.compile(r"(?P<indent>[ ]*)Considering target file '(?P<target>.*)'\.[ \t]*$")
-MUST_REMAKE_PATTERN = re.compile(r"(?P<indent>[ ]*)Must remake target '(?P<target>.*)'\.[ \t]*$")
-FINISH_PREREQ_PATTERN = re.compile(r"(?P<indent>[ ]*)Finished prerequisites of target file '(?P<target>.*)'\.[ \t]*$")
-TARGET_REMADE_PATTER = re.compile(r"(?P<indent>[ ]*)Successfully remade target file '(?P<target>.*)'\.[ \t]*$")
-NO_NEED_REMAKE_PATTERN = re.compile(r"(?P<indent>[ ]*)No need to remake target '(?P<target>[^']*)'[.;]")
+CONSIDERING_PATTERN = re.compile(r"(?P<indent>[ ]*)Considering target file [`'](?P<target>.*)'\.[ \t]*$")
+MUST_REMAKE_PATTERN = re.compile(r"(?P<indent>[ ]*)Must remake target [`'](?P<target>.*)'\.[ \t]*$")
+FINISH_PREREQ_PATTERN = re.compile(r"(?P<indent>[ ]*)Finished prerequisites of target file [`'](?P<target>.*)'\.[ \t]*$")
+TARGET_REMADE_PATTER = re.compile(r"(?P<indent>[ ]*)Successfully remade target file [`'](?P<target>.*)'\.[ \t]*$")
+NO_NEED_REMAKE_PATTERN = re.compile(r"(?P<indent>[ ]*)No need to remake target [`'](?P<target>[^']*)'[.;]")
 SUB_MAKE_PATTERN = re.compile(r"^# GNU Make [34](\.[0-9]+)?[ \t]*$")
 CURDIR_PATTERN = re.compile(r"^[ \t]*CURDIR[ \t]*:?=[ \t]*(?P<curdir>.*)$")
-TARGET_FAILED_PATTERN = re.compile(r"recipe for target '(?P<target>.*)' failed")
-MAKEFILE_PATTERN = re.compile(r"[ \t]*Reading makefile '(?P<makefile>.*)'\.\.\.[ \t]*$")
+TARGET_FAILED_PATTERN = re.compile(r"recipe for target [`'](?P<target>.*)' failed")
+MAKEFILE_PATTERN = re.compile(r"[ \t]*Reading makefile [`'](?P<makefile>.*)'\.\.\.[ \t]*$")
 CMDGOALS_PATTERN = re.compile(r"^[ \t]*MAKECMDGOALS[ \t]*:?=[ \t]*(?P<cmdgoals>.*)$")
-CONSIDERED_ALREADY_PATTERN = re.compile(r"[ \t]*File '(?P<target>.*)' was considered already.[ \t]*$")
+CONSIDERED_ALREADY_PATTERN = re.compile(r"[ \t]*File [`'](?P<target>.*)' was considered already.[ \t]*$")
+# make job control, error and directory lines, and blank lines between the recipe output lines
+RECIPE_NOISE_PATTERN = re.compile(r"(?:(?:Putting|Live|Reaping winning|Reaping losing|Removing) child |"
+                                  r"Got a SIGCHLD|Unblocking |Invoking recipe from |"
+                                  r"(?:# )?make(?:\[[0-9]+\])?: (?:\*\*\*|Entering directory|Leaving directory)|"
+                                  r"[ \t]*$)")
+
+# time stamp prefix added by e.g. "make -d | ts '%.s'", "ts '%Y-%m-%d %H:%M:%.S'",
+# plain "ts" or "ts -s", optionally in brackets
+TIMESTAMP_PATTERN = re.compile(r"\[?(?:(?P<epoch>[0-9]{9,}(?:\.[0-9]+)?)|"
+                               r"(?:(?P<date>[0-9]{4}-[0-9]{2}-[0-9]{2})[T ]|"
+                               r"(?P<month>[A-Z][a-z]{2}) +(?P<day>[0-9]{1,2}) )?"
+                               r"(?P<clock>[0-9]{1,3}:[0-9]{2}:[0-9]{2}(?:[.,][0-9]+)?))\]? ")
+MONTHS = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+          'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+
+
+@functools.lru_cache(maxsize=64)
+def get_day_seconds(date, month, day):
+    # seconds from epoch to the start of the day of a time stamp
+    if date:
+        year, month, day = date.split('-')
+        return calendar.timegm((int(year), int(month), int(day), 0, 0, 0))
+    if month:
+        # no year in "ts" default format
+        return calendar.timegm((time.gmtime().tm_year, MONTHS.get(month, 1), int(day), 0, 0, 0))
+    return 0
+
+
+def parse_timestamp(m):
+    # seconds of a TIMESTAMP_PATTERN match
+    if m.group('epoch'):
+        return float(m.group('epoch'))
+    hours, minutes, seconds = m.group('clock').split(':')
+    return get_day_seconds(m.group('date'), m.group('month'), m.group('day')) + \
+        int(hours) * 3600 + int(minutes) * 60 + float(seconds.replace(',', '.'))
 
 
 class MakeInvocation(object):
@@ -33,7 +86,6 @@ class MakeInvocation(object):
         self.line_num = None
         self.targets = []  # top level targets considered for this invocation
         self.submakes = []  # top level submakes???
-        self.database = None  # associated make database
         self.curdir = None  # working directory
         self.cmdgoals = None  # command line goals
         self.makefile = None  # associated makefile
@@ -42,8 +94,13 @@ class MakeInvocation(object):
         self.parent = parent  # parent make invocation
         self.current_target = None  # type: MakeTarget
         self.build_log = None
+        self.build_log_stat = None  # (size, mtime) of build log when the tree was saved, None if unknown
         self.db_start_pos = None
         self.db_end_pos = None
+        self.db_start_offset = None  # byte range of the make database dump in build log
+        self.db_end_offset = None
+        self.start_time = None  # time stamps, seconds
+        self.end_time = None
 
     def get_makefile(self):
         if not self.makefile:
@@ -56,6 +113,32 @@ class MakeInvocation(object):
             return self.makefile
         return posixpath.join(curdir, self.makefile)
 
+    def get_database(self):
+        # the make database dump is not kept in memory, read it back from build log
+        if self.db_start_offset is None or self.db_end_offset is None or \
+                not self.build_log:
+            return None
+        error = get_build_log_error(self)
+        if error:
+            raise MakeDatabaseError('can not read make database dump: {}'.format(error))
+        data = read_build_log_range(self.build_log, self.db_start_offset, self.db_end_offset)
+        return data.decode('utf-8', errors='replace')
+
+
+def get_build_log_error(invocation):
+    # why byte ranges of the build log of a make tree can not be read back, None if they can
+    build_log = invocation.build_log
+    if not build_log:
+        return 'no build log recorded'
+    try:
+        stat = os.stat(build_log)
+    except OSError:
+        return 'build log <{}> not found'.format(build_log)
+    if invocation.build_log_stat is not None and \
+            invocation.build_log_stat != (stat.st_size, stat.st_mtime_ns):
+        return 'build log <{}> changed since it was scanned'.format(build_log)
+    return None
+
 
 # MakeTarget state
 MTST_CONSIDERING = 0x00
@@ -94,6 +177,8 @@ def get_line_number(line_no):
 
 
 INDENTION = '--'
+DEFAULT_OUTPUT_LINES = 10  # recipe output lines shown per target
+OUTPUT_READ_SIZE = 1024 * 1024  # longest span tail read back for output lines
 
 
 class MakeTarget(object):
@@ -107,8 +192,11 @@ class MakeTarget(object):
         self.invocation = None  # type: MakeInvocation
         self.failed_pos = None
         self.end_pos = None
+        self.start_time = None  # time stamps, seconds
+        self.end_time = None
+        self.output_spans = None  # recipe output, flat array of (start, end) build log offsets
 
-    def dump(self, details='', indent=0, buffer=None, excludes=[]):
+    def dump(self, details='', indent=0, buffer=None, excludes=[], output_lines=DEFAULT_OUTPUT_LINES):
         for x in excludes:
             m = x.search(self.name)
             if m:
@@ -178,307 +266,1571 @@ class MakeTarget(object):
                     buffer.write(' , default goal: <{}>'.format(submake.default_goal))
                 buffer.write('\n')
 
+        # dump recipe output, of failed targets only unless 'oo'
+        if 'o' in details and self.output_spans and \
+                (self.state == MTST_REMAKE_FAILED or 'oo' in details):
+            buffer.write(indent + INDENTION)
+            error = get_build_log_error(self.invocation)
+            if error:
+                buffer.write('output: not available, {}\n'.format(error))
+            else:
+                buffer.write('output:\n')
+                for line in get_target_output(self, output_lines):
+                    buffer.write(indent + 2 * INDENTION)
+                    buffer.write(line + '\n')
+
         if logger:
             logger.info(buffer.getvalue())
 
 
+class SharedMakeTarget(MakeTarget):
+    # occurrence of a finished prereq sub tree identical to an earlier one of the same invocation,
+    # shares its nodes; line numbers are those of the earlier sub tree moved by delta
+    __slots__ = ('shared', 'delta', 'parent', '_prereqs')
+
+    def __init__(self, shared, delta, parent):
+        self.shared = shared  # type: MakeTarget
+        self.delta = delta
+        self.parent = parent
+        self._prereqs = None
+
+    name = property(lambda self: self.shared.name)
+    state = property(lambda self: self.shared.state)
+    invocation = property(lambda self: self.shared.invocation)
+    submakes = property(lambda self: self.shared.submakes)
+    failed_pos = property(lambda self: self.shared.failed_pos)
+    start_time = property(lambda self: self.shared.start_time)
+    end_time = property(lambda self: self.shared.end_time)
+    output_spans = property(lambda self: self.shared.output_spans)
+
+    @property
+    def line_num(self):
+        return self.shared.line_num + self.delta
+
+    @property
+    def end_pos(self):
+        return self.shared.end_pos + self.delta
+
+    @property
+    def prereqs(self):
+        # created on first access and kept, so that the nodes keep their identity
+        if self._prereqs is None:
+            self._prereqs = [SharedMakeTarget(prereq.shared, prereq.delta + self.delta, self)
+                             if isinstance(prereq, SharedMakeTarget)
+                             else SharedMakeTarget(prereq, self.delta, self)
+                             for prereq in self.shared.prereqs]
+        return self._prereqs
+
+
+def get_target_output(target, max_lines=DEFAULT_OUTPUT_LINES):
+    # last recipe output lines of a target, read back from its spans in build log without rescan
+    spans = target.output_spans
+    build_log = target.invocation.build_log
+    if not spans or not build_log or max_lines <= 0:
+        return []
+    lines = []
+    for i in range(len(spans) - 2, -1, -2):
+        start, end = spans[i], spans[i + 1]
+        # one read per span, of its tail only if it is very long
+        read_start = max(start, end - OUTPUT_READ_SIZE)
+        span_lines = read_build_log_range(build_log, read_start, end).splitlines()
+        if read_start > start:
+            # partial first line
+            span_lines = span_lines[1:]
+        lines[:0] = span_lines[-(max_lines - len(lines)):]
+        if len(lines) >= max_lines:
+            break
+    return [line.decode('utf-8', errors='replace') for line in lines]
+
+
+def get_target_record(target):
+    # target fields for structured output
+    invocation = target.invocation
+    submakes = []
+    for submake in target.submakes:
+        submakes.append({
+            'makefile': submake.get_makefile(),
+            'level': submake.level,
+            'cmdgoals': submake.cmdgoals,
+            'default_goal': submake.default_goal
+        })
+    return {
+        'name': target.name,
+        'state': MTST_NAMES.get(target.state, '<unknown>')[1:-1],
+        'line_num': target.line_num,
+        'end_pos': target.end_pos,
+        'failed_pos': target.failed_pos,
+        'start_time': target.start_time,
+        'end_time': target.end_time,
+        'makefile': invocation.get_makefile(),
+        'level': invocation.level,
+        'parent': target.parent.name if target.parent is not None else None,
+        'prereqs': [prereq.name for prereq in target.prereqs],
+        'submakes': submakes
+    }
+
+
+OUTPUT_FORMATS = ['text', 'ndjson', 'json']
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+
+class TargetWriter(object):
+    # writes targets straight to a buffered stream, bypassing logging:
+    # text - same as MakeTarget.dump, ndjson - one JSON object per line, json - a JSON array
+    def __init__(self, fp, output_format='ndjson', details='d', excludes=[], output_lines=DEFAULT_OUTPUT_LINES):
+        assert (output_format in OUTPUT_FORMATS)
+        self.fp = fp
+        self.output_format = output_format
+        self.details = details
+        self.excludes = excludes
+        self.output_lines = output_lines
+        self.count = 0
+        self.encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def write(self, target):
+        if self.output_format == 'text':
+            target.dump(details=self.details, indent=-target.invocation.level,
+                        buffer=self.fp, excludes=self.excludes, output_lines=self.output_lines)
+        elif self.output_format == 'ndjson':
+            self.fp.write(self.encoder.encode(get_target_record(target)))
+            self.fp.write('\n')
+        else:
+            # the array is opened by the first target, nothing is written if the query never runs
+            self.fp.write(',\n' if self.count else '[')
+            self.fp.write(self.encoder.encode(get_target_record(target)))
+        self.count += 1
+
+    def close(self):
+        if self.output_format == 'json':
+            self.fp.write(']\n' if self.count else '[]\n')
+        self.fp.flush()
+
+
+def open_output_stream():
+    # buffered utf-8 stdout, left open when the writer is done
+    return open(sys.stdout.fileno(), 'w', buffering=OUTPUT_BUFFER_SIZE,
+                encoding='utf-8', errors='replace', closefd=False)
+
+
 class TargetFilter(object):
     def __init__(self):
         self.name_pattern = None
         self.state_filter = None
         self.excludes = []
 
+    def get_states(self):
+        # state filter as a collection of states, None if not filtering on state
+        if self.state_filter is None:
+            return None
+        if isinstance(self.state_filter, (list, set)):
+            return self.state_filter
+        return [self.state_filter]
+
+    def match(self, target):
+        # single target check, same result as find_target
+        if self.name_pattern is not None and not self.name_pattern.search(target.name):
+            return False
+        states = self.get_states()
+        if states is not None and target.state not in states:
+            return False
+        return not any(x.search(target.name) for x in self.excludes)
+
+
+# events of scanned lines, returned by BuildLogScanner.scan_line
+SCAN_EVENT_OTHER = 'other'
+SCAN_EVENT_OUTPUT = 'recipe output'
+SCAN_EVENT_SUBMAKE = 'submake'
+SCAN_EVENT_MAKEFILE = 'makefile'
+SCAN_EVENT_CONSIDERING = 'considering'
+SCAN_EVENT_CONSIDERED_ALREADY = 'considered already'
+SCAN_EVENT_PREREQ_FINISHED = 'prereqs finished'
+SCAN_EVENT_MUST_REMAKE = 'must remake'
+SCAN_EVENT_NO_NEED_REMAKE = 'no need to remake'
+SCAN_EVENT_REMADE = 'remade'
+SCAN_EVENT_FAILED = 'failed'
+SCAN_EVENT_DATABASE_BEGIN = 'database begin'
+SCAN_EVENT_DATABASE = 'database'
+SCAN_EVENT_DATABASE_END = 'database end'
+
+PROGRESS_CHECK_LINES = 4096  # lines between clock checks for progress reports
+
+
+class ScanStateError(AssertionError):
+    # a build log line does not fit the state of the scanner
+    def __init__(self, message, line_num, event, target=None, expected=None, actual=None):
+        super().__init__(message)
+        self.message = message
+        self.line_num = line_num
+        self.event = event
+        self.target = target  # name of the current target
+        self.expected = expected  # expected target states
+        self.actual = actual  # actual target state
+
+    def __str__(self):
+        s = 'build log line {}, <{}>: {}'.format(self.line_num, self.event, self.message)
+        if self.target is not None:
+            s += ', target <{}>'.format(self.target)
+        if self.expected is not None:
+            s += ', expected state {}'.format(' or '.join(MTST_NAMES.get(state, '<unknown>')
+                                                          for state in self.expected))
+        if self.actual is not None:
+            s += ', actual state {}'.format(MTST_NAMES.get(self.actual, '<unknown>'))
+        return s
+
+
+class ScanStats(object):
+    # scanner instrumentation, see BuildLogScanner.stats
+    def __init__(self, progress_interval=5.0):
+        self.event_counts = {}  # event -> matched lines
+        self.event_times = {}  # event -> seconds spent in scan_line
+        self.lines = 0
+        self.bytes = 0
+        self.nodes = 0  # peak number of MakeInvocation and MakeTarget objects in the tree
+        self.shared_nodes = 0  # targets replaced by SharedMakeTarget views
+        self.elapsed = 0.0
+        self.peak_memory = None  # peak resident set size, KiB
+        self.error = None  # type: ScanStateError
+        self.progress_interval = progress_interval
+        self.on_progress = self.log_progress  # callback, called with the stats object
+        self.logger = logging.getLogger('STATS')
+
+    def scan(self, scanner, fp):
+        clock = time.perf_counter
+        counts = self.event_counts
+        times = self.event_times
+        start = clock() - self.elapsed
+        next_report = start + self.elapsed + self.progress_interval
+        try:
+            for raw in fp:
+                t = clock()
+                event = scanner.scan_line(raw)
+                t_end = clock()
+                counts[event] = counts.get(event, 0) + 1
+                times[event] = times.get(event, 0.0) + t_end - t
+                self.lines += 1
+                self.bytes += len(raw)
+                if self.lines % PROGRESS_CHECK_LINES == 0 and t_end >= next_report:
+                    self.update(scanner, start)
+                    next_report = t_end + self.progress_interval
+                    if self.on_progress is not None:
+                        self.on_progress(self)
+        except ScanStateError as e:
+            self.error = e
+            raise
+        finally:
+            self.update(scanner, start)
+
+    def update(self, scanner, start):
+        self.elapsed = time.perf_counter() - start
+        self.nodes = scanner.peak_nodes
+        self.shared_nodes = scanner.shared_nodes
+        if resource is not None:
+            self.peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def get_rates(self):
+        # lines/s, bytes/s
+        if self.elapsed <= 0:
+            return 0.0, 0.0
+        return self.lines / self.elapsed, self.bytes / self.elapsed
+
+    def log_progress(self, stats):
+        lines_per_sec, bytes_per_sec = self.get_rates()
+        self.logger.info('%d lines, %.1f MiB scanned, %.0f lines/s, %.1f MiB/s',
+                         self.lines, self.bytes / 1048576, lines_per_sec, bytes_per_sec / 1048576)
+
+    def dump(self):
+        lines_per_sec, bytes_per_sec = self.get_rates()
+        buffer = StringIO()
+        buffer.write('{} lines, {:.1f} MiB in {:.3f}s, {:.0f} lines/s, {:.1f} MiB/s\n'.format(
+            self.lines, self.bytes / 1048576, self.elapsed, lines_per_sec, bytes_per_sec / 1048576))
+        buffer.write('{} nodes at peak'.format(self.nodes))
+        if self.shared_nodes:
+            buffer.write(', {} targets shared'.format(self.shared_nodes))
+        if self.peak_memory is not None:
+            buffer.write(', peak memory {:.1f} MiB'.format(self.peak_memory / 1024))
+        buffer.write('\n')
+        for event in sorted(self.event_counts, key=lambda event: -self.event_times[event]):
+            buffer.write(INDENTION + '{:<20} {:>10} lines {:>10.3f}s\n'.format(
+                event, self.event_counts[event], self.event_times[event]))
+        if self.error is not None:
+            buffer.write('scan stopped: {}\n'.format(self.error))
+        self.logger.info(buffer.getvalue())
+
+
+class BuildLogScanner(object):
+    # incremental build log scanner, lines are fed one by one so that a scan
+    # can be continued when the log grows or resumed from a checkpoint
+    def __init__(self, log_file, timestamps=False, share_subtrees=False):
+        self.log_file = os.path.abspath(log_file)
+        self.timestamps = timestamps  # lines are prefixed with time stamps
+        self.share_subtrees = share_subtrees  # share identical prereq sub trees of an invocation
+        self.shared_subtrees = {}  # id(invocation) -> ({sub tree key: MakeTarget}, ids of those targets)
+        self.timestamp = None  # time stamp of current line
+        self.make_level = 0
+        self.line_num = 0
+        self.offset = 0  # byte offset of the next line
+        self.collecting_database = False
+        self.current_invocation = None  # type: MakeInvocation
+        self.top_level_invocation = None  # type: MakeInvocation
+        self.on_target_failed = None  # callback, called with the failed MakeTarget
+        self.stats = None  # type: ScanStats
+        self.nodes = 0  # MakeInvocation and MakeTarget objects in the tree
+        self.peak_nodes = 0
+        self.shared_nodes = 0  # targets replaced by SharedMakeTarget views
+        self.logger = logging.getLogger('SCANNER')
+
+    def is_finished(self):
+        # the top level make has printed its database
+        return self.top_level_invocation is not None and \
+            self.current_invocation is None
+
+    def scan(self, fp):
+        if self.stats is not None:
+            self.stats.scan(self, fp)
+            return
+        for raw in fp:
+            self.scan_line(raw)
+
+    def add_node(self):
+        self.nodes += 1
+        if self.nodes > self.peak_nodes:
+            self.peak_nodes = self.nodes
+
+    def share_target(self, target):
+        # hash-consing, a finished target whose sub tree equals an earlier one of the invocation,
+        # line numbers relative to the target included, is replaced by a SharedMakeTarget
+        if target.submakes or target.failed_pos is not None or target.start_time is not None or \
+                target.output_spans is not None:
+            return
+        subtrees, shareable = self.shared_subtrees.setdefault(id(target.invocation), ({}, set()))
+        prereq_keys = []
+        for prereq in target.prereqs:
+            if isinstance(prereq, SharedMakeTarget):
+                prereq_id = id(prereq.shared)
+            elif id(prereq) in shareable:
+                prereq_id = id(prereq)
+            else:
+                return
+            prereq_keys.append((prereq.line_num - target.line_num, prereq_id))
+        key = (target.name, target.state, target.end_pos - target.line_num, tuple(prereq_keys))
+
+        shared = subtrees.get(key)
+        if shared is None:
+            subtrees[key] = target
+            shareable.add(id(target))
+            return
+        # the target is the last one considered by its parent
+        siblings = target.parent.prereqs if target.parent is not None else target.invocation.targets
+        assert (siblings[-1] is target)
+        siblings[-1] = SharedMakeTarget(shared, target.line_num - shared.line_num, target.parent)
+        # its prereqs are views already, only the target itself is released
+        self.nodes -= 1
+        self.shared_nodes += 1
+
+    def state_error(self, event, message, target=None, expected=None):
+        return ScanStateError(message, self.line_num, event,
+                              target=target.name if target is not None else None,
+                              expected=expected,
+                              actual=target.state if target is not None and expected is not None else None)
+
+    def check_target(self, event, target_name, expected):
+        # current target of the event, it must be target_name in one of the expected states
+        if not isinstance(self.current_invocation, MakeInvocation):
+            raise self.state_error(event, 'no make invocation for target <{}>'.format(target_name))
+        target = self.current_invocation.current_target
+        if not isinstance(target, MakeTarget):
+            raise self.state_error(event, 'no current target for target <{}>'.format(target_name))
+        if target_name is not None and target.name != target_name:
+            raise self.state_error(event, 'target <{}> is not the current target'.format(target_name), target)
+        if expected is not None and target.state not in expected:
+            raise self.state_error(event, 'unexpected target state', target, expected)
+        return target
+
+    def scan_line(self, raw):
+        # returns the event of the line
+        self.line_num += 1
+        line_offset = self.offset
+        self.offset += len(raw)
+        ln = raw.decode('utf-8', errors='replace')
+        if self.timestamps:
+            m = TIMESTAMP_PATTERN.match(ln)
+            if m:
+                self.timestamp = parse_timestamp(m)
+                ln = ln[m.end():]
+
+        if self.collecting_database:
+            # <# Finished Make data base on>
+            if ln.startswith(MK_DB_PRINT_END):
+                if self.current_invocation.db_end_pos is not None:
+                    raise self.state_error(SCAN_EVENT_DATABASE_END, 'make database already finished')
+                self.current_invocation.db_end_pos = self.line_num
+                self.current_invocation.db_end_offset = self.offset
+                self.current_invocation.end_time = self.timestamp
+                self.collecting_database = False
+                self.shared_subtrees.pop(id(self.current_invocation), None)
+
+                # update current make invocation
+                self.current_invocation = self.current_invocation.parent
+                self.make_level -= 1
+                return SCAN_EVENT_DATABASE_END
+
+            # curdir extraction
+            m = CURDIR_PATTERN.search(ln)
+            if m:
+                curdir = m.group('curdir').strip()
+                if self.current_invocation.curdir is not None:
+                    raise self.state_error(SCAN_EVENT_DATABASE, 'CURDIR already set')
+                self.current_invocation.curdir = curdir
+                return SCAN_EVENT_DATABASE
+
+            # default goal extraction
+            m = DEFAULT_GOAL_PATTERN.search(ln)
+            if m:
+                default_goal = m.group('target').strip()
+                if self.current_invocation.default_goal is not None:
+                    raise self.state_error(SCAN_EVENT_DATABASE, '.DEFAULT_GOAL already set')
+                self.current_invocation.default_goal = default_goal
+                return SCAN_EVENT_DATABASE
+
+            # command line goal extraction
+            m = CMDGOALS_PATTERN.search(ln)
+            if m:
+                cmdgoals = m.group('cmdgoals').strip()
+                if self.current_invocation.cmdgoals is not None:
+                    raise self.state_error(SCAN_EVENT_DATABASE, 'MAKECMDGOALS already set')
+                self.current_invocation.cmdgoals = cmdgoals
+                return SCAN_EVENT_DATABASE
+
+            return SCAN_EVENT_DATABASE
+
+        # <# GNU Make 4.1>
+        # a new "make" invocation
+        m = SUB_MAKE_PATTERN.search(ln)
+        if m:
+            self.make_level += 1
+            if isinstance(self.current_invocation, MakeInvocation):
+                for_target = self.current_invocation.current_target
+            else:
+                for_target = None
+            new_invocation = MakeInvocation(self.make_level, self.current_invocation, for_target)
+            self.add_node()
+            new_invocation.build_log = self.log_file
+            new_invocation.line_num = self.line_num
+            new_invocation.start_time = self.timestamp
+            if isinstance(for_target, MakeTarget):
+                for_target.submakes.append(new_invocation)
+            elif isinstance(self.current_invocation, MakeInvocation):
+                self.current_invocation.submakes.append(new_invocation)
+            self.current_invocation = new_invocation
+            if self.top_level_invocation is None:
+                self.top_level_invocation = new_invocation
+
+            if isinstance(for_target, MakeTarget):
+                self.logger.debug('new make invocation at line_number=%d, for target=%s, level=%d',
+                                  self.line_num, for_target.name, self.make_level)
+            else:
+                self.logger.debug('new make invocation at line_number=%d, level=%d',
+                                  self.line_num, self.make_level)
+            return SCAN_EVENT_SUBMAKE
+
+        # makefile name
+        if isinstance(self.current_invocation, MakeInvocation) and \
+                self.current_invocation.makefile is None:
+            m = MAKEFILE_PATTERN.search(ln)
+            if m:
+                makefile = m.group('makefile').strip()
+                self.current_invocation.makefile = makefile
+                return SCAN_EVENT_MAKEFILE
+
+        # <Considering target file '...'>
+        # a new target
+        m = CONSIDERING_PATTERN.search(ln)
+        if m:
+            target_name = m.group('target').strip()
+            if not isinstance(self.current_invocation, MakeInvocation):
+                raise self.state_error(SCAN_EVENT_CONSIDERING, 'no make invocation for target <{}>'.format(target_name))
+            if not target_name:
+                raise self.state_error(SCAN_EVENT_CONSIDERING, 'empty target name')
+            new_target = MakeTarget(target_name, self.current_invocation.current_target)
+            self.add_node()
+            new_target.line_num = self.line_num
+            new_target.start_time = self.timestamp
+            new_target.invocation = self.current_invocation
+            if isinstance(self.current_invocation.current_target, MakeTarget):
+                self.current_invocation.current_target.prereqs.append(new_target)
+                self.current_invocation.current_target.state = MTST_PREREQ_COLLECTING
+                self.logger.debug('new make target name=<%s>, as prereq for target=<%s>, line_number=%d',
+                                  target_name, self.current_invocation.current_target.name, self.line_num)
+            else:
+                self.current_invocation.targets.append(new_target)
+                self.logger.debug('new make target name=<%s>, line_number=%d',
+                                  target_name, self.line_num)
+            self.current_invocation.current_target = new_target
+            return SCAN_EVENT_CONSIDERING
+
+        m = CONSIDERED_ALREADY_PATTERN.search(ln)
+        if m:
+            target_name = m.group('target').strip()
+            self.check_target(SCAN_EVENT_CONSIDERED_ALREADY, target_name, [MTST_CONSIDERING])
+            self.current_invocation.current_target.state = MTST_CONSIDERED_ALREADY
+            self.current_invocation.current_target.end_pos = self.line_num
+            self.current_invocation.current_target.end_time = self.timestamp
+            if self.share_subtrees:
+                self.share_target(self.current_invocation.current_target)
+            self.current_invocation.current_target = self.current_invocation.current_target.parent
+            return SCAN_EVENT_CONSIDERED_ALREADY
+
+        # <Finished prerequisites of target file '...'>
+        # prerequisites analysis completes
+        m = FINISH_PREREQ_PATTERN.search(ln)
+        if m:
+            target_name = m.group('target').strip()
+            self.check_target(SCAN_EVENT_PREREQ_FINISHED, target_name, [MTST_CONSIDERING, MTST_PREREQ_COLLECTING])
+            self.current_invocation.current_target.state = MTST_PREREQ_COLLECTED
+            self.logger.debug('target <%s> prerequisites collected, line_number=%d',
+                              target_name, self.line_num)
+            return SCAN_EVENT_PREREQ_FINISHED
+
+        # <Must remake target '...'>
+        # must remake target
+        m = MUST_REMAKE_PATTERN.search(ln)
+        if m:
+            target_name = m.group('target').strip()
+            self.check_target(SCAN_EVENT_MUST_REMAKE, target_name, [MTST_PREREQ_COLLECTED])
+            self.current_invocation.current_target.state = MTST_REMAKING
+            self.logger.debug('target <%s> need remade, line_number=%d',
+                              target_name, self.line_num)
+            return SCAN_EVENT_MUST_REMAKE
+
+        # <No need to remake target '...'>
+        # no need to remake
+        m = NO_NEED_REMAKE_PATTERN.search(ln)
+        if m:
+            target_name = m.group('target').strip()
+            self.check_target(SCAN_EVENT_NO_NEED_REMAKE, target_name, [MTST_PREREQ_COLLECTED])
+            self.current_invocation.current_target.state = MTST_UP_TO_DATE
+            self.logger.debug('target <%s> no need to remake, line_number=%d',
+                              target_name, self.line_num)
+            # update current target
+            self.current_invocation.current_target.end_pos = self.line_num
+            self.current_invocation.current_target.end_time = self.timestamp
+            if self.share_subtrees:
+                self.share_target(self.current_invocation.current_target)
+            self.current_invocation.current_target = self.current_invocation.current_target.parent
+            return SCAN_EVENT_NO_NEED_REMAKE
+
+        # <Successfully remade target file '...'>
+        # target remade successfully
+        m = TARGET_REMADE_PATTER.search(ln)
+        if m:
+            target_name = m.group('target').strip()
+            self.check_target(SCAN_EVENT_REMADE, target_name, [MTST_REMAKING, MTST_REMAKE_FAILED])
+            self.current_invocation.current_target.state = MTST_REMADE
+            self.logger.debug('target <%s> remade successfully, line_number=%d',
+                              target_name, self.line_num)
+            # update current target
+            self.current_invocation.current_target.end_pos = self.line_num
+            self.current_invocation.current_target.end_time = self.timestamp
+            if self.share_subtrees:
+                self.share_target(self.current_invocation.current_target)
+            self.current_invocation.current_target = self.current_invocation.current_target.parent
+            return SCAN_EVENT_REMADE
+
+        # <recipe for target '...' failed>
+        # target failed
+        m = TARGET_FAILED_PATTERN.search(ln)
+        if m:
+            target_name = m.group('target').strip()
+            target = self.check_target(SCAN_EVENT_FAILED, None, None)
+
+            if target_name != target.name:
+                return SCAN_EVENT_OTHER
+
+            if target.state not in [MTST_REMAKING, MTST_REMAKE_FAILED]:
+                raise self.state_error(SCAN_EVENT_FAILED, 'unexpected target state', target,
+                                       [MTST_REMAKING, MTST_REMAKE_FAILED])
+            self.current_invocation.current_target.state = MTST_REMAKE_FAILED
+            self.current_invocation.current_target.failed_pos = self.line_num
+            self.current_invocation.current_target.end_pos = self.line_num
+            self.current_invocation.current_target.end_time = self.timestamp
+            # postpone current target update
+            self.logger.debug('recipe failed for target <%s>, line_number=%d',
+                              target_name, self.line_num)
+            if self.on_target_failed is not None:
+                self.on_target_failed(self.current_invocation.current_target)
+            return SCAN_EVENT_FAILED
+
+        # <# Make data base, printed on ...>
+        if ln.startswith(MK_DB_PRINT_BEGIN):
+            if not isinstance(self.current_invocation, MakeInvocation):
+                raise self.state_error(SCAN_EVENT_DATABASE_BEGIN, 'no make invocation')
+            if self.current_invocation.db_start_offset is not None:
+                raise self.state_error(SCAN_EVENT_DATABASE_BEGIN, 'make database already started')
+            self.current_invocation.db_start_pos = self.line_num
+            self.current_invocation.db_start_offset = line_offset
+            self.collecting_database = True
+            self.logger.debug('start collecting make database, line_number=%d',
+                              self.line_num)
+            # update current target
+            if isinstance(self.current_invocation.current_target, MakeTarget) and \
+                    self.current_invocation.current_target.state == MTST_REMAKE_FAILED:
+                self.current_invocation.current_target = self.current_invocation.current_target.parent
+            return SCAN_EVENT_DATABASE_BEGIN
+
+        # recipe output of the target being remade, only its offsets are kept
+        if isinstance(self.current_invocation, MakeInvocation):
+            target = self.current_invocation.current_target
+            if isinstance(target, MakeTarget) and target.state == MTST_REMAKING and \
+                    not RECIPE_NOISE_PATTERN.match(ln):
+                spans = target.output_spans
+                if spans is None:
+                    spans = target.output_spans = array('q')
+                if spans and spans[-1] == line_offset:
+                    spans[-1] = self.offset
+                else:
+                    spans.append(line_offset)
+                    spans.append(self.offset)
+                return SCAN_EVENT_OUTPUT
 
-def build_log_scan(log_file):
-    make_level = 0
-    line_num = 0
-    current_invocation = None  # type: MakeInvocation
-    top_level_invocation = None
-    logger = logging.getLogger('SCANNER')
-
-    with open(log_file) as fp:
-        for ln in fp:
-            line_num += 1
-
-            if isinstance(current_invocation, MakeInvocation) and \
-               isinstance(current_invocation.database, StringIO):
-                if current_invocation.db_start_pos is None:
-                    current_invocation.db_start_pos = line_num
-
-                current_invocation.database.write(ln)
-
-                # <# Finished Make data base on>
-                if ln.startswith(MK_DB_PRINT_END):
-                    current_invocation.database.write(ln)
-                    assert current_invocation.db_end_pos is None
-                    current_invocation.db_end_pos = line_num
-                    current_invocation.database = current_invocation.database.getvalue()
-
-                    # update current make invocation
-                    current_invocation = current_invocation.parent
-                    make_level -= 1
-                    continue
-
-                # curdir extraction
-                m = CURDIR_PATTERN.search(ln)
-                if m:
-                    curdir = m.group('curdir').strip()
-                    assert (current_invocation.curdir is None)
-                    current_invocation.curdir = curdir
-                    continue
-
-                # default goal extraction
-                m = DEFAULT_GOAL_PATTERN.search(ln)
-                if m:
-                    default_goal = m.group('target').strip()
-                    assert (current_invocation.default_goal is None)
-                    current_invocation.default_goal = default_goal
-                    continue
-
-                # command line goal extraction
-                m = CMDGOALS_PATTERN.search(ln)
-                if m:
-                    cmdgoals = m.group('cmdgoals').strip()
-                    assert (current_invocation.cmdgoals is None)
-                    current_invocation.cmdgoals = cmdgoals
-                    continue
+        return SCAN_EVENT_OTHER
 
-                continue
+    def finish(self):
+        if self.current_invocation is not None or self.make_level != 0:
+            raise ScanStateError('build log ends inside make invocation, level {}'.format(self.make_level),
+                                 self.line_num, 'end of log')
+        return self.top_level_invocation
 
-            # <# GNU Make 4.1>
-            # a new "make" invocation
-            m = SUB_MAKE_PATTERN.search(ln)
-            if m:
-                make_level += 1
-                if isinstance(current_invocation, MakeInvocation):
-                    for_target = current_invocation.current_target
-                else:
-                    for_target = None
-                new_invocation = MakeInvocation(make_level, current_invocation, for_target)
-                new_invocation.build_log = os.path.abspath(log_file)
-                new_invocation.line_num = line_num
-                if isinstance(for_target, MakeTarget):
-                    for_target.submakes.append(new_invocation)
-                elif isinstance(current_invocation, MakeInvocation):
-                    current_invocation.submakes.append(new_invocation)
-                current_invocation = new_invocation
-                if top_level_invocation is None:
-                    top_level_invocation = new_invocation
-
-                if isinstance(for_target, MakeTarget):
-                    logger.debug('new make invocation at line_number=%d, for target=%s, level=%d',
-                                 line_num, for_target.name, make_level)
-                else:
-                    logger.debug('new make invocation at line_number=%d, level=%d',
-                                 line_num, make_level)
-                continue
 
-            # makefile name
-            if isinstance(current_invocation, MakeInvocation) and \
-                    current_invocation.makefile is None:
-                m = MAKEFILE_PATTERN.search(ln)
-                if m:
-                    makefile = m.group('makefile').strip()
-                    current_invocation.makefile = makefile
-                    continue
-
-            # <Considering target file '...'>
-            # a new target
-            m = CONSIDERING_PATTERN.search(ln)
-            if m:
-                target_name = m.group('target').strip()
-                assert (isinstance(current_invocation, MakeInvocation) and \
-                        len(target_name) > 0)
-                new_target = MakeTarget(target_name, current_invocation.current_target)
-                new_target.line_num = line_num
-                new_target.invocation = current_invocation
-                if isinstance(current_invocation.current_target, MakeTarget):
-                    current_invocation.current_target.prereqs.append(new_target)
-                    current_invocation.current_target.state = MTST_PREREQ_COLLECTING
-                    logger.debug('new make target name=<%s>, as prereq for target=<%s>, line_number=%d',
-                                 target_name, current_invocation.current_target.name, line_num)
-                else:
-                    current_invocation.targets.append(new_target)
-                    logger.debug('new make target name=<%s>, line_number=%d',
-                                 target_name, line_num)
-                current_invocation.current_target = new_target
-                continue
+def iter_complete_lines(lines):
+    # the lines ending with a line feed, a log being written may end with a part of a line
+    for raw in lines:
+        if not raw.endswith(b'\n'):
+            return
+        yield raw
 
-            m = CONSIDERED_ALREADY_PATTERN.search(ln)
-            if m:
-                target_name = m.group('target').strip()
-                assert (isinstance(current_invocation, MakeInvocation) and \
-                        isinstance(current_invocation.current_target, MakeTarget) and \
-                        current_invocation.current_target.state == MTST_CONSIDERING and \
-                        current_invocation.current_target.name == target_name)
-                current_invocation.current_target.state = MTST_CONSIDERED_ALREADY
-                current_invocation.current_target.end_pos = line_num
-                current_invocation.current_target = current_invocation.current_target.parent
-                continue
 
-            # <Finished prerequisites of target file '...'>
-            # prerequisites analysis completes
-            m = FINISH_PREREQ_PATTERN.search(ln)
-            if m:
-                target_name = m.group('target').strip()
-                assert (isinstance(current_invocation, MakeInvocation) and \
-                        isinstance(current_invocation.current_target, MakeTarget) and \
-                        target_name == current_invocation.current_target.name and \
-                        current_invocation.current_target.state in [MTST_CONSIDERING, MTST_PREREQ_COLLECTING])
-                current_invocation.current_target.state = MTST_PREREQ_COLLECTED
-                logger.debug('target <%s> prerequisites collected, line_number=%d',
-                             target_name, line_num)
-                continue
+def build_log_scan(log_file, checkpoint=None, timestamps=False, stats=None, share_subtrees=False):
+    if checkpoint and os.path.isfile(checkpoint):
+        scanner = load_scanner_checkpoint(checkpoint, log_file)
+    else:
+        scanner = BuildLogScanner(log_file, timestamps)
+    scanner.stats = stats
+    scanner.share_subtrees = share_subtrees
+
+    lines = iter_build_log_lines(log_file, scanner.offset)
+    if checkpoint:
+        # an incomplete last line is left to the scan resumed from the checkpoint,
+        # as in follow_build_log
+        lines = iter_complete_lines(lines)
+    scanner.scan(lines)
+    if checkpoint:
+        save_scanner_checkpoint(checkpoint, scanner)
+    return scanner.finish()
+
+
+# make database file, a SQLite file with flat node tables and a string table,
+# node ids follow the pre-order of the make tree so that a sub tree is an id range
+MKDB_FORMAT = 'build_log_scan.mkdb'
+MKDB_FORMAT_VERSION = 3
+SQLITE_MAGIC = b'SQLite format 3\x00'
+
+MKDB_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE strings (id INTEGER PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE invocations (
+    id INTEGER PRIMARY KEY,
+    level INTEGER,
+    line_num INTEGER,
+    parent_id INTEGER,
+    for_target_id INTEGER,
+    curdir_sid INTEGER,
+    cmdgoals_sid INTEGER,
+    makefile_sid INTEGER,
+    default_goal_sid INTEGER,
+    build_log_sid INTEGER,
+    db_start_pos INTEGER,
+    db_end_pos INTEGER,
+    db_start_offset INTEGER,
+    db_end_offset INTEGER,
+    start_time REAL,
+    end_time REAL,
+    target_first INTEGER,
+    target_last INTEGER
+);
+CREATE TABLE targets (
+    id INTEGER PRIMARY KEY,
+    name_sid INTEGER NOT NULL,
+    invocation_id INTEGER NOT NULL,
+    parent_id INTEGER,
+    state INTEGER,
+    line_num INTEGER,
+    end_pos INTEGER,
+    failed_pos INTEGER,
+    start_time REAL,
+    end_time REAL,
+    output_spans BLOB,
+    subtree_last INTEGER
+);
+"""
+
+MKDB_INDEXES = """
+CREATE UNIQUE INDEX strings_value ON strings (value);
+CREATE INDEX targets_name ON targets (name_sid);
+CREATE INDEX targets_state ON targets (state);
+CREATE INDEX targets_parent ON targets (parent_id);
+CREATE INDEX targets_invocation ON targets (invocation_id, parent_id);
+CREATE INDEX invocations_parent ON invocations (parent_id);
+CREATE INDEX invocations_for_target ON invocations (for_target_id);
+"""
+
+MKDB_TARGET_QUERY = """
+SELECT t.id, n.value, t.invocation_id, t.parent_id, t.state,
+       t.line_num, t.end_pos, t.failed_pos, t.start_time, t.end_time, t.output_spans, t.subtree_last
+FROM targets t JOIN strings n ON n.id = t.name_sid
+"""
+
+MKDB_INVOCATION_QUERY = """
+SELECT i.id, i.level, i.line_num, i.parent_id, i.for_target_id,
+       (SELECT value FROM strings WHERE id = i.curdir_sid),
+       (SELECT value FROM strings WHERE id = i.cmdgoals_sid),
+       (SELECT value FROM strings WHERE id = i.makefile_sid),
+       (SELECT value FROM strings WHERE id = i.default_goal_sid),
+       (SELECT value FROM strings WHERE id = i.build_log_sid),
+       i.db_start_pos, i.db_end_pos, i.db_start_offset, i.db_end_offset,
+       i.start_time, i.end_time, i.target_first, i.target_last
+FROM invocations i
+"""
+
+
+def get_output_spans(data):
+    # output spans of a target row, saved as the raw bytes of the array
+    if data is None:
+        return None
+    spans = array('q')
+    spans.frombytes(data)
+    return spans
+
+
+class MakeDatabaseError(RuntimeError):
+    pass
+
+
+class StoredMakeInvocation(MakeInvocation):
+    # make invocation backed by a make database file, relations are loaded on first access
+    def __init__(self, store, row):
+        (self.row_id, self.level, self.line_num, self._parent_id, self._for_target_id,
+         self.curdir, self.cmdgoals, self.makefile, self.default_goal, self.build_log,
+         self.db_start_pos, self.db_end_pos, self.db_start_offset, self.db_end_offset,
+         self.start_time, self.end_time, self.target_first, self.target_last) = row
+        self.store = store  # type: MakeDatabaseStore
+        self.build_log_stat = store.build_log_stat
+        self.current_target = None
+        self._targets = None
+        self._submakes = None
+
+    @property
+    def parent(self):
+        if self._parent_id is None:
+            return None
+        return self.store.get_invocation(self._parent_id)
+
+    @property
+    def for_target(self):
+        if self._for_target_id is None:
+            return None
+        return self.store.get_target(self._for_target_id)
+
+    @property
+    def targets(self):
+        if self._targets is None:
+            self._targets = self.store.get_targets(
+                'WHERE t.invocation_id = ? AND t.parent_id IS NULL', (self.row_id,))
+        return self._targets
+
+    @property
+    def submakes(self):
+        if self._submakes is None:
+            self._submakes = self.store.get_invocations(
+                'WHERE i.parent_id = ? AND i.for_target_id IS NULL', (self.row_id,))
+        return self._submakes
+
+
+class StoredMakeTarget(MakeTarget):
+    # make target backed by a make database file, relations are loaded on first access
+    def __init__(self, store, row):
+        (self.row_id, self.name, self._invocation_id, self._parent_id, self.state,
+         self.line_num, self.end_pos, self.failed_pos, self.start_time, self.end_time,
+         output_spans, self.subtree_last) = row
+        self.output_spans = get_output_spans(output_spans)
+        self.store = store  # type: MakeDatabaseStore
+        self._prereqs = None
+        self._submakes = None
+
+    @property
+    def invocation(self):
+        return self.store.get_invocation(self._invocation_id)
+
+    @property
+    def parent(self):
+        if self._parent_id is None:
+            return None
+        return self.store.get_target(self._parent_id)
+
+    @property
+    def prereqs(self):
+        if self._prereqs is None:
+            self._prereqs = self.store.get_targets('WHERE t.parent_id = ?', (self.row_id,))
+        return self._prereqs
+
+    @property
+    def submakes(self):
+        if self._submakes is None:
+            self._submakes = self.store.get_invocations('WHERE i.for_target_id = ?', (self.row_id,))
+        return self._submakes
+
+
+class MakeDatabaseStore(object):
+    def __init__(self, mkdb_file):
+        self.mkdb_file = mkdb_file
+        uri = 'file:%s?mode=ro' % urllib.parse.quote(os.path.abspath(mkdb_file))
+        self.conn = sqlite3.connect(uri, uri=True)
+        self.invocations = {}  # row id -> StoredMakeInvocation
+        self.targets = {}  # row id -> StoredMakeTarget
 
-            # <Must remake target '...'>
-            # must remake target
-            m = MUST_REMAKE_PATTERN.search(ln)
-            if m:
-                target_name = m.group('target').strip()
-                assert (isinstance(current_invocation, MakeInvocation) and \
-                        isinstance(current_invocation.current_target, MakeTarget) and \
-                        target_name == current_invocation.current_target.name and \
-                        current_invocation.current_target.state == MTST_PREREQ_COLLECTED)
-                current_invocation.current_target.state = MTST_REMAKING
-                logger.debug('target <%s> need remade, line_number=%d',
-                             target_name, line_num)
+        try:
+            meta = dict(self.conn.execute('SELECT key, value FROM meta'))
+        except sqlite3.DatabaseError:
+            meta = {}
+        if meta.get('format') != MKDB_FORMAT:
+            raise MakeDatabaseError('<%s> is not a make database file' % mkdb_file)
+        if meta.get('version') != str(MKDB_FORMAT_VERSION):
+            raise MakeDatabaseError('make database <%s> has format version %s, expected %d, '
+                                    'please rescan the build log' %
+                                    (mkdb_file, meta.get('version'), MKDB_FORMAT_VERSION))
+        self.meta = meta
+        self.root_id = int(meta['root'])
+        # a checkpoint belongs to a growing build log, its size is not checked
+        self.build_log_stat = None
+        if 'build_log_size' in meta and 'checkpoint' not in meta:
+            self.build_log_stat = (int(meta['build_log_size']), int(meta['build_log_mtime']))
+
+        build_log = meta.get('build_log')
+        if build_log and os.path.isfile(build_log) and 'checkpoint' not in meta:
+            stat = os.stat(build_log)
+            if str(stat.st_size) != meta.get('build_log_size') or \
+                    str(stat.st_mtime_ns) != meta.get('build_log_mtime'):
+                logging.getLogger('MKDB').warning('build log <%s> changed since make database <%s> was saved',
+                                                  build_log, mkdb_file)
+
+    def get_root(self):
+        return self.get_invocation(self.root_id)
+
+    def load_tree(self):
+        # build the whole tree from plain MakeInvocation/MakeTarget objects at once,
+        # returns the root and the row id -> object maps
+        invocations = {}
+        invocation_rows = list(self.conn.execute(MKDB_INVOCATION_QUERY + ' ORDER BY i.id'))
+        for row in invocation_rows:
+            invocation = MakeInvocation(row[1], None, None)
+            (invocation.line_num, invocation.curdir, invocation.cmdgoals, invocation.makefile,
+             invocation.default_goal, invocation.build_log, invocation.db_start_pos,
+             invocation.db_end_pos, invocation.db_start_offset, invocation.db_end_offset,
+             invocation.start_time, invocation.end_time) = row[2:3] + row[5:16]
+            invocation.build_log_stat = self.build_log_stat
+            invocations[row[0]] = invocation
+
+        targets = {}
+        for row in self.conn.execute(MKDB_TARGET_QUERY + ' ORDER BY t.id'):
+            parent = targets[row[3]] if row[3] is not None else None
+            target = MakeTarget(row[1], parent)
+            target.invocation = invocations[row[2]]
+            (target.state, target.line_num, target.end_pos, target.failed_pos,
+             target.start_time, target.end_time) = row[4:10]
+            target.output_spans = get_output_spans(row[10])
+            if parent is not None:
+                parent.prereqs.append(target)
+            else:
+                target.invocation.targets.append(target)
+            targets[row[0]] = target
+
+        for row in invocation_rows:
+            invocation = invocations[row[0]]
+            if row[3] is not None:
+                invocation.parent = invocations[row[3]]
+            if row[4] is not None:
+                invocation.for_target = targets[row[4]]
+                invocation.for_target.submakes.append(invocation)
+            elif invocation.parent is not None:
+                invocation.parent.submakes.append(invocation)
+
+        return invocations[self.root_id], invocations, targets
+
+    def get_invocation(self, row_id):
+        invocation = self.invocations.get(row_id)
+        if invocation is None:
+            invocation = self.get_invocations('WHERE i.id = ?', (row_id,))[0]
+        return invocation
+
+    def get_target(self, row_id):
+        target = self.targets.get(row_id)
+        if target is None:
+            target = self.get_targets('WHERE t.id = ?', (row_id,))[0]
+        return target
+
+    def get_invocations(self, where, params):
+        invocations = []
+        for row in self.conn.execute(MKDB_INVOCATION_QUERY + where + ' ORDER BY i.id', params):
+            invocations.append(self._make_invocation(row))
+        return invocations
+
+    def get_targets(self, where, params):
+        targets = []
+        for row in self.conn.execute(MKDB_TARGET_QUERY + where + ' ORDER BY t.id', params):
+            targets.append(self._make_target(row))
+        return targets
+
+    def _make_invocation(self, row):
+        invocation = self.invocations.get(row[0])
+        if invocation is None:
+            invocation = StoredMakeInvocation(self, row)
+            self.invocations[row[0]] = invocation
+        return invocation
+
+    def _make_target(self, row):
+        target = self.targets.get(row[0])
+        if target is None:
+            target = StoredMakeTarget(self, row)
+            self.targets[row[0]] = target
+        return target
+
+    def find_target(self, mkdb, filter):
+        # only the matching rows are turned into objects
+        if isinstance(mkdb, StoredMakeInvocation):
+            first, last = mkdb.target_first, mkdb.target_last
+        else:
+            first, last = mkdb.row_id, mkdb.subtree_last
+
+        where = 'WHERE t.id BETWEEN ? AND ?'
+        params = [first, last]
+        name_pattern = filter.name_pattern
+        if name_pattern is not None:
+            # let the name index narrow down the rows
+            prefix, exact = get_literal_prefix(name_pattern)
+            if exact:
+                where += ' AND n.value = ?'
+                params.append(prefix)
+                name_pattern = None
+            elif prefix:
+                where += ' AND n.value >= ? AND n.value < ?'
+                params.extend([prefix, prefix + '\U0010ffff'])
+
+        states = filter.get_states()
+        if states is not None:
+            where += ' AND t.state IN (%s)' % ','.join('?' * len(states))
+            params.extend(states)
+
+        for row in self.conn.execute(MKDB_TARGET_QUERY + where + ' ORDER BY t.id', params):
+            name = row[1]
+            if name_pattern is not None and not name_pattern.search(name):
                 continue
-
-            # <No need to remake target '...'>
-            # no need to remake
-            m = NO_NEED_REMAKE_PATTERN.search(ln)
-            if m:
-                target_name = m.group('target').strip()
-                assert (isinstance(current_invocation, MakeInvocation) and \
-                        isinstance(current_invocation.current_target, MakeTarget) and \
-                        target_name == current_invocation.current_target.name and \
-                        current_invocation.current_target.state == MTST_PREREQ_COLLECTED)
-                current_invocation.current_target.state = MTST_UP_TO_DATE
-                logger.debug('target <%s> no need to remake, line_number=%d',
-                             target_name, line_num)
-                # update current target
-                current_invocation.current_target.end_pos = line_num
-                current_invocation.current_target = current_invocation.current_target.parent
+            if any(x.search(name) for x in filter.excludes):
                 continue
+            yield self._make_target(row)
 
-            # <Successfully remade target file '...'>
-            # target remade successfully
-            m = TARGET_REMADE_PATTER.search(ln)
-            if m:
-                target_name = m.group('target').strip()
-                assert (isinstance(current_invocation, MakeInvocation) and \
-                        isinstance(current_invocation.current_target, MakeTarget) and \
-                        target_name == current_invocation.current_target.name and \
-                        current_invocation.current_target.state in [MTST_REMAKING, MTST_REMAKE_FAILED])
-                current_invocation.current_target.state = MTST_REMADE
-                logger.debug('target <%s> remade successfully, line_number=%d',
-                             target_name, line_num)
-                # update current target
-                current_invocation.current_target.end_pos = line_num
-                current_invocation.current_target = current_invocation.current_target.parent
-                continue
 
-            # <recipe for target '...' failed>
-            # target failed
-            m = TARGET_FAILED_PATTERN.search(ln)
+def open_make_database(mkdb_file):
+    with open(mkdb_file, 'rb') as fp:
+        magic = fp.read(len(SQLITE_MAGIC))
+    if magic != SQLITE_MAGIC:
+        raise MakeDatabaseError('<%s> is not a make database file of version %d '
+                                '(saved by an older version?), please rescan the build log' %
+                                (mkdb_file, MKDB_FORMAT_VERSION))
+    return MakeDatabaseStore(mkdb_file)
+
+
+def load_make_database(mkdb_file):
+    return open_make_database(mkdb_file).get_root()
+
+
+# what load_build raises for a file it can not load, an error message for the user
+LOAD_BUILD_ERRORS = (OSError, MakeDatabaseError, BuildLogFormatError, ScanStateError)
+
+
+def is_make_database_file(file_name):
+    with open(file_name, 'rb') as fp:
+        return fp.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+
+def load_build(file_name, timestamps=False, plain=False):
+    # make tree of a build log or a saved make database, told apart by the SQLite magic;
+    # a plain tree is loaded at once and not bound to the database connection, e.g. for a
+    # walk of the whole tree or to share it between threads
+    if not is_make_database_file(file_name):
+        return build_log_scan(file_name, timestamps=timestamps)
+    store = open_make_database(file_name)
+    return store.load_tree()[0] if plain else store.get_root()
+
+
+def save_make_database(mkdb_file, mkdb, scanner=None):
+    # with a scanner, its state is saved as well and the file is a scanner checkpoint
+    assert (isinstance(mkdb, MakeInvocation))
+
+    strings = {}
+
+    def string_id(value):
+        if value is None:
+            return None
+        sid = strings.get(value)
+        if sid is None:
+            sid = len(strings) + 1
+            strings[value] = sid
+        return sid
+
+    # iterative pre-order walk, deep trees must not hit the recursion limit
+    invocation_ids = {}
+    target_ids = {}
+    invocation_rows = []
+    target_rows = []
+    stack = [(mkdb, False)]
+    while stack:
+        node, leaving = stack.pop()
+        if leaving:
+            # last target id of the sub tree
+            if isinstance(node, MakeInvocation):
+                invocation_rows[invocation_ids[id(node)] - 1][-1] = len(target_rows)
+            else:
+                target_rows[target_ids[id(node)] - 1][-1] = len(target_rows)
+            continue
+
+        stack.append((node, True))
+        if isinstance(node, MakeInvocation):
+            row_id = len(invocation_rows) + 1
+            invocation_ids[id(node)] = row_id
+            parent = node.parent
+            for_target = node.for_target
+            invocation_rows.append([
+                row_id, node.level, node.line_num,
+                invocation_ids[id(parent)] if parent is not None else None,
+                target_ids[id(for_target)] if for_target is not None else None,
+                string_id(node.curdir), string_id(node.cmdgoals), string_id(node.makefile),
+                string_id(node.default_goal), string_id(node.build_log),
+                node.db_start_pos, node.db_end_pos, node.db_start_offset, node.db_end_offset,
+                node.start_time, node.end_time, len(target_rows) + 1, None])
+            children = node.targets + node.submakes
+        else:
+            row_id = len(target_rows) + 1
+            target_ids[id(node)] = row_id
+            parent = node.parent
+            target_rows.append([
+                row_id, string_id(node.name), invocation_ids[id(node.invocation)],
+                target_ids[id(parent)] if parent is not None else None,
+                node.state, node.line_num, node.end_pos, node.failed_pos,
+                node.start_time, node.end_time,
+                node.output_spans.tobytes() if node.output_spans else None, None])
+            children = node.prereqs + node.submakes
+        stack.extend((child, False) for child in reversed(children))
+
+    meta = {
+        'format': MKDB_FORMAT,
+        'version': str(MKDB_FORMAT_VERSION),
+        'root': '1',
+        'targets': str(len(target_rows)),
+        'invocations': str(len(invocation_rows)),
+    }
+    if mkdb.build_log and os.path.isfile(mkdb.build_log):
+        stat = os.stat(mkdb.build_log)
+        meta['build_log'] = mkdb.build_log
+        meta['build_log_size'] = str(stat.st_size)
+        meta['build_log_mtime'] = str(stat.st_mtime_ns)
+    if scanner is not None:
+        current_targets = {}
+        for invocation in iter_make_invocations(mkdb):
+            if invocation.current_target is not None:
+                current_targets[str(invocation_ids[id(invocation)])] = \
+                    target_ids[id(invocation.current_target)]
+        current_invocation = scanner.current_invocation
+        meta['checkpoint'] = json.dumps({
+            'line_num': scanner.line_num,
+            'offset': scanner.offset,
+            'tail_crc': get_build_log_tail_crc(scanner.log_file, scanner.offset),
+            'make_level': scanner.make_level,
+            'timestamps': scanner.timestamps,
+            'timestamp': scanner.timestamp,
+            'collecting_database': scanner.collecting_database,
+            'current_invocation': invocation_ids[id(current_invocation)]
+            if current_invocation is not None else None,
+            'current_targets': current_targets,
+        })
+
+    # write to a temporary file first, an existing database is replaced atomically
+    tmp_file = mkdb_file + '.tmp'
+    if os.path.exists(tmp_file):
+        os.unlink(tmp_file)
+    conn = sqlite3.connect(tmp_file)
+    try:
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.executescript(MKDB_SCHEMA)
+        conn.executemany('INSERT INTO meta VALUES (?, ?)', meta.items())
+        conn.executemany('INSERT INTO strings VALUES (?, ?)',
+                         ((sid, value) for value, sid in strings.items()))
+        conn.executemany('INSERT INTO invocations VALUES (%s)' % ','.join('?' * 18), invocation_rows)
+        conn.executemany('INSERT INTO targets VALUES (%s)' % ','.join('?' * 12), target_rows)
+        conn.executescript(MKDB_INDEXES)
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_file, mkdb_file)
+
+
+# bytes before the checkpoint offset used to recognize the build log on resume
+CHECKPOINT_TAIL_SIZE = 4096
+
+
+def get_build_log_tail_crc(log_file, offset):
+    return zlib.crc32(read_build_log_range(log_file, max(0, offset - CHECKPOINT_TAIL_SIZE), offset))
+
+
+def save_scanner_checkpoint(checkpoint_file, scanner):
+    if scanner.top_level_invocation is None:
+        # nothing scanned yet
+        return
+    save_make_database(checkpoint_file, scanner.top_level_invocation, scanner)
+
+
+def load_scanner_checkpoint(checkpoint_file, log_file):
+    store = open_make_database(checkpoint_file)
+    if 'checkpoint' not in store.meta:
+        raise MakeDatabaseError('<%s> is not a scanner checkpoint' % checkpoint_file)
+    state = json.loads(store.meta['checkpoint'])
+
+    scanner = BuildLogScanner(log_file, state['timestamps'])
+    scanner.timestamp = state['timestamp']
+    if get_build_log_tail_crc(scanner.log_file, state['offset']) != state['tail_crc']:
+        raise MakeDatabaseError('checkpoint <%s> does not belong to build log <%s>' %
+                                (checkpoint_file, log_file))
+
+    root, invocations, targets = store.load_tree()
+    for invocation in invocations.values():
+        invocation.build_log = scanner.log_file
+    for invocation_id, target_id in state['current_targets'].items():
+        invocations[int(invocation_id)].current_target = targets[target_id]
+
+    scanner.line_num = state['line_num']
+    scanner.offset = state['offset']
+    scanner.make_level = state['make_level']
+    scanner.collecting_database = state['collecting_database']
+    scanner.top_level_invocation = root
+    scanner.nodes = scanner.peak_nodes = len(invocations) + len(targets)
+    if state['current_invocation'] is not None:
+        scanner.current_invocation = invocations[state['current_invocation']]
+    return scanner
+
+
+def follow_build_log(log_file, checkpoint=None, poll_interval=1.0, checkpoint_interval=60.0,
+                     on_target_failed=None, timestamps=False, share_subtrees=False):
+    # scan a build log while it is being written, until the top level make finishes
+    logger = logging.getLogger('FOLLOW')
+    if get_build_log_format(log_file) != LOG_FORMAT_PLAIN:
+        raise BuildLogFormatError('compressed build log <%s> can not be followed' % log_file)
+    if checkpoint and os.path.isfile(checkpoint):
+        scanner = load_scanner_checkpoint(checkpoint, log_file)
+        logger.info('resuming from checkpoint <%s>, line <%s>',
+                    checkpoint, get_line_number(scanner.line_num))
+    else:
+        scanner = BuildLogScanner(log_file, timestamps)
+    scanner.on_target_failed = on_target_failed
+    scanner.share_subtrees = share_subtrees
+
+    last_checkpoint = time.monotonic()
+    pending = b''  # incomplete last line
+    with open(log_file, 'rb') as fp:
+        fp.seek(scanner.offset)
+        try:
+            while not scanner.is_finished():
+                raw = fp.readline()
+                if raw.endswith(b'\n'):
+                    scanner.scan_line(pending + raw if pending else raw)
+                    pending = b''
+                    idle = False
+                else:
+                    # end of log for now, wait for it to grow
+                    pending += raw
+                    idle = True
+                    if os.fstat(fp.fileno()).st_size < scanner.offset + len(pending):
+                        raise RuntimeError('build log <%s> was truncated' % log_file)
+
+                if checkpoint and (idle or scanner.line_num & 0xffff == 0) and \
+                        time.monotonic() - last_checkpoint >= checkpoint_interval:
+                    save_scanner_checkpoint(checkpoint, scanner)
+                    last_checkpoint = time.monotonic()
+                    logger.debug('checkpoint saved, line_number=%d', scanner.line_num)
+
+                if idle:
+                    time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            if checkpoint:
+                save_scanner_checkpoint(checkpoint, scanner)
+                logger.info('checkpoint saved to <%s>, line <%s>',
+                            checkpoint, get_line_number(scanner.line_num))
+            raise
+
+    if checkpoint:
+        save_scanner_checkpoint(checkpoint, scanner)
+    return scanner.finish()
+
+
+# fast failure scan: the failure lines and the make invocation nesting are found by
+# a bulk byte search, then only the invocations containing failures (and their
+# parents) are scanned line by line. other sub makes and all make database dumps
+# are reduced to the few lines the scanner needs from them.
+FAILURE_SCAN_MARKERS = [
+    (b'# GNU Make ', lambda ln: SUB_MAKE_PATTERN.search(ln) is not None),
+    (MK_DB_PRINT_BEGIN.encode(), lambda ln: ln.startswith(MK_DB_PRINT_BEGIN)),
+    (MK_DB_PRINT_END.encode(), lambda ln: ln.startswith(MK_DB_PRINT_END)),
+    (b"recipe for target ", lambda ln: TARGET_FAILED_PATTERN.search(ln) is not None)
+]
+MARK_SUB_MAKE = 0
+MARK_DB_BEGIN = 1
+MARK_DB_END = 2
+MARK_FAILED = 3
+DATABASE_SUMMARY_LITERALS = [(b'CURDIR', CURDIR_PATTERN),
+                             (b'.DEFAULT_GOAL', DEFAULT_GOAL_PATTERN),
+                             (b'MAKECMDGOALS', CMDGOALS_PATTERN)]
+COUNT_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+class InvocationRange(object):
+    # byte range of a make invocation in build log, from its "# GNU Make" header
+    # to the end of its make database dump
+    def __init__(self, start, header_end, parent):
+        self.start = start
+        self.header_end = header_end
+        self.end = None
+        self.db_begin = None  # offset of the database begin line
+        self.db_end = None  # offset of the database end line
+        self.parent = parent
+        self.children = []
+        self.failures = []  # offsets of failure lines
+        self.in_scope = False  # contains a failure, scanned line by line
+
+
+class FailureScanner(object):
+    def __init__(self, log_file, mm, timestamps=False):
+        self.log_file = log_file
+        self.mm = mm
+        self.timestamps = timestamps
+        self.count_offset = 0  # newlines before count_offset are counted in count_lines
+        self.count_lines = 0
+
+    def get_line(self, pos):
+        # (start, end) of the line containing pos, end includes the line ending
+        start = self.mm.rfind(b'\n', 0, pos) + 1
+        end = self.mm.find(b'\n', pos)
+        return start, len(self.mm) if end < 0 else end + 1
+
+    def decode_line(self, start, end):
+        ln = self.mm[start:end].decode('utf-8', errors='replace')
+        if self.timestamps:
+            m = TIMESTAMP_PATTERN.match(ln)
             if m:
-                target_name = m.group('target').strip()
-                assert (isinstance(current_invocation, MakeInvocation) and \
-                        isinstance(current_invocation.current_target, MakeTarget))
-
-                if target_name != current_invocation.current_target.name:
-                    continue
-
-                assert (current_invocation.current_target.state in [MTST_REMAKING, MTST_REMAKE_FAILED])
-                current_invocation.current_target.state = MTST_REMAKE_FAILED
-                current_invocation.current_target.failed_pos = line_num
-                current_invocation.current_target.end_pos = line_num
-                # postpone current target update
-                logger.debug('recipe failed for target <%s>, line_number=%d',
-                             target_name, line_num)
+                ln = ln[m.end():]
+        return ln
+
+    def find_line(self, literal, check, start, end):
+        # first line in [start, end) containing literal and passing check
+        pos = self.mm.find(literal, start, end)
+        while pos >= 0:
+            line_start, line_end = self.get_line(pos)
+            if check(self.decode_line(line_start, line_end)):
+                return line_start, line_end
+            pos = self.mm.find(literal, line_end, end)
+        return None
+
+    def find_markers(self):
+        markers = {}
+        for kind, (literal, check) in enumerate(FAILURE_SCAN_MARKERS):
+            pos = self.mm.find(literal)
+            while pos >= 0:
+                line_start, line_end = self.get_line(pos)
+                if line_start not in markers and check(self.decode_line(line_start, line_end)):
+                    markers[line_start] = (kind, line_end)
+                pos = self.mm.find(literal, line_end)
+        return sorted((start, kind, end) for start, (kind, end) in markers.items())
+
+    def build_ranges(self):
+        # nesting of make invocations, same rules as BuildLogScanner: lines inside
+        # a make database dump are ignored until its end line
+        root = None
+        stack = []
+        in_database = False
+        for start, kind, end in self.find_markers():
+            if in_database:
+                if kind == MARK_DB_END:
+                    node = stack.pop()
+                    node.db_end = start
+                    node.end = end
+                    in_database = False
                 continue
-
-            # <# Make data base, printed on ...>
-            if ln.startswith(MK_DB_PRINT_BEGIN):
-                assert (isinstance(current_invocation, MakeInvocation) and \
-                        current_invocation.database is None)
-                current_invocation.database = StringIO()
-                current_invocation.database.write(ln)
-                logger.debug('start collecting make database, line_number=%d',
-                             line_num)
-                # update current target
-                if isinstance(current_invocation.current_target, MakeTarget) and \
-                        current_invocation.current_target.state == MTST_REMAKE_FAILED:
-                    current_invocation.current_target = current_invocation.current_target.parent
+            if kind == MARK_SUB_MAKE:
+                parent = stack[-1] if stack else None
+                if parent is None and root is not None:
+                    # only the first top level make is part of the make tree
+                    break
+                node = InvocationRange(start, end, parent)
+                if parent is not None:
+                    parent.children.append(node)
+                else:
+                    root = node
+                stack.append(node)
+            elif kind == MARK_DB_BEGIN and stack:
+                stack[-1].db_begin = start
+                in_database = True
+            elif kind == MARK_FAILED and stack:
+                stack[-1].failures.append(start)
+
+        for node in stack:
+            node.end = len(self.mm)
+        return root
+
+    def get_segments(self, root):
+        # byte ranges of the lines to be scanned, in log order
+        segments = []
+        nodes = [root]
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, tuple):
+                segments.append(node)
                 continue
+            own_end = node.db_begin if node.db_begin is not None else node.end
+            pending = []
+            if node.in_scope:
+                pos = node.start
+                for child in node.children:
+                    pending.append((pos, child.start))
+                    pending.append(child)
+                    pos = child.end
+                pending.append((pos, own_end))
+            else:
+                pending.append((node.start, node.header_end))
+                limit = node.children[0].start if node.children else own_end
+                line = self.find_line(b"Reading makefile ", lambda ln: MAKEFILE_PATTERN.search(ln) is not None,
+                                      node.header_end, limit)
+                if line is not None:
+                    pending.append(line)
+            if node.db_begin is not None:
+                db_begin_end = self.get_line(node.db_begin)[1]
+                pending.append((node.db_begin, db_begin_end))
+                db_end = node.db_end if node.db_end is not None else node.end
+                lines = set()
+                for literal, pattern in DATABASE_SUMMARY_LITERALS:
+                    line = self.find_line(literal, lambda ln: pattern.search(ln) is not None,
+                                          db_begin_end, db_end)
+                    if line is not None:
+                        lines.add(line)
+                pending.extend(sorted(lines))
+                if node.db_end is not None:
+                    pending.append((node.db_end, node.end))
+            nodes.extend(reversed(pending))
+        return segments
+
+    def get_line_count(self, offset):
+        # number of lines before offset, offsets are requested in ascending order
+        while self.count_offset < offset:
+            chunk_end = min(offset, self.count_offset + COUNT_CHUNK_SIZE)
+            self.count_lines += self.mm[self.count_offset:chunk_end].count(b'\n')
+            self.count_offset = chunk_end
+        return self.count_lines
+
+    def scan(self):
+        root = self.build_ranges()
+        scanner = BuildLogScanner(self.log_file, self.timestamps)
+        if root is None:
+            return scanner
+
+        nodes = [root]
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.children)
+            if node.failures:
+                # the invocation and its parents are scanned line by line
+                while node is not None and not node.in_scope:
+                    node.in_scope = True
+                    node = node.parent
+
+        for start, end in self.get_segments(root):
+            if start >= end:
+                continue
+            scanner.line_num = self.get_line_count(start)
+            scanner.offset = start
+            for raw in BytesIO(self.mm[start:end]):
+                scanner.scan_line(raw)
+        return scanner
+
+
+def build_log_scan_failures(log_file, timestamps=False):
+    # make tree in which the failed targets, their target ancestry, prereqs and submakes
+    # are the same as in a full scan, other parts of the tree are incomplete
+    if get_build_log_format(log_file) != LOG_FORMAT_PLAIN or os.path.getsize(log_file) == 0:
+        return build_log_scan(log_file, timestamps=timestamps)
+    with open(log_file, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        scanner = FailureScanner(os.path.abspath(log_file), mm, timestamps).scan()
+    return scanner.top_level_invocation
+
+
+def iter_make_invocations(mkdb):
+    # all make invocations under a make invocation, in pre-order, without recursion
+    stack = [mkdb]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, MakeInvocation):
+            yield node
+            children = node.targets + node.submakes
+        else:
+            children = node.prereqs + node.submakes
+        stack.extend(reversed(children))
+
 
-    assert (current_invocation is None and \
-            make_level == 0)
-    return top_level_invocation
+def iter_make_targets(mkdb):
+    # all targets under a make invocation or target, in pre-order, without recursion
+    if not isinstance(mkdb, (MakeInvocation, MakeTarget)):
+        raise RuntimeError('invalid parameter')
+    stack = [mkdb]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, MakeInvocation):
+            children = node.targets + node.submakes
+        else:
+            yield node
+            children = node.prereqs + node.submakes
+        stack.extend(reversed(children))
+
+
+REGEX_SPECIAL_CHARS = set('.^$*+?{}[]()|\\')
+
+
+def get_literal_prefix(pattern):
+    # literal prefix of an anchored target name regex, e.g. '^foo/bar.*\\.o$' gives 'foo/bar'.
+    # returns (prefix, exact), exact is True if the regex matches the prefix only
+    if not isinstance(pattern.pattern, str) or \
+            pattern.flags & (re.IGNORECASE | re.VERBOSE) or \
+            not pattern.pattern.startswith('^') or '|' in pattern.pattern:
+        return '', False
+
+    src = pattern.pattern
+    prefix = []
+    pos = 1
+    while pos < len(src):
+        c = src[pos]
+        if c == '\\':
+            # escaped punctuation is a literal, anything else (\d, \w ...) is not
+            if pos + 1 >= len(src) or src[pos + 1].isalnum() or src[pos + 1] == '_':
+                break
+            c = src[pos + 1]
+            step = 2
+        elif c in REGEX_SPECIAL_CHARS:
+            break
+        else:
+            step = 1
+
+        quantifier = src[pos + step:pos + step + 1]
+        if quantifier in ('*', '?', '{'):
+            # optional character, not part of the prefix
+            break
+        prefix.append(c)
+        pos += step
+        if quantifier == '+':
+            break
+
+    exact = src[pos:] in ('$', '\\Z')
+    return ''.join(prefix), exact
+
+
+class TargetIndex(object):
+    # name and state indexes over an in-memory make tree, built once and then
+    # used by every find_target query on the same tree
+    def __init__(self, mkdb):
+        self.targets = list(iter_make_targets(mkdb))  # find_target order
+        self.by_name = {}  # target name -> positions in self.targets
+        self.by_state = {}  # target state -> positions in self.targets
+        for pos, target in enumerate(self.targets):
+            self.by_name.setdefault(target.name, []).append(pos)
+            self.by_state.setdefault(target.state, []).append(pos)
+        self.names = sorted(self.by_name)
+
+    def _lookup_prefix(self, prefix):
+        positions = []
+        idx = bisect.bisect_left(self.names, prefix)
+        while idx < len(self.names) and self.names[idx].startswith(prefix):
+            positions.extend(self.by_name[self.names[idx]])
+            idx += 1
+        positions.sort()
+        return positions
+
+    def find(self, filter):
+        candidates = None  # positions to check, all targets if None
+        name_pattern = filter.name_pattern
+        if name_pattern is not None:
+            prefix, exact = get_literal_prefix(name_pattern)
+            if exact:
+                candidates = self.by_name.get(prefix, [])
+                name_pattern = None
+            elif prefix:
+                candidates = self._lookup_prefix(prefix)
+
+        states = filter.get_states()
+        if states is not None:
+            positions = []
+            for state in states:
+                positions.extend(self.by_state.get(state, []))
+            if candidates is None:
+                positions.sort()
+                candidates = positions
+            else:
+                positions = set(positions)
+                candidates = [pos for pos in candidates if pos in positions]
 
+        if candidates is None:
+            candidates = range(len(self.targets))
 
-def load_make_database(mkdb_file):
-    with open(mkdb_file, 'rb') as fp:
-        return pickle.load(fp)
+        for pos in candidates:
+            target = self.targets[pos]
+            if name_pattern is not None and not name_pattern.search(target.name):
+                continue
+            if filter.excludes and any(x.search(target.name) for x in filter.excludes):
+                continue
+            yield target
 
 
-def save_make_database(mkdb_file, mkdb):
-    assert (isinstance(mkdb, MakeInvocation))
-    with open(mkdb_file, 'wb') as fp:
-        pickle.dump(mkdb, fp)
+# indexes of queried make trees, only of finished ones
+TARGET_INDEXES = weakref.WeakKeyDictionary()
 
 
-def find_target(mkdb, filter: TargetFilter):
+def is_finished_tree(mkdb):
+    # a make invocation is finished when it has printed its database, a target when it has an end
     if isinstance(mkdb, MakeInvocation):
-        for target in mkdb.targets:
-            yield from find_target(target, filter)
-        for submake in mkdb.submakes:
-            yield from find_target(submake, filter)
-    elif isinstance(mkdb, MakeTarget):
-        if mkdb.name.find('apps') >= 0:
-            pause = 1
-        discard = False
-        if filter.name_pattern is not None:
-            m = filter.name_pattern.search(mkdb.name)
-            if not m:
-                discard = True
-
-        if not discard and filter.state_filter is not None:
-            if mkdb.state == filter.state_filter:
-                pass
-            elif isinstance(filter.state_filter, (list, set)) and \
-                    mkdb.state in filter.state_filter:
-                pass
-            else:
-                discard = True
+        return mkdb.db_end_pos is not None
+    return mkdb.end_pos is not None
 
-        if filter.excludes:
-            for x in filter.excludes:
-                m = x.search(mkdb.name)
-                if m:
-                    discard = True
-                    break
 
-        if not discard:
-            yield mkdb
+def get_target_index(mkdb):
+    index = TARGET_INDEXES.get(mkdb)
+    if index is None:
+        index = TargetIndex(mkdb)
+        # a tree still being scanned gets new targets and states, its index is used only once
+        if is_finished_tree(mkdb):
+            TARGET_INDEXES[mkdb] = index
+    return index
 
-        for prereq in mkdb.prereqs:
-            yield from find_target(prereq, filter)
-        for submake in mkdb.submakes:
-            yield from find_target(submake, filter)
-    else:
-        raise RuntimeError('invalid parameter')
 
+def find_target(mkdb, filter: TargetFilter):
+    if isinstance(mkdb, (StoredMakeInvocation, StoredMakeTarget)):
+        # query the make database file directly
+        yield from mkdb.store.find_target(mkdb, filter)
+        return
+
+    yield from get_target_index(mkdb).find(filter)
 
-VERBOSE_LEVEL = {
-    'critical': logging.CRITICAL,
-    'fatal': logging.FATAL,
-    'error': logging.ERROR,
-    'warning': logging.WARNING,
-    'info': logging.INFO,
-    'debug': logging.DEBUG
-}
-DEFAULT_VERBOSE_LEVEL = logging.INFO
 
 NAME_TO_TARGET_STATE = {
     "succeed": MTST_REMADE,
@@ -487,30 +1839,35 @@ NAME_TO_TARGET_STATE = {
 }
 
 
-class LogWithIndent(logging.Formatter):
-    def format(self, record):
-        s = super().format(record)
-        lines = s.splitlines(keepends=True)
-        buffer = StringIO()
-        idx = 0
-        for ln in lines:
-            if idx == 0:
-                buffer.write(ln)
-            else:
-                buffer.write(INDENTION + ln)
-            idx += 1
-        return buffer.getvalue()
+def get_target_filter(target=None, state=None, excludes=None):
+    # TargetFilter from command line style options, None if nothing to filter
+    target_filter = None
+    if target:
+        target_filter = TargetFilter()
+        target_filter.name_pattern = re.compile(target)
 
+    if state:
+        state_filter = set([])
+        words = state.strip().split()
+        for w in words:
+            if w in NAME_TO_TARGET_STATE:
+                state_filter.add(NAME_TO_TARGET_STATE[w])
+        if state_filter:
+            if not target_filter:
+                target_filter = TargetFilter()
+            target_filter.state_filter = state_filter
 
-def init_logging(verbose):
-    formatter = LogWithIndent(fmt='[%(name)s - %(levelname)s]\n%(message)s')
-    handler = logging.StreamHandler()
-    handler.setFormatter(formatter)
-    logging.basicConfig(level=verbose, handlers=[handler])
+    if excludes:
+        if not target_filter:
+            target_filter = TargetFilter()
+
+        for x in excludes:
+            target_filter.excludes.append(re.compile(x))
+    return target_filter
 
 
-def main():
-    parser = argparse.ArgumentParser()
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog)
     parser.add_argument('-S', '--save', default=None)
     parser.add_argument('-L', '--load', default=None)
     parser.add_argument('-t', '--target', default=None)
@@ -519,24 +1876,106 @@ def main():
     parser.add_argument('-v', '--verbose', default=None)
     parser.add_argument('-d', '--details', default='d')
     parser.add_argument('-x', '--exclude', action='append', default=None)
-
-    options, args = parser.parse_known_args(sys.argv)
+    parser.add_argument('-F', '--format', choices=OUTPUT_FORMATS, default=None)
+    parser.add_argument('-T', '--timestamps', action='store_true', default=False)
+    parser.add_argument('-f', '--follow', action='store_true', default=False)
+    parser.add_argument('-C', '--checkpoint', default=None)
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--checkpoint-interval', type=float, default=60.0)
+    parser.add_argument('--stats', action='store_true', default=False)
+    parser.add_argument('--failures', action='store_true', default=False)
+    parser.add_argument('-N', '--output-lines', type=int, default=DEFAULT_OUTPUT_LINES)
+    parser.add_argument('--share-subtrees', action='store_true', default=False)
+
+    options = parser.parse_args(argv)
 
     # set up default output level
-    if options.verbose in VERBOSE_LEVEL:
-        verbose_level = VERBOSE_LEVEL[options.verbose]
-    else:
-        try:
-            verbose_level = int(options.verbose)
-        except (ValueError, TypeError):
-            verbose_level = DEFAULT_VERBOSE_LEVEL
-    init_logging(verbose_level)
+    init_logging(get_verbose_level(options.verbose))
 
     logger = logging.getLogger('APP')
-    if options.log:
-        mk = build_log_scan(options.log)
+    if options.format:
+        writer = TargetWriter(open_output_stream(), options.format, options.details,
+                              output_lines=options.output_lines)
+    else:
+        writer = None
+
+    if options.target:
+        logger.info('target name regexp: <{}>'.format(options.target))
+    target_filter = get_target_filter(options.target, options.state, options.exclude)
+
+    if options.failures:
+        # the fast failure scan only answers "which targets failed" on a partial make tree
+        if not options.log:
+            logger.error('a failure scan (--failures) needs a build log, please specify it with -l')
+            sys.exit(-1)
+        if options.save:
+            logger.error('the make tree of a failure scan is incomplete and can not be saved')
+            sys.exit(-1)
+        conflicts = [name for name, value in (('-s/--state', options.state),
+                                              ('-C/--checkpoint', options.checkpoint),
+                                              ('-f/--follow', options.follow),
+                                              ('--stats', options.stats),
+                                              ('--share-subtrees', options.share_subtrees)) if value]
+        if conflicts:
+            logger.error('a failure scan (--failures) can not be combined with %s', ', '.join(conflicts))
+            sys.exit(-1)
+
+    # targets already written by follow mode, not repeated by the final query
+    reported = set()
+
+    if options.log and options.follow:
+        def report_failed_target(target):
+            # a repeated failure line reports the target once
+            if id(target) in reported or (target_filter and not target_filter.match(target)):
+                return
+            reported.add(id(target))
+            if writer:
+                writer.write(target)
+                writer.fp.flush()
+            else:
+                target.dump(details=options.details, indent=-target.invocation.level,
+                            output_lines=options.output_lines)
+
+        try:
+            mk = follow_build_log(options.log, options.checkpoint,
+                                  poll_interval=options.poll_interval,
+                                  checkpoint_interval=options.checkpoint_interval,
+                                  on_target_failed=report_failed_target,
+                                  timestamps=options.timestamps,
+                                  share_subtrees=options.share_subtrees)
+        except (MakeDatabaseError, BuildLogFormatError, ScanStateError) as e:
+            logger.error('%s', e)
+            sys.exit(-1)
+        except KeyboardInterrupt:
+            logger.info('stopped following build log <%s>', options.log)
+            sys.exit(-1)
+    elif options.log and options.failures:
+        try:
+            mk = build_log_scan_failures(options.log, options.timestamps)
+        except (BuildLogFormatError, ScanStateError) as e:
+            logger.error('%s', e)
+            sys.exit(-1)
+        if mk is None:
+            logger.error('no make invocation found in build log <%s>', options.log)
+            sys.exit(-1)
+    elif options.log:
+        stats = ScanStats() if options.stats else None
+        try:
+            mk = build_log_scan(options.log, options.checkpoint, options.timestamps, stats,
+                                options.share_subtrees)
+        except (MakeDatabaseError, BuildLogFormatError, ScanStateError) as e:
+            if stats:
+                stats.dump()
+            logger.error('%s', e)
+            sys.exit(-1)
+        if stats:
+            stats.dump()
     elif options.load:
-        mk = load_make_database(options.load)
+        try:
+            mk = load_make_database(options.load)
+        except MakeDatabaseError as e:
+            logger.error('%s', e)
+            sys.exit(-1)
     else:
         logger.error('no make database file specified')
         sys.exit(-1)
@@ -546,35 +1985,26 @@ def main():
         logger.info('make database saved to file <%s>', options.save)
         sys.exit(0)
 
-    target_filter = None
-    if options.target:
-        logger.info('target name regexp: <{}>'.format(options.target))
-
-        target_filter = TargetFilter()
-        target_filter.name_pattern = re.compile(options.target)
-
-    if options.state:
-        state_filter = set([])
-        words = options.state.strip().split()
-        for w in words:
-            if w in NAME_TO_TARGET_STATE:
-                state_filter.add(NAME_TO_TARGET_STATE[w])
-        if state_filter:
-            if not target_filter:
-                target_filter = TargetFilter()
-            target_filter.state_filter = state_filter
-
-    if options.exclude:
+    if options.failures:
+        # only the failed targets of a fast failure scan are complete
         if not target_filter:
             target_filter = TargetFilter()
+        target_filter.state_filter = {MTST_REMAKE_FAILED}
 
-        for x in options.exclude:
-            target_filter.excludes.append(re.compile(x))
-
-    if target_filter:
+    if target_filter and writer:
+        writer.excludes = target_filter.excludes
+        for mk_target in find_target(mk, target_filter):
+            if id(mk_target) not in reported:
+                writer.write(mk_target)
+    elif target_filter:
         for mk_target in find_target(mk, target_filter):
+            if id(mk_target) in reported:
+                continue
             mk_target.dump(details=options.details, indent=-mk_target.invocation.level,
-                           excludes=target_filter.excludes)
+                           excludes=target_filter.excludes, output_lines=options.output_lines)
+
+    if writer:
+        writer.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,344 @@
+#! /usr/bin/python3
+
+# resident query server for scanned builds, and its client
+#
+# the server loads build logs or saved make databases once, keeps the make trees
+# and their target indexes in memory, and answers target queries over HTTP on
+# localhost or a Unix socket. queries run concurrently in threads on read-only
+# trees; a watcher thread follows the files on disk and swaps in a new tree once
+# it is complete, queries meanwhile, and those already running, use the old one.
+#
+#   build_log_server.py -a serve -p 8765 nightly=build.log last=last.mkdb
+#   build_log_server.py -a query -p 8765 -b nightly -t '\.o$' -s failed -d vvp
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+import http.client
+import http.server
+import socketserver
+import urllib.parse
+from io import StringIO
+
+from fwtools import init_logging, get_verbose_level
+from build_log_io import LOG_FORMAT_PLAIN, get_build_log_format
+from build_log_scan import LOAD_BUILD_ERRORS, BuildLogScanner, \
+    OUTPUT_FORMATS, TargetWriter, load_build, is_make_database_file, get_target_filter, \
+    get_target_index, find_target, iter_make_targets
+
+DEFAULT_PORT = 8765
+SERVER_ACTIONS = ['serve', 'query', 'list', 'reload']
+CLIENT_TIMEOUT = 600.0
+WATCH_INTERVAL = 2.0  # seconds between checks of the served files
+
+
+class LoadedBuild(object):
+    # a served build, updated by the watcher thread only: queries never load or
+    # scan, they get the last complete tree. a plain build log is followed, new
+    # lines are scanned as they are written and the tree is swapped in once the
+    # top level make finishes. other files are reloaded as a whole once they
+    # have not changed for a watch interval.
+    def __init__(self, name, file_name, timestamps=False):
+        self.name = name
+        self.file_name = os.path.abspath(file_name)
+        self.timestamps = timestamps
+        self.root = None  # replaced as a whole on reload, never modified
+        self.target_count = 0
+        self.file_stat = None  # (size, mtime) of the loaded file
+        self.error = None  # error of the last reload
+        self.error_stat = None  # (size, mtime) of the file that failed to load
+        self.changed_stat = None  # (size, mtime) of a change seen, loaded when it is seen again
+        self.scanner = None  # type: BuildLogScanner  # following a plain build log
+        self.lock = threading.Lock()  # serializes updates
+        self.logger = logging.getLogger('SERVER')
+
+    def get_file_stat(self):
+        stat = os.stat(self.file_name)
+        return stat.st_size, stat.st_mtime_ns
+
+    def set_root(self, root, file_stat):
+        get_target_index(root)
+        target_count = sum(1 for _ in iter_make_targets(root))
+
+        self.root, self.target_count, self.file_stat = root, target_count, file_stat
+        self.error = None
+        self.logger.info('build <%s> loaded from <%s>, %d targets', self.name, self.file_name, target_count)
+
+    def follow(self, file_stat):
+        # scan the lines written since the last update, a shorter or, once
+        # finished, changed log was rewritten and is scanned from the start
+        scanner = self.scanner
+        if scanner is None or file_stat[0] < scanner.offset or scanner.is_finished():
+            scanner = self.scanner = BuildLogScanner(self.file_name, self.timestamps)
+        with open(self.file_name, 'rb') as fp:
+            fp.seek(scanner.offset)
+            for raw in fp:
+                if not raw.endswith(b'\n'):
+                    # incomplete last line, scanned when the log grows
+                    break
+                scanner.scan_line(raw)
+                if scanner.is_finished():
+                    break
+        if scanner.is_finished():
+            self.set_root(scanner.finish(), file_stat)
+        else:
+            self.logger.debug('build <%s> still being written, line <%d>', self.name, scanner.line_num)
+
+    def update(self, force=False):
+        # brings the tree up to date with the file, force reloads it as a whole
+        with self.lock:
+            file_stat = self.get_file_stat()
+            if force:
+                self.scanner = None
+            elif file_stat in (self.file_stat, self.error_stat):
+                return
+            try:
+                if not is_make_database_file(self.file_name) and \
+                        get_build_log_format(self.file_name) == LOG_FORMAT_PLAIN:
+                    self.follow(file_stat)
+                elif force or self.root is None or file_stat == self.changed_stat:
+                    # plain objects, no SQLite connection shared between threads
+                    self.set_root(load_build(self.file_name, self.timestamps, plain=True), file_stat)
+                else:
+                    self.changed_stat = file_stat
+            except LOAD_BUILD_ERRORS as e:
+                self.error = str(e)
+                self.error_stat = file_stat
+                self.scanner = None
+                self.logger.warning('loading build <%s> failed: %s', self.name, e)
+                if self.root is None:
+                    raise
+
+    def get_info(self):
+        return {
+            'name': self.name,
+            'file': self.file_name,
+            'targets': self.target_count,
+            'following': self.scanner is not None and not self.scanner.is_finished(),
+            'error': self.error
+        }
+
+
+def watch_builds(builds, interval=WATCH_INTERVAL):
+    # watcher thread, keeps the served builds up to date
+    logger = logging.getLogger('SERVER')
+    while True:
+        time.sleep(interval)
+        for build in builds.values():
+            try:
+                build.update()
+            except Exception as e:
+                # e.g. the file was removed, reported once, the old tree is still served
+                if str(e) != build.error:
+                    build.error = str(e)
+                    logger.warning('updating build <%s> failed: %s', build.name, e)
+
+
+class QueryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class QueryHandler(http.server.BaseHTTPRequestHandler):
+    # GET /builds, /targets?build=&target=&state=&exclude=&details=&format=, /reload?build=
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # client address is empty on a Unix socket
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logging.getLogger('SERVER').debug('%s - %s', self.address_string(), format % args)
+
+    def get_build(self, params):
+        builds = self.server.builds
+        name = params.get('build', [None])[0]
+        if name is None:
+            if len(builds) != 1:
+                raise QueryError(400, 'please specify a build, one of: ' + ', '.join(builds))
+            return next(iter(builds.values()))
+        if name not in builds:
+            raise QueryError(404, 'unknown build <{}>'.format(name))
+        return builds[name]
+
+    def query_targets(self, params):
+        build = self.get_build(params)
+        output_format = params.get('format', ['text'])[0]
+        if output_format not in OUTPUT_FORMATS:
+            raise QueryError(400, 'unknown format <{}>'.format(output_format))
+        try:
+            target_filter = get_target_filter(params.get('target', [None])[0], params.get('state', [None])[0],
+                                              params.get('exclude'))
+        except Exception as e:
+            raise QueryError(400, 'invalid query: {}'.format(e))
+
+        root = build.root
+        if root is None:
+            raise QueryError(503, 'build <{}> is not loaded yet{}'.format(
+                build.name, ': ' + build.error if build.error else ''))
+
+        buffer = StringIO()
+        if target_filter:
+            writer = TargetWriter(buffer, output_format, params.get('details', ['d'])[0],
+                                  target_filter.excludes)
+            for target in find_target(root, target_filter):
+                writer.write(target)
+            writer.close()
+        return buffer.getvalue(), 'application/json' if output_format != 'text' else 'text/plain'
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        try:
+            if url.path == '/targets':
+                body, content_type = self.query_targets(params)
+            elif url.path == '/builds':
+                body = json.dumps([build.get_info() for build in self.server.builds.values()]) + '\n'
+                content_type = 'application/json'
+            elif url.path == '/reload':
+                build = self.get_build(params)
+                try:
+                    build.update(force=True)
+                except LOAD_BUILD_ERRORS as e:
+                    raise QueryError(500, 'reloading build <{}> failed: {}'.format(build.name, e))
+                body, content_type = json.dumps(build.get_info()) + '\n', 'application/json'
+            else:
+                raise QueryError(404, 'unknown path <{}>'.format(url.path))
+            status = 200
+        except QueryError as e:
+            status, body, content_type = e.status, str(e) + '\n', 'text/plain'
+
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(builds, port=DEFAULT_PORT, unix_socket=None, watch_interval=WATCH_INTERVAL):
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, QueryHandler)
+        address = unix_socket
+    else:
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', port), QueryHandler)
+        server.daemon_threads = True
+        address = 'http://127.0.0.1:{}'.format(port)
+    server.builds = builds
+
+    threading.Thread(target=watch_builds, args=(builds, watch_interval), daemon=True).start()
+
+    logger = logging.getLogger('SERVER')
+    logger.info('serving %d builds at <%s>', len(builds), address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('server stopped')
+    finally:
+        server.server_close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, unix_socket, timeout=CLIENT_TIMEOUT):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_socket = unix_socket
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_socket)
+
+
+def request(path, params, port=DEFAULT_PORT, unix_socket=None):
+    # (status, body) of a server request
+    if unix_socket:
+        conn = UnixHTTPConnection(unix_socket)
+    else:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=CLIENT_TIMEOUT)
+    try:
+        query = urllib.parse.urlencode([(k, v) for k, v in params if v is not None])
+        conn.request('GET', path + ('?' + query if query else ''))
+        response = conn.getresponse()
+        return response.status, response.read().decode('utf-8')
+    finally:
+        conn.close()
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('-a', '--action', choices=SERVER_ACTIONS, default='query')
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('-u', '--unix', default=None)
+    parser.add_argument('-b', '--build', default=None)
+    parser.add_argument('-t', '--target', default=None)
+    parser.add_argument('-s', '--state', default=None)
+    parser.add_argument('-x', '--exclude', action='append', default=None)
+    parser.add_argument('-d', '--details', default='d')
+    parser.add_argument('-F', '--format', choices=OUTPUT_FORMATS, default='text')
+    parser.add_argument('-T', '--timestamps', action='store_true', default=False)
+    parser.add_argument('-w', '--watch-interval', type=float, default=WATCH_INTERVAL)
+    parser.add_argument('-v', '--verbose', default=None)
+    parser.add_argument('builds', nargs='*', help='[name=]file of a build to serve')
+
+    options = parser.parse_args(argv)
+
+    init_logging(get_verbose_level(options.verbose))
+
+    logger = logging.getLogger('APP')
+    if options.action == 'serve':
+        # [name=]file, name defaults to the file name
+        builds = {}
+        for arg in options.builds:
+            name, sep, file_name = arg.rpartition('=')
+            if not sep:
+                name = os.path.basename(file_name)
+            builds[name] = LoadedBuild(name, file_name, options.timestamps)
+        if not builds:
+            logger.error('no build log or make database file specified')
+            sys.exit(-1)
+        try:
+            for build in builds.values():
+                build.update()
+        except LOAD_BUILD_ERRORS as e:
+            logger.error('%s', e)
+            sys.exit(-1)
+        serve(builds, options.port, options.unix, options.watch_interval)
+        return
+
+    if options.action == 'query':
+        path = '/targets'
+        params = [('build', options.build), ('target', options.target), ('state', options.state),
+                  ('details', options.details), ('format', options.format)]
+        params.extend(('exclude', x) for x in options.exclude or [])
+    elif options.action == 'reload':
+        path, params = '/reload', [('build', options.build)]
+    else:
+        path, params = '/builds', []
+
+    try:
+        status, body = request(path, params, options.port, options.unix)
+    except OSError as e:
+        logger.error('can not connect to server: %s', e)
+        sys.exit(-1)
+    if status != 200:
+        logger.error('%s', body.strip())
+        sys.exit(-1)
+    sys.stdout.write(body)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+#! /usr/bin/python3
+
+# single command line entry point of the firmware image and build log tools
+#
+# every tool is a subcommand, its module is imported only when the subcommand
+# runs, so e.g. "fwtools chk" does not load the build log scanner. "fwtools run"
+# runs a script of subcommands, one command line per line, in one interpreter:
+# modules and their caches are loaded once for the whole script instead of once
+# per command.
+#
+#   fwtools scan -l build.log -s failed -d o
+#   fwtools run release.fwt
+#   fwtools run -k - < release.fwt
+#
+# also the logging setup shared by all tools.
+
+import sys
+import shlex
+import logging
+import argparse
+import importlib
+from io import StringIO
+
+INDENTION = '--'
+
+VERBOSE_LEVEL = {
+    'critical': logging.CRITICAL,
+    'fatal': logging.FATAL,
+    'error': logging.ERROR,
+    'warning': logging.WARNING,
+    'info': logging.INFO,
+    'debug': logging.DEBUG
+}
+DEFAULT_VERBOSE_LEVEL = logging.INFO
+
+# subcommand -> (module, description), a module is imported when its subcommand runs
+COMMANDS = {
+    'scan': ('build_log_scan', 'scan or follow a build log, query and save its make tree'),
+    'batch': ('build_log_batch', 'analyze many build logs in parallel'),
+    'database': ('build_log_database', 'query the make database dumps of a build log'),
+    'diff': ('build_log_diff', 'differences between two builds'),
+    'profile': ('build_log_profile', 'critical path and self times of a build'),
+    'graph': ('build_log_graph', 'export the dependency graph of a build'),
+    'server': ('build_log_server', 'resident query server for builds, and its client'),
+    'gen': ('build_log_gen', 'generate a synthetic build log'),
+    'bench': ('build_log_bench', 'benchmark the build log scanner'),
+    'log': ('build_log_io', 'compress and index build logs'),
+    'chk': ('netgear_chk_image', 'check Netgear chk firmware images, extract kernel and rootfs'),
+}
+
+
+class LogWithIndent(logging.Formatter):
+    def __init__(self, fmt=None, indention=INDENTION):
+        super().__init__(fmt)
+        self.indention = indention
+
+    def format(self, record):
+        s = super().format(record)
+        lines = s.splitlines(keepends=True)
+        buffer = StringIO()
+        idx = 0
+        for ln in lines:
+            if idx == 0:
+                buffer.write(ln)
+            else:
+                buffer.write(self.indention + ln)
+            idx += 1
+        return buffer.getvalue()
+
+
+def init_logging(verbose, indention=INDENTION):
+    # replaces an earlier setup, each command of a script sets its own level
+    formatter = LogWithIndent(fmt='[%(name)s - %(levelname)s]\n%(message)s', indention=indention)
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logging.basicConfig(level=verbose, handlers=[handler], force=True)
+
+
+def get_verbose_level(verbose):
+    # logging level of a -v option, a level name or number
+    if verbose in VERBOSE_LEVEL:
+        return VERBOSE_LEVEL[verbose]
+    try:
+        return int(verbose)
+    except (ValueError, TypeError):
+        return DEFAULT_VERBOSE_LEVEL
+
+
+def run_command(argv, line_num=None):
+    # runs one subcommand, returns its exit status; errors of the command are
+    # logged, with the script line number if any, and do not stop the caller
+    name = argv[0]
+    try:
+        module = importlib.import_module(COMMANDS[name][0])
+    except ImportError as e:
+        # e.g. construct, needed by chk only
+        logging.getLogger('RUN').error('command <%s> is not available: %s', name, e)
+        return 1
+    try:
+        module.main(argv[1:], prog='fwtools ' + name)
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        sys.stderr.write('{}\n'.format(e.code))
+        return 1
+    except Exception as e:
+        logger = logging.getLogger('RUN')
+        if line_num is not None:
+            logger.error('line <%d>: command <%s> failed: %s: %s', line_num, name, type(e).__name__, e)
+        else:
+            logger.error('command <%s> failed: %s: %s', name, type(e).__name__, e)
+        logger.debug('traceback', exc_info=True)
+        return 1
+    return 0
+
+
+def run_script(fp, keep_going=False):
+    # runs the command lines of a script, stops at the first failure unless keep_going,
+    # returns the exit status of the first failed command
+    logger = logging.getLogger('RUN')
+    status = 0
+    for line_num, ln in enumerate(fp, 1):
+        try:
+            argv = shlex.split(ln, comments=True)
+        except ValueError as e:
+            logger.error('line <%d>: %s', line_num, e)
+            command_status = 2
+        else:
+            if not argv:
+                continue
+            if argv[0] not in COMMANDS:
+                logger.error('line <%d>: unknown command <%s>', line_num, argv[0])
+                command_status = 2
+            else:
+                command_status = run_command(argv, line_num)
+        if command_status:
+            logger.error('line <%d>: failed with exit status %s', line_num, command_status)
+            status = status or command_status
+            if not keep_going:
+                break
+    return status
+
+
+def get_usage():
+    buffer = StringIO()
+    buffer.write('usage: fwtools <command> [options]\n\n')
+    buffer.write('commands:\n')
+    for name, (module, description) in COMMANDS.items():
+        buffer.write('  {:<10}{}\n'.format(name, description))
+    buffer.write('  {:<10}{}\n'.format('run', 'run a script of commands, one per line, in one process'))
+    buffer.write('\n"fwtools <command> -h" shows the options of a command\n')
+    return buffer.getvalue()
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv or argv[0] in ('-h', '--help'):
+        sys.stdout.write(get_usage())
+        sys.exit(0 if argv else 2)
+
+    if argv[0] == 'run':
+        parser = argparse.ArgumentParser(prog='fwtools run')
+        parser.add_argument('script', help='script file, - for stdin')
+        parser.add_argument('-k', '--keep-going', action='store_true', default=False)
+        parser.add_argument('-v', '--verbose', default=None)
+        options = parser.parse_args(argv[1:])
+        init_logging(get_verbose_level(options.verbose))
+        if options.script == '-':
+            sys.exit(run_script(sys.stdin, options.keep_going))
+        try:
+            fp = open(options.script)
+        except OSError as e:
+            logging.getLogger('RUN').error('can not open script: %s', e)
+            sys.exit(-1)
+        with fp:
+            sys.exit(run_script(fp, options.keep_going))
+
+    if argv[0] not in COMMANDS:
+        sys.stderr.write('unknown command <{}>\n\n'.format(argv[0]))
+        sys.stderr.write(get_usage())
+        sys.exit(2)
+    sys.exit(run_command(argv))
+
+
+if __name__ == '__main__':
+    main()
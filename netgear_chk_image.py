@@ -5,7 +5,8 @@ import os, sys
 import typing
 import argparse
 import logging
-from io import StringIO
+
+from fwtools import init_logging
 
 CHUNK_SIZE = 64 * 1024
 
@@ -248,28 +249,6 @@ def netgear_image_load_header(fp: typing.IO):
 INDENTION = ' '
 
 
-class LogWithIndent(logging.Formatter):
-    def format(self, record):
-        s = super().format(record)
-        lines = s.splitlines(keepends=True)
-        buffer = StringIO()
-        idx = 0
-        for ln in lines:
-            if idx == 0:
-                buffer.write(ln)
-            else:
-                buffer.write(INDENTION + ln)
-            idx += 1
-        return buffer.getvalue()
-
-
-def init_logging(verbose):
-    formatter = LogWithIndent(fmt='[%(name)s - %(levelname)s]\n%(message)s')
-    handler = logging.StreamHandler()
-    handler.setFormatter(formatter)
-    logging.basicConfig(level=verbose, handlers=[handler])
-
-
 def extract_kernel_image(chk_image, kernel_image=None):
     logger = logging.getLogger('EXTRACT')
     with open(chk_image, 'rb') as fp:
@@ -384,34 +363,35 @@ def brcm_extract_rootfs_image(image_data, token):
     return image_data[pos:], fstype
 
 
-def main():
-    parser = argparse.ArgumentParser()
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog)
     parser.add_argument('-a', '--action', default=None)
     parser.add_argument('-w', '--firmware', default=None)
     parser.add_argument('-v', '--verbose', action='store_true', default=False)
     parser.add_argument('-o', '--output', default=None)
+    parser.add_argument('firmware_file', nargs='?', default=None)
 
-    options, args = parser.parse_known_args(sys.argv)
+    options = parser.parse_args(argv)
 
     # set up message logging
     if options.verbose:
         verbose_flags = logging.DEBUG
     else:
         verbose_flags = logging.INFO
-    init_logging(verbose_flags)
+    init_logging(verbose_flags, INDENTION)
 
     logger = logging.getLogger('MAIN')
 
     # check command line
     if options.action in set(['check', 'info', 'extract_rootfs', 'extract_kernel', 'extract_rootfs_2']):
-        if not options.firmware and len(args) < 2:
+        if not options.firmware and not options.firmware_file:
             logger.error('please specify the firmware file')
             sys.exit(-1)
 
         if options.firmware:
             firmware = options.firmware
         else:
-            firmware = args[1]
+            firmware = options.firmware_file
 
         if not os.path.isfile(firmware):
             logger.error('firmware file <%s> does not exist', firmware)
@@ -0,0 +1,77 @@
+# build logs of a small make project for the tests, written by running "make -d -p"
+#
+# the top level makefile runs a sub make in each of d1, d2 and d3, a sub make
+# builds four objects into lib.a. in a failing build the recipe of d2/f3.o
+# fails and make stops there.
+
+import os
+import re
+import shutil
+import subprocess
+import unittest
+
+TOP_MAKEFILE = """SUBDIRS = d1 d2 d3
+all: $(SUBDIRS)
+$(SUBDIRS):
+\t$(MAKE) -C $@
+.PHONY: all $(SUBDIRS)
+"""
+SUB_MAKEFILE = """CFLAGS = -O2 -DDIR
+OBJS = f1.o f2.o f3.o f4.o
+HDRS = a.h b.h c.h
+all: lib.a
+lib.a: $(OBJS)
+\t@echo ar $@; touch $@
+%.o: %.c $(HDRS)
+\t@echo cc $<; touch $@{check}
+"""
+FAILING_CHECK = '; test $@ != f3.o'
+SUBDIRS = ['d1', 'd2', 'd3']
+SOURCES = ['a.h', 'b.h', 'c.h', 'f1.c', 'f2.c', 'f3.c', 'f4.c']
+# make 4.2 and later report a failed recipe in one line, rewritten to the two
+# lines of the versions the scanner reads
+FAILED_RECIPE_PATTERN = re.compile(rb"^(?P<make>make(?:\[[0-9]+\])?): \*\*\* "
+                                   rb"\[(?P<makefile>[^:\]]+):(?P<line>[0-9]+): (?P<target>[^\]]+)\] (?P<error>.*\n)$")
+TIMESTAMP_START = 1700000000.0
+TIMESTAMP_STEP = 0.001  # seconds per log line
+
+requires_make = unittest.skipUnless(shutil.which('make'), 'make is not installed')
+
+
+def make_project(project_dir, failing=False):
+    with open(os.path.join(project_dir, 'Makefile'), 'w') as fp:
+        fp.write(TOP_MAKEFILE)
+    for subdir in SUBDIRS:
+        os.mkdir(os.path.join(project_dir, subdir))
+        with open(os.path.join(project_dir, subdir, 'Makefile'), 'w') as fp:
+            fp.write(SUB_MAKEFILE.format(check=FAILING_CHECK if failing and subdir == 'd2' else ''))
+        for name in SOURCES:
+            open(os.path.join(project_dir, subdir, name), 'w').close()
+
+
+def make_build_log(tmp_dir, name='build.log', failing=False, timestamps=False):
+    # path of the log of a clean build of a new project
+    project_dir = os.path.join(tmp_dir, name + '.project')
+    os.mkdir(project_dir)
+    make_project(project_dir, failing)
+    log_file = os.path.join(tmp_dir, name)
+    run_make(project_dir, log_file, timestamps)
+    return log_file
+
+
+def run_make(project_dir, log_file, timestamps=False):
+    # the environment is part of the make database dump, keep it small
+    env = {'PATH': os.environ.get('PATH', os.defpath), 'LC_ALL': 'C'}
+    output = subprocess.run(['make', '-d', '-p'], cwd=project_dir, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout
+    with open(log_file, 'wb') as fp:
+        for line_num, ln in enumerate(output.splitlines(keepends=True)):
+            m = FAILED_RECIPE_PATTERN.match(ln)
+            if m:
+                ln = b"%s:%s: recipe for target '%s' failed\n%s: *** [%s] %s" % (
+                    m.group('makefile'), m.group('line'), m.group('target'),
+                    m.group('make'), m.group('target'), m.group('error'))
+            for part in ln.splitlines(keepends=True):
+                if timestamps:
+                    fp.write(b'%.3f ' % (TIMESTAMP_START + line_num * TIMESTAMP_STEP))
+                fp.write(part)
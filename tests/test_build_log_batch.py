@@ -0,0 +1,81 @@
+# tests of build_log_batch on logs of a small make project, see build_logs.py
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from build_logs import requires_make, make_build_log
+from build_log_batch import BatchCache, scan_build_log_stats, batch_scan
+
+
+def find_key(keys, suffix):
+    found = [key for key in keys if key.endswith(suffix)]
+    assert len(found) == 1, found
+    return found[0]
+
+
+@requires_make
+class BatchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.clean_log = make_build_log(cls.tmp_dir, name='clean.log')
+        cls.failing_log = make_build_log(cls.tmp_dir, name='failing.log', failing=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+
+    def test_failure_snippet(self):
+        stats = scan_build_log_stats(self.failing_log, snippet_lines=3)
+        self.assertTrue(stats['complete'])
+        self.assertIsNone(stats['error'])
+        targets = stats['targets']
+        f3 = targets[find_key(targets, '/d2:f3.o')]
+        self.assertEqual(f3['states'], ['failed'])
+        failure, = f3['failures']
+        self.assertEqual(len(failure['text']), 3)
+        self.assertEqual(failure['text'][0], 'cc f3.c')
+        self.assertEqual(failure['text'][-1], "Makefile:8: recipe for target 'f3.o' failed")
+        self.assertFalse(targets[find_key(targets, '/d1:f3.o')]['failures'])
+
+    def test_incomplete_log(self):
+        part_file = os.path.join(self.tmp_dir, 'part.log')
+        with open(self.failing_log, 'rb') as fp, open(part_file, 'wb') as outfp:
+            outfp.write(fp.read(os.path.getsize(self.failing_log) // 2))
+        stats = scan_build_log_stats(part_file)
+        self.assertFalse(stats['complete'])
+        self.assertTrue(stats['targets'])
+
+    def test_report(self):
+        log_files = [self.clean_log, self.failing_log]
+        report = batch_scan(log_files, self.cache_dir, jobs=2)
+        self.assertEqual([log['log'] for log in report.logs], log_files)
+        self.assertEqual([log['failed'] for log in report.logs], [0, 2])
+        self.assertTrue(all(log['complete'] for log in report.logs))
+        # the projects of the logs are in separate directories
+        f3 = report.targets[find_key(report.targets, 'failing.log.project/d2:f3.o')]
+        self.assertEqual((f3['builds'], f3['remade'], f3['failed']), (1, 1, 1))
+        self.assertEqual(f3['snippets'][0]['log'], self.failing_log)
+
+    def test_cache(self):
+        batch_scan([self.failing_log], self.cache_dir, jobs=1)
+        cache = BatchCache(self.cache_dir)
+        stats = cache.load(self.failing_log)
+        self.assertEqual(stats, scan_build_log_stats(self.failing_log))
+        # scanned again with other options or after the log changed
+        self.assertIsNone(cache.load(self.failing_log, timestamps=True))
+        stat = os.stat(self.failing_log)
+        os.utime(self.failing_log, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        try:
+            self.assertIsNone(cache.load(self.failing_log))
+        finally:
+            os.utime(self.failing_log, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+# tests of build_log_database, the parser of the make database dumps
+
+import os
+import gc
+import shutil
+import tempfile
+import unittest
+
+from build_logs import requires_make, make_build_log
+from build_log_scan import MK_DB_PRINT_BEGIN, MakeDatabaseError, build_log_scan, save_make_database, \
+    load_make_database, iter_make_invocations
+from build_log_database import PARSED_DATABASES, parse_make_database, get_make_database, find_variable, find_rules
+
+DATABASE = MK_DB_PRINT_BEGIN + """
+
+# Variables
+
+# automatic
+@D = $(patsubst %/,%,$(dir $@))
+# makefile (from 'Makefile', line 1)
+CFLAGS := -O2
+# makefile (from 'Makefile', line 2)
+define RECIPE
+echo one
+echo two
+endef
+# environment
+PATH = /bin
+
+# Implicit Rules
+
+%.o: %.c
+#  recipe to execute (from 'Makefile', line 9):
+\t$(CC) -c $<
+
+# Files
+
+# Not a target:
+Makefile:
+#  Implicit rule search has not been done.
+
+# makefile (from 'Makefile', line 4)
+app: CFLAGS += -g
+app: main.o | out
+#  Phony target (prerequisite of .PHONY).
+#  recipe to execute (from 'Makefile', line 6):
+\t$(CC) -o $@ $^
+\t@echo done
+
+clean::
+#  recipe to execute (from 'Makefile', line 11):
+\trm -f *.o
+
+clean:: distclean
+#  recipe to execute (from 'Makefile', line 13):
+\trm -f app
+
+# files hash-table stats:
+"""
+
+
+class ParseMakeDatabaseTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db = parse_make_database(DATABASE)
+
+    def test_variables(self):
+        variables = self.db.variables
+        self.assertEqual(variables['CFLAGS'].value, '-O2')
+        self.assertEqual(variables['CFLAGS'].flavor, ':=')
+        self.assertEqual(variables['CFLAGS'].origin, 'makefile')
+        self.assertEqual(variables['CFLAGS'].location, ('Makefile', 1))
+        self.assertEqual(variables['RECIPE'].value, 'echo one\necho two')
+        self.assertEqual(variables['RECIPE'].location, ('Makefile', 2))
+        self.assertEqual(variables['PATH'].origin, 'environment')
+        self.assertIsNone(variables['PATH'].location)
+        self.assertEqual(variables['@D'].origin, 'automatic')
+
+    def test_pattern_rules(self):
+        rule, = self.db.pattern_rules_by_target['%.o']
+        self.assertEqual(rule.prereqs, ['%.c'])
+        self.assertEqual(rule.recipe, ['$(CC) -c $<'])
+        self.assertEqual(rule.recipe_location, ('Makefile', 9))
+
+    def test_files(self):
+        app, = self.db.get_rules('app')
+        self.assertEqual(app.prereqs, ['main.o'])
+        self.assertEqual(app.order_only, ['out'])
+        self.assertTrue(app.phony)
+        self.assertEqual(app.recipe, ['$(CC) -o $@ $^', '@echo done'])
+        self.assertEqual(app.recipe_location, ('Makefile', 6))
+        self.assertEqual(app.variables['CFLAGS'].value, '-g')
+        self.assertEqual(app.variables['CFLAGS'].flavor, '+=')
+        self.assertEqual(app.variables['CFLAGS'].location, ('Makefile', 4))
+
+        self.assertFalse(self.db.get_rules('Makefile')[0].is_target)
+        self.assertEqual([rule.get_name() for rule in self.db.get_explicit_rules()], ['app', 'clean', 'clean'])
+        clean = self.db.get_rules('clean')
+        self.assertEqual([rule.double_colon for rule in clean], [True, True])
+        self.assertEqual([rule.prereqs for rule in clean], [[], ['distclean']])
+        self.assertEqual(self.db.get_rules('missing'), [])
+
+    def test_timestamps(self):
+        # time stamp prefixes of the lines are stripped
+        text = ''.join('1700000000.000 ' + ln for ln in DATABASE.splitlines(True))
+        db = parse_make_database(text)
+        self.assertEqual(db.variables['RECIPE'].value, 'echo one\necho two')
+        self.assertEqual(db.get_rules('app')[0].recipe, self.db.get_rules('app')[0].recipe)
+
+
+@requires_make
+class MakeDatabaseQueryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.log_file = make_build_log(cls.tmp_dir)
+        cls.root = build_log_scan(cls.log_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_variable(self):
+        found = list(find_variable(self.root, 'CFLAGS'))
+        self.assertEqual([os.path.basename(os.path.dirname(invocation.get_makefile())) for invocation, _ in found],
+                         ['d1', 'd2', 'd3'])
+        for invocation, variable in found:
+            self.assertEqual(variable.value, '-O2 -DDIR')
+            self.assertEqual(variable.origin, 'makefile')
+            self.assertEqual(variable.location, ('Makefile', 1))
+
+    def test_rules(self):
+        found = list(find_rules(self.root, 'f3.o'))
+        self.assertEqual(len(found), 3)
+        for invocation, rule in found:
+            self.assertEqual(rule.prereqs, ['f3.c', 'a.h', 'b.h', 'c.h'])
+            self.assertEqual(rule.recipe, ['@echo cc $<; touch $@'])
+            self.assertEqual(rule.recipe_location, ('Makefile', 8))
+        # the pattern rule of the makefile, besides the built-in ones
+        pattern_rules = [rule for _, rule in find_rules(self.root, '%.o') if rule.recipe_location is not None]
+        self.assertEqual(len(pattern_rules), 3)
+        self.assertEqual(pattern_rules[0].prereqs, ['%.c', 'a.h', 'b.h', 'c.h'])
+
+    def test_saved_make_database(self):
+        # the database dumps are read from the build log of the saved tree
+        mkdb_file = os.path.join(self.tmp_dir, 'build.mkdb')
+        save_make_database(mkdb_file, self.root)
+        found = list(find_variable(load_make_database(mkdb_file), 'CFLAGS'))
+        self.assertEqual([variable.value for _, variable in found], ['-O2 -DDIR'] * 3)
+
+    def test_timestamped_log(self):
+        log_file = make_build_log(self.tmp_dir, name='timestamped.log', timestamps=True)
+        found = list(find_rules(build_log_scan(log_file, timestamps=True), 'f3.o'))
+        self.assertEqual([rule.recipe for _, rule in found], [['@echo cc $<; touch $@']] * 3)
+
+    def test_parsed_once(self):
+        # a database is parsed once per invocation and dropped with its tree
+        root = build_log_scan(self.log_file)
+        invocation = list(iter_make_invocations(root))[1]
+        self.assertIs(get_make_database(invocation), get_make_database(invocation))
+        self.assertIn(invocation, PARSED_DATABASES)
+        count = len(PARSED_DATABASES)
+        del root, invocation
+        gc.collect()
+        self.assertLess(len(PARSED_DATABASES), count)
+
+    def test_changed_log(self):
+        # the dumps of a saved tree are not read from a build log changed since the scan
+        log_file = os.path.join(self.tmp_dir, 'changed.log')
+        shutil.copyfile(self.log_file, log_file)
+        mkdb_file = os.path.join(self.tmp_dir, 'changed.mkdb')
+        save_make_database(mkdb_file, build_log_scan(log_file))
+        with open(log_file, 'ab') as fp:
+            fp.write(b'one more line\n')
+        with self.assertRaises(MakeDatabaseError):
+            list(find_variable(load_make_database(mkdb_file), 'CFLAGS'))
+        os.remove(log_file)
+        with self.assertRaises(MakeDatabaseError):
+            list(find_rules(load_make_database(mkdb_file), 'f3.o'))
+
+if __name__ == '__main__':
+    unittest.main()
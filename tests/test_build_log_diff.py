@@ -0,0 +1,81 @@
+# tests of build_log_diff on a failing build and its rebuild after the fix
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from build_logs import requires_make, make_build_log, run_make, SUB_MAKEFILE
+from build_log_scan import MakeInvocation, load_build, save_make_database, build_log_scan
+from build_log_diff import TARGET_OTHER, TARGET_UP_TO_DATE, TARGET_REMADE, TARGET_FAILED, diff_builds
+
+
+def get_changes(changes):
+    # (directory of the makefile, target name) -> old summary
+    return {(os.path.basename(os.path.dirname(invocation_key[1])), name): old_summary
+            for (invocation_key, name), old_summary in changes}
+
+
+@requires_make
+class BuildDiffTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.failed_log = make_build_log(cls.tmp_dir, failing=True)
+        project_dir = cls.failed_log + '.project'
+        with open(os.path.join(project_dir, 'd2', 'Makefile'), 'w') as fp:
+            fp.write(SUB_MAKEFILE.format(check=''))
+        cls.rebuild_log = os.path.join(cls.tmp_dir, 'rebuild.log')
+        run_make(project_dir, cls.rebuild_log)
+        cls.failed_root = build_log_scan(cls.failed_log)
+        cls.rebuild_root = build_log_scan(cls.rebuild_log)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_rebuild(self):
+        diff = diff_builds(self.failed_root, self.rebuild_root)
+        self.assertEqual(diff.newly_failed, [])
+        remade = get_changes(diff.newly_remade)
+        self.assertEqual(remade[('build.log.project', 'd2')], TARGET_FAILED)
+        # not remade after f3.o failed
+        self.assertEqual(remade[('d2', 'lib.a')], TARGET_OTHER)
+        self.assertIsNone(remade[('d3', 'f1.o')])
+        up_to_date = get_changes(diff.newly_up_to_date)
+        self.assertEqual(up_to_date[('d1', 'f1.o')], TARGET_REMADE)
+        # the recipe of f3.o touched it before it failed
+        self.assertEqual(up_to_date[('d2', 'f3.o')], TARGET_FAILED)
+        self.assertEqual([key[1].rsplit('/', 2)[-2] for key in diff.added_submakes], ['d3'])
+        self.assertEqual(diff.removed_submakes, [])
+        self.assertEqual(diff.removed_targets, 0)
+        self.assertGreater(diff.added_targets, 0)
+
+    def test_reverse(self):
+        diff = diff_builds(self.rebuild_root, self.failed_root)
+        failed = get_changes(diff.newly_failed)
+        self.assertEqual(sorted(name for _, name in failed), ['d2', 'f3.o'])
+        self.assertEqual(failed[('d2', 'f3.o')], TARGET_UP_TO_DATE)
+        self.assertEqual([key[1].rsplit('/', 2)[-2] for key in diff.removed_submakes], ['d3'])
+
+    def test_same_build(self):
+        diff = diff_builds(self.failed_root, self.failed_root)
+        self.assertEqual((diff.newly_failed, diff.newly_remade, diff.newly_up_to_date), ([], [], []))
+        self.assertEqual((diff.added_submakes, diff.removed_submakes), ([], []))
+        self.assertEqual((diff.added_targets, diff.removed_targets), (0, 0))
+
+    def test_make_database(self):
+        # a saved make database diffs the same as its build log
+        mkdb_file = os.path.join(self.tmp_dir, 'failed.mkdb')
+        save_make_database(mkdb_file, self.failed_root)
+        root = load_build(mkdb_file, plain=True)
+        self.assertIsInstance(root, MakeInvocation)
+        expected = diff_builds(self.failed_root, self.rebuild_root)
+        diff = diff_builds(root, self.rebuild_root)
+        for name in ('newly_failed', 'newly_remade', 'newly_up_to_date', 'added_submakes', 'removed_submakes',
+                     'added_targets', 'removed_targets'):
+            self.assertEqual(getattr(diff, name), getattr(expected, name))
+
+
+if __name__ == '__main__':
+    unittest.main()
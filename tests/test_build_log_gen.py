@@ -0,0 +1,59 @@
+# tests of build_log_gen, the generator of synthetic build logs
+
+import re
+import unittest
+from io import StringIO
+
+from build_log_gen import LogParams, BuildLogGenerator
+
+RECIPE_PATTERN = re.compile(r'cc -O2 -c (\S+) -o (\S+)$')
+NOISE_PATTERN = re.compile(r"(?:In file included from )?(\S+?):(?:\d+:|\d+:\d+: | In function )")
+CHILD_PATTERN = re.compile(r'(Live|Reaping winning|Reaping losing|Removing) child (0x[0-9a-f]+) .*PID (\d+)')
+
+
+def generate_lines(failure_rate=0.0):
+    params = LogParams()
+    params.failure_rate = failure_rate
+    params.noise = 3.0
+    buffer = StringIO()
+    BuildLogGenerator(buffer, params).generate()
+    return buffer.getvalue().splitlines()
+
+
+class BuildLogGeneratorTest(unittest.TestCase):
+    def test_noise_lines(self):
+        # the compiler messages of a recipe are about its source
+        source = None
+        count = 0
+        for ln in generate_lines():
+            m = RECIPE_PATTERN.match(ln)
+            if m:
+                source = m.group(1)
+            elif ln.startswith('Reaping '):
+                source = None
+            m = NOISE_PATTERN.match(ln)
+            if m and source:
+                self.assertEqual(m.group(1), source)
+                count += 1
+        self.assertGreater(count, 0)
+
+    def test_child_pids(self):
+        # a child is reaped and removed with the PID it was started with, also after
+        # the children of a sub make
+        for failure_rate in (0.0, 0.05):
+            pids = {}
+            reaped = 0
+            for ln in generate_lines(failure_rate):
+                m = CHILD_PATTERN.match(ln)
+                if not m:
+                    continue
+                if m.group(1) == 'Live':
+                    pids[m.group(2)] = m.group(3)
+                else:
+                    self.assertEqual(m.group(3), pids[m.group(2)], ln)
+                    reaped += 1
+            self.assertEqual(reaped, 2 * len(pids))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# tests of build_log_graph on logs of a small make project, see build_logs.py
+
+import re
+import shutil
+import tempfile
+import unittest
+from io import StringIO
+from xml.etree import ElementTree
+
+from build_logs import requires_make, make_build_log
+from build_log_scan import MakeInvocation, MakeTarget, build_log_scan, iter_make_targets
+from build_log_graph import EDGE_PREREQ, EDGE_SUBMAKE, get_target_key, build_dependency_graph
+
+GRAPHML_NS = '{http://graphml.graphdrawing.org/xmlns}'
+
+
+def new_target(name, invocation, parent=None):
+    target = MakeTarget(name, parent)
+    target.invocation = invocation
+    (parent.prereqs if parent is not None else invocation.targets).append(target)
+    return target
+
+
+class DuplicateEdgeTest(unittest.TestCase):
+    def test_duplicate_prereqs(self):
+        # a target considered twice and a prereq listed twice give one edge each
+        invocation = MakeInvocation(1, None, None)
+        invocation.makefile = 'Makefile'
+        for _ in range(2):
+            target = new_target('all', invocation)
+            new_target('a.o', invocation, target)
+            new_target('a.o', invocation, target)
+            new_target('all', invocation, target)
+        graph = build_dependency_graph(invocation)
+        self.assertEqual(graph.get_node_count(), 2)
+        self.assertEqual(list(graph.iter_edges()), [(0, 1, EDGE_PREREQ)])
+        # the edges of a tree added again are there already
+        graph.add_make_tree(invocation)
+        self.assertEqual(list(graph.iter_edges()), [(0, 1, EDGE_PREREQ)])
+        self.assertEqual(list(graph.reverse.neighbors(1)), [0])
+
+
+@requires_make
+class DependencyGraphTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.root = build_log_scan(make_build_log(cls.tmp_dir, failing=True))
+        cls.graph = build_dependency_graph(cls.root)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def find_node(self, label):
+        nodes = self.graph.find_nodes(re.compile(label))
+        self.assertEqual(len(nodes), 1)
+        return nodes[0]
+
+    def test_nodes(self):
+        keys = set(get_target_key(target) for target in iter_make_targets(self.root))
+        self.assertEqual(self.graph.get_node_count(), len(keys))
+        failed = [self.graph.get_label(node) for node in range(self.graph.get_node_count())
+                  if self.graph.node_failed[node]]
+        self.assertEqual(len(failed), 2)
+        self.assertTrue(failed[0].endswith(':d2'))
+        self.assertTrue(failed[1].endswith('/d2:f3.o'))
+
+    def test_edges(self):
+        graph = self.graph
+        edges = list(graph.iter_edges())
+        self.assertEqual(len(edges), graph.get_edge_count())
+        self.assertEqual(len(set((src, dst) for src, dst, _ in edges)), len(edges))
+        for src, dst, kind in edges:
+            self.assertIn(dst, graph.forward.neighbors(src))
+            self.assertIn(src, graph.reverse.neighbors(dst))
+        submake_edges = [(src, dst) for src, dst, kind in edges if kind == EDGE_SUBMAKE]
+        self.assertIn((self.find_node(r'project:d2$'), self.find_node(r'/d2:all$')), submake_edges)
+
+    def test_closure(self):
+        f3 = self.find_node(r'/d2:f3\.o$')
+        self.assertEqual([self.graph.get_label(node).rsplit('/', 1)[-1] for node in self.graph.closure([f3])],
+                         ['d2:f3.o', 'd2:f3.c'])
+        pulled_in = [self.graph.get_label(node).rsplit('/', 1)[-1] for node in self.graph.closure([f3], True)]
+        self.assertEqual(pulled_in, ['d2:f3.o', 'd2:lib.a', 'd2:all', 'build.log.project:d2',
+                                     'build.log.project:all'])
+
+    def test_dot(self):
+        buffer = StringIO()
+        self.graph.write_dot(buffer)
+        lines = buffer.getvalue().splitlines()
+        self.assertEqual(lines[0], 'digraph make {')
+        self.assertEqual(lines[-1], '}')
+        self.assertEqual(len([ln for ln in lines if ' -> ' in ln]), self.graph.get_edge_count())
+        self.assertEqual(len([ln for ln in lines if 'color=red' in ln]), 2)
+
+    def test_graphml(self):
+        f3 = self.find_node(r'/d2:f3\.o$')
+        nodes = self.graph.closure([f3], True)
+        buffer = StringIO()
+        self.graph.write_graphml(buffer, nodes)
+        graph = ElementTree.fromstring(buffer.getvalue()).find(GRAPHML_NS + 'graph')
+        self.assertEqual(len(graph.findall(GRAPHML_NS + 'node')), len(nodes))
+        # the edges between the selected nodes only
+        self.assertEqual(len(graph.findall(GRAPHML_NS + 'edge')), len(nodes) - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
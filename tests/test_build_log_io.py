@@ -0,0 +1,90 @@
+# tests of build_log_io: plain and compressed build logs, their seek indexes and range reads
+
+import os
+import gzip
+import lzma
+import shutil
+import tempfile
+import unittest
+
+from build_log_io import LOG_FORMAT_PLAIN, LOG_FORMAT_GZIP, LOG_FORMAT_XZ, LOG_FORMAT_ZSTD, INDEX_SUFFIX, \
+    BuildLogFormatError, BuildLogIndex, zstandard, get_build_log_format, iter_build_log_lines, \
+    read_build_log_range, compress_build_log
+
+LINES = [b'line %d of the build log\n' % i for i in range(20000)]
+DATA = b''.join(LINES)
+MEMBER_SIZE = 64 * 1024
+RANGES = [(0, 10), (1000, 1000), (MEMBER_SIZE - 5, MEMBER_SIZE + 5), (3 * MEMBER_SIZE + 7, 5 * MEMBER_SIZE),
+          (len(DATA) - 30, len(DATA)), (0, len(DATA))]
+
+
+class BuildLogIoTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.tmp_dir, 'build.log')
+        with open(self.log_file, 'wb') as fp:
+            fp.write(DATA)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def assert_readable(self, log_file, log_format):
+        self.assertEqual(get_build_log_format(log_file), log_format)
+        self.assertEqual(list(iter_build_log_lines(log_file)), LINES)
+        offset = len(b''.join(LINES[:1234]))
+        self.assertEqual(list(iter_build_log_lines(log_file, offset)), LINES[1234:])
+        for start, end in RANGES:
+            self.assertEqual(read_build_log_range(log_file, start, end), DATA[start:end])
+
+    def test_plain(self):
+        self.assert_readable(self.log_file, LOG_FORMAT_PLAIN)
+
+    def test_single_member_gzip(self):
+        archive_file = self.log_file + '.gz'
+        with gzip.open(archive_file, 'wb') as fp:
+            fp.write(DATA)
+        self.assert_readable(archive_file, LOG_FORMAT_GZIP)
+
+    def test_single_stream_xz(self):
+        archive_file = self.log_file + '.xz'
+        with lzma.open(archive_file, 'wb') as fp:
+            fp.write(DATA)
+        self.assert_readable(archive_file, LOG_FORMAT_XZ)
+
+    def assert_archive(self, suffix, log_format):
+        archive_file = self.log_file + suffix
+        index = compress_build_log(self.log_file, archive_file, member_size=MEMBER_SIZE)
+        self.assertEqual(len(index.members), (len(DATA) + MEMBER_SIZE - 1) // MEMBER_SIZE)
+        self.assertTrue(os.path.isfile(archive_file + INDEX_SUFFIX))
+        self.assertEqual(BuildLogIndex.load(archive_file).members, index.members)
+        self.assert_readable(archive_file, log_format)
+
+    def test_archive_gzip(self):
+        self.assert_archive('.gz', LOG_FORMAT_GZIP)
+        # still a valid gzip file of the whole log
+        with gzip.open(self.log_file + '.gz', 'rb') as fp:
+            self.assertEqual(fp.read(), DATA)
+
+    def test_archive_xz(self):
+        self.assert_archive('.xz', LOG_FORMAT_XZ)
+        with lzma.open(self.log_file + '.xz', 'rb') as fp:
+            self.assertEqual(fp.read(), DATA)
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_archive_zstd(self):
+        self.assert_archive('.zst', LOG_FORMAT_ZSTD)
+
+    def test_unknown_archive_suffix(self):
+        with self.assertRaises(BuildLogFormatError):
+            compress_build_log(self.log_file, self.log_file + '.bz2')
+
+    def test_index_of_changed_archive(self):
+        archive_file = self.log_file + '.gz'
+        compress_build_log(self.log_file, archive_file, member_size=MEMBER_SIZE)
+        with open(archive_file, 'ab') as fp:
+            fp.write(gzip.compress(b'one more line\n'))
+        self.assertIsNone(BuildLogIndex.load(archive_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+# tests of build_log_profile and of the time stamps of build_log_scan
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from build_logs import requires_make, make_build_log, TIMESTAMP_START
+from build_log_scan import MakeInvocation, MakeTarget, TIMESTAMP_PATTERN, MTST_REMADE, \
+    build_log_scan, parse_timestamp, iter_make_targets, save_make_database, load_build
+from build_log_profile import BuildProfile, get_covered_time
+
+
+def parse(ln):
+    m = TIMESTAMP_PATTERN.match(ln)
+    return parse_timestamp(m) if m else None
+
+
+def new_invocation(level, start, end, parent=None, for_target=None):
+    invocation = MakeInvocation(level, parent, for_target)
+    invocation.start_time, invocation.end_time = start, end
+    if for_target is not None:
+        for_target.submakes.append(invocation)
+    return invocation
+
+
+def new_target(name, invocation, start, end, parent=None):
+    target = MakeTarget(name, parent)
+    target.invocation = invocation
+    target.state = MTST_REMADE
+    target.start_time, target.end_time = start, end
+    (parent.prereqs if parent is not None else invocation.targets).append(target)
+    return target
+
+
+class TimestampTest(unittest.TestCase):
+    def test_formats(self):
+        self.assertEqual(parse('1700000000.25 make'), 1700000000.25)
+        self.assertEqual(parse('[1700000000] make'), 1700000000.0)
+        self.assertEqual(parse('2024-01-01 00:00:01.5 make') - parse('2024-01-01 00:00:00 make'), 1.5)
+        self.assertEqual(parse('2024-01-02T00:00:00 make') - parse('2024-01-01 23:59:59 make'), 1.0)
+        self.assertEqual(parse('Jan  1 10:00:00 make') - parse('Jan  1 09:59:58 make'), 2.0)
+        self.assertEqual(parse('0:01:02,5 make'), 62.5)
+
+    def test_no_time_stamp(self):
+        self.assertIsNone(parse('make: Entering directory'))
+        self.assertIsNone(parse('10:00 make'))
+
+
+class BuildProfileTest(unittest.TestCase):
+    # top level make [0, 10] with goal "all", whose recipe runs a sub make [2, 8]
+    # building "x.o" [2, 7] and "y.o" [5, 8]
+    def setUp(self):
+        self.root = new_invocation(1, 0.0, 10.0)
+        self.all = new_target('all', self.root, 0.0, 10.0)
+        self.submake = new_invocation(2, 2.0, 8.0, self.root, self.all)
+        self.x = new_target('x.o', self.submake, 2.0, 7.0)
+        self.y = new_target('y.o', self.submake, 5.0, 8.0)
+        self.profile = BuildProfile(self.root)
+
+    def test_self_times(self):
+        self_times = self.profile.self_times
+        self.assertEqual(self_times[id(self.all)], 4.0)
+        self.assertEqual(self_times[id(self.submake)], 0.0)
+        self.assertEqual(self_times[id(self.x)], 5.0)
+        self.assertEqual(self_times[id(self.y)], 3.0)
+
+    def test_critical_path(self):
+        self.assertEqual(self.profile.get_critical_path(), [self.root, self.all, self.submake, self.x])
+        self.assertEqual(self.profile.path_times[id(self.root)], 9.0)
+
+    def test_top_targets(self):
+        self.assertEqual(self.profile.get_top_targets(2), [self.x, self.all])
+
+    def test_level_parallelism(self):
+        # the top level runs alone for 4s, the sub make for 6s with 8s of target time
+        self.assertEqual(self.profile.get_level_parallelism(), {1: (4.0, 4.0, 1), 2: (8.0, 6.0, 1)})
+
+    def test_covered_time(self):
+        self.assertEqual(get_covered_time([(1.0, 3.0), (2.0, 4.0), (6.0, 12.0)], 0.0, 10.0), 7.0)
+        self.assertEqual(get_covered_time([], 0.0, 10.0), 0.0)
+
+
+@requires_make
+class TimestampedLogTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.log_file = make_build_log(cls.tmp_dir, timestamps=True)
+        cls.plain_log_file = make_build_log(cls.tmp_dir, name='plain.log')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_times(self):
+        root = build_log_scan(self.log_file, timestamps=True)
+        self.assertEqual(root.start_time, TIMESTAMP_START)
+        self.assertGreater(root.end_time, root.start_time)
+        for target in iter_make_targets(root):
+            self.assertGreaterEqual(target.start_time, target.invocation.start_time)
+            self.assertLessEqual(target.end_time, target.invocation.end_time)
+
+    def test_profile(self):
+        profile = BuildProfile(build_log_scan(self.log_file, timestamps=True))
+        self.assertTrue(profile.has_timestamps())
+        levels = profile.get_level_parallelism()
+        self.assertEqual(sorted(levels), [1, 2])
+        self.assertEqual(levels[2][2], 3)
+        # the wall times of the levels add up to the build time
+        build_time = profile.root.end_time - profile.root.start_time
+        self.assertAlmostEqual(levels[1][1] + levels[2][1], build_time, places=6)
+        self.assertLess(levels[1][1], build_time / 2)
+
+    def test_without_time_stamps(self):
+        self.assertFalse(BuildProfile(build_log_scan(self.plain_log_file)).has_timestamps())
+
+    def test_load_build(self):
+        # the profiler takes a build log or a saved make database
+        root = load_build(self.log_file, timestamps=True)
+        mkdb_file = os.path.join(self.tmp_dir, 'build.mkdb')
+        save_make_database(mkdb_file, root)
+        loaded = load_build(mkdb_file)
+        self.assertEqual([(t.name, t.start_time, t.end_time) for t in iter_make_targets(loaded)],
+                         [(t.name, t.start_time, t.end_time) for t in iter_make_targets(root)])
+
+
+if __name__ == '__main__':
+    unittest.main()
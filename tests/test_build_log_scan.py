@@ -0,0 +1,537 @@
+# tests of build_log_scan on logs of a small make project, see build_logs.py
+
+import os
+import re
+import gzip
+import json
+import shutil
+import tempfile
+import threading
+import sys
+import unittest
+import subprocess
+from io import StringIO
+from array import array
+
+from build_logs import requires_make, make_build_log
+from build_log_gen import LogParams, generate_build_log
+from build_log_io import BuildLogFormatError, compress_build_log
+from build_log_scan import MTST_REMADE, MTST_REMAKE_FAILED, MTST_UP_TO_DATE, MTST_PREREQ_COLLECTING, \
+    MTST_PREREQ_COLLECTED, SCAN_EVENT_MUST_REMAKE, SCAN_EVENT_CONSIDERING, SCAN_EVENT_DATABASE, MakeInvocation, \
+    MakeTarget, SharedMakeTarget, MakeDatabaseError, ScanStateError, ScanStats, TargetFilter, build_log_scan, save_make_database, load_make_database, find_target, \
+    iter_make_targets, get_literal_prefix, follow_build_log, TargetWriter, build_log_scan_failures, \
+    get_target_output, main
+
+DUMP_DETAILS = 'vvpm'
+SCAN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'build_log_scan.py')
+
+
+def get_filter(name=None, states=None):
+    target_filter = TargetFilter()
+    if name is not None:
+        target_filter.name_pattern = re.compile(name)
+    if states is not None:
+        target_filter.state_filter = set(states)
+    return target_filter
+
+
+def dump_targets(root, target_filter=None, details=DUMP_DETAILS):
+    # same as the dump of the command line
+    buffer = StringIO()
+    for target in find_target(root, target_filter or get_filter()):
+        target.dump(details=details, indent=-target.invocation.level, buffer=buffer)
+    return buffer.getvalue()
+
+
+@requires_make
+class MakeDatabaseTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.log_file = make_build_log(cls.tmp_dir, failing=True)
+        cls.root = build_log_scan(cls.log_file)
+        cls.mkdb_file = os.path.join(cls.tmp_dir, 'build.mkdb')
+        save_make_database(cls.mkdb_file, cls.root)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_round_trip(self):
+        expected = dump_targets(self.root)
+        self.assertTrue(expected)
+        self.assertEqual(dump_targets(load_make_database(self.mkdb_file)), expected)
+
+    def test_query(self):
+        root = load_make_database(self.mkdb_file)
+        failed = [t.name for t in find_target(root, get_filter(states=[MTST_REMAKE_FAILED]))]
+        self.assertEqual(failed, ['d2', 'f3.o'])
+        target_filter = get_filter(name=r'\.o$', states=[MTST_REMAKE_FAILED])
+        self.assertEqual(dump_targets(root, target_filter), dump_targets(self.root, target_filter))
+
+    def test_not_a_make_database(self):
+        with self.assertRaises(MakeDatabaseError):
+            load_make_database(self.log_file)
+
+
+@requires_make
+class FindTargetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.root = build_log_scan(make_build_log(cls.tmp_dir, failing=True))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def assert_same_targets(self, target_filter):
+        # the index gives the targets of a walk of the tree, in the same order
+        expected = []
+        for target in iter_make_targets(self.root):
+            if target_filter.name_pattern is not None and not target_filter.name_pattern.search(target.name):
+                continue
+            if target_filter.state_filter is not None and target.state not in target_filter.state_filter:
+                continue
+            if any(x.search(target.name) for x in target_filter.excludes):
+                continue
+            expected.append(target)
+        self.assertEqual(list(find_target(self.root, target_filter)), expected)
+        return expected
+
+    def test_all(self):
+        self.assertEqual(len(self.assert_same_targets(get_filter())), len(list(iter_make_targets(self.root))))
+
+    def test_name(self):
+        self.assertTrue(self.assert_same_targets(get_filter(name=r'^lib\.a$')))
+        self.assertTrue(self.assert_same_targets(get_filter(name=r'^f[0-9]+\.o$')))
+        self.assertTrue(self.assert_same_targets(get_filter(name=r'\.h$')))
+        self.assertFalse(self.assert_same_targets(get_filter(name=r'^missing')))
+
+    def test_state(self):
+        self.assertTrue(self.assert_same_targets(get_filter(states=[MTST_REMADE, MTST_REMAKE_FAILED])))
+        self.assertTrue(self.assert_same_targets(get_filter(name=r'^f', states=[MTST_UP_TO_DATE])))
+
+    def test_excludes(self):
+        target_filter = get_filter(name=r'^f')
+        target_filter.excludes = [re.compile(r'\.c$')]
+        self.assertTrue(self.assert_same_targets(target_filter))
+
+    def test_literal_prefix(self):
+        self.assertEqual(get_literal_prefix(re.compile(r'^foo/bar.*\.o$')), ('foo/bar', False))
+        self.assertEqual(get_literal_prefix(re.compile(r'^lib\.a$')), ('lib.a', True))
+        self.assertEqual(get_literal_prefix(re.compile(r'^fo?')), ('f', False))
+        self.assertEqual(get_literal_prefix(re.compile(r'lib')), ('', False))
+        self.assertEqual(get_literal_prefix(re.compile(r'^a|^b')), ('', False))
+
+    def test_tree_being_scanned(self):
+        # the index of an unfinished tree is not kept, a later query sees new targets
+        invocation = MakeInvocation(1, None, None)
+        target = MakeTarget('a.o')
+        target.invocation = invocation
+        invocation.targets.append(target)
+        self.assertEqual([t.name for t in find_target(invocation, get_filter())], ['a.o'])
+        target = MakeTarget('b.o')
+        target.invocation = invocation
+        invocation.targets.append(target)
+        self.assertEqual([t.name for t in find_target(invocation, get_filter())], ['a.o', 'b.o'])
+
+
+
+def copy_log(log_file, part_file, size=None):
+    # the first size bytes of a build log, all of it if None
+    with open(log_file, 'rb') as fp:
+        data = fp.read() if size is None else fp.read(size)
+    with open(part_file, 'wb') as fp:
+        fp.write(data)
+
+
+def get_line_end(log_file, text):
+    # byte offset after the line containing text
+    with open(log_file, 'rb') as fp:
+        data = fp.read()
+    return data.index(b'\n', data.index(text.encode())) + 1
+
+
+@requires_make
+class FollowTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.log_file = make_build_log(cls.tmp_dir, failing=True)
+        cls.expected = dump_targets(build_log_scan(cls.log_file))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def setUp(self):
+        self.part_file = os.path.join(self.tmp_dir, 'part.log')
+        self.checkpoint = os.path.join(self.tmp_dir, 'part.ckpt')
+        for name in (self.part_file, self.checkpoint):
+            if os.path.exists(name):
+                os.remove(name)
+
+    def test_follow(self):
+        failed = []
+        root = follow_build_log(self.log_file, poll_interval=0.01,
+                                on_target_failed=lambda target: failed.append(target.name))
+        self.assertEqual(failed, ['f3.o', 'd2'])
+        self.assertEqual(dump_targets(root), self.expected)
+
+    def test_follow_growing_log(self):
+        # the log grows by a part of a line at a time while it is followed
+        copy_log(self.log_file, self.part_file, 1000)
+        result = []
+        thread = threading.Thread(target=lambda: result.append(
+            follow_build_log(self.part_file, poll_interval=0.001)), daemon=True)
+        thread.start()
+        with open(self.log_file, 'rb') as src, open(self.part_file, 'ab') as dst:
+            src.seek(1000)
+            for data in iter(lambda: src.read(50000), b''):
+                dst.write(data)
+                dst.flush()
+        thread.join(10.0)
+        self.assertEqual(dump_targets(result[0]), self.expected)
+
+    def test_resume_checkpoint(self):
+        # a scan of the log written so far fails, the checkpoint it leaves resumes the scan later
+        copy_log(self.log_file, self.part_file, get_line_end(self.log_file, "Considering target file 'f3.o'"))
+        with self.assertRaises(AssertionError):
+            build_log_scan(self.part_file, checkpoint=self.checkpoint)
+        self.assertTrue(os.path.isfile(self.checkpoint))
+        copy_log(self.log_file, self.part_file)
+        self.assertEqual(dump_targets(build_log_scan(self.part_file, checkpoint=self.checkpoint)),
+                         self.expected)
+
+    def test_resume_partial_line(self):
+        # the log written so far ends inside a line, the checkpoint is saved before that line
+        copy_log(self.log_file, self.part_file, get_line_end(self.log_file, "Considering target file 'f3.o'") + 5)
+        with self.assertRaises(AssertionError):
+            build_log_scan(self.part_file, checkpoint=self.checkpoint)
+        copy_log(self.log_file, self.part_file)
+        self.assertEqual(dump_targets(build_log_scan(self.part_file, checkpoint=self.checkpoint)),
+                         self.expected)
+
+    def test_repeated_failure_line(self):
+        # a failed target is written once, also if its failure line is repeated
+        with open(self.log_file, 'rb') as fp:
+            data = fp.read()
+        end = get_line_end(self.log_file, "recipe for target 'f3.o' failed")
+        with open(self.part_file, 'wb') as fp:
+            fp.write(data[:end] + data[data.rindex(b'\n', 0, end - 1) + 1:end] + data[end:])
+        output = subprocess.run([sys.executable, SCAN_SCRIPT, '-l', self.part_file, '-f', '-F', 'ndjson',
+                                 '-s', 'failed', '--poll-interval', '0.01'],
+                                stdout=subprocess.PIPE, check=True).stdout
+        self.assertEqual([json.loads(ln)['name'] for ln in output.splitlines()], ['f3.o', 'd2'])
+
+    def test_checkpoint_of_other_log(self):
+        copy_log(self.log_file, self.part_file, get_line_end(self.log_file, "Considering target file 'f3.o'"))
+        with self.assertRaises(AssertionError):
+            build_log_scan(self.part_file, checkpoint=self.checkpoint)
+        with open(self.part_file, 'wb') as fp:
+            fp.write(b'\n' * 100000)
+        with self.assertRaises(MakeDatabaseError):
+            build_log_scan(self.part_file, checkpoint=self.checkpoint)
+
+
+
+@requires_make
+class CompressedLogTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.log_file = make_build_log(cls.tmp_dir, failing=True)
+        cls.expected = dump_targets(build_log_scan(cls.log_file))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_gzip(self):
+        archive_file = self.log_file + '.gz'
+        with open(self.log_file, 'rb') as fp, gzip.open(archive_file, 'wb') as outfp:
+            shutil.copyfileobj(fp, outfp)
+        self.assertEqual(dump_targets(build_log_scan(archive_file)), self.expected)
+        with self.assertRaises(BuildLogFormatError):
+            follow_build_log(archive_file)
+
+    def test_archive(self):
+        archive_file = self.log_file + '.xz'
+        compress_build_log(self.log_file, archive_file, member_size=16 * 1024)
+        self.assertEqual(dump_targets(build_log_scan(archive_file)), self.expected)
+
+
+
+@requires_make
+class TargetWriterTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.root = build_log_scan(make_build_log(cls.tmp_dir, failing=True))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def write_targets(self, output_format, target_filter):
+        buffer = StringIO()
+        writer = TargetWriter(buffer, output_format, DUMP_DETAILS)
+        for target in find_target(self.root, target_filter):
+            writer.write(target)
+        writer.close()
+        return buffer.getvalue()
+
+    def test_text(self):
+        target_filter = get_filter(name=r'\.o$')
+        self.assertEqual(self.write_targets('text', target_filter), dump_targets(self.root, target_filter))
+
+    def test_ndjson(self):
+        lines = self.write_targets('ndjson', get_filter(name=r'\.o$')).splitlines()
+        records = [json.loads(ln) for ln in lines]
+        self.assertEqual([r['name'] for r in records],
+                         [t.name for t in find_target(self.root, get_filter(name=r'\.o$'))])
+        failed = [r for r in records if r['state'] == 'failed']
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(failed[0]['name'], 'f3.o')
+        self.assertEqual(failed[0]['parent'], 'lib.a')
+        self.assertEqual(failed[0]['prereqs'][0], 'f3.c')
+        self.assertEqual(failed[0]['level'], 2)
+        self.assertIsNotNone(failed[0]['failed_pos'])
+
+    def test_json(self):
+        records = json.loads(self.write_targets('json', get_filter(states=[MTST_REMAKE_FAILED])))
+        self.assertEqual([r['name'] for r in records], ['d2', 'f3.o'])
+        self.assertEqual(records[0]['submakes'][0]['level'], 2)
+        self.assertEqual(self.write_targets('json', get_filter(name='^missing$')), '[]\n')
+
+    def test_json_without_query(self):
+        # e.g. an error before the query, stdout stays empty
+        buffer = StringIO()
+        TargetWriter(buffer, 'json')
+        self.assertEqual(buffer.getvalue(), '')
+
+
+@requires_make
+class ScanStatsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.log_file = make_build_log(cls.tmp_dir)
+        with open(cls.log_file, 'rb') as fp:
+            cls.lines = fp.readlines()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_stats(self):
+        stats = ScanStats()
+        root = build_log_scan(self.log_file, stats=stats)
+        targets = list(iter_make_targets(root))
+        self.assertEqual(stats.lines, len(self.lines))
+        self.assertEqual(stats.bytes, os.path.getsize(self.log_file))
+        self.assertEqual(stats.event_counts[SCAN_EVENT_CONSIDERING], len(targets))
+        self.assertGreater(stats.event_counts[SCAN_EVENT_DATABASE], 0)
+        self.assertEqual(sum(stats.event_counts.values()), stats.lines)
+        # the 4 make invocations and their targets
+        self.assertEqual(stats.nodes, 4 + len(targets))
+        self.assertIsNone(stats.error)
+
+    def test_state_error(self):
+        # without its "Finished prerequisites" line f2.o is still collecting prereqs at "Must remake"
+        bad_file = os.path.join(self.tmp_dir, 'bad.log')
+        line_num = next(n for n, ln in enumerate(self.lines, 1)
+                        if b"Finished prerequisites of target file 'f2.o'" in ln)
+        with open(bad_file, 'wb') as fp:
+            fp.writelines(self.lines[:line_num - 1] + self.lines[line_num:])
+        stats = ScanStats()
+        with self.assertRaises(ScanStateError) as cm:
+            build_log_scan(bad_file, stats=stats)
+        e = cm.exception
+        self.assertEqual(e.line_num, line_num)
+        self.assertIn(b"Must remake target 'f2.o'", self.lines[line_num])
+        self.assertEqual(e.event, SCAN_EVENT_MUST_REMAKE)
+        self.assertEqual(e.target, 'f2.o')
+        self.assertEqual(e.expected, [MTST_PREREQ_COLLECTED])
+        self.assertEqual(e.actual, MTST_PREREQ_COLLECTING)
+        self.assertEqual(str(e), 'build log line {}, <must remake>: unexpected target state, target <f2.o>, '
+                                 'expected state <prereq collected>, actual state <prereq collecting>'.format(line_num))
+        self.assertIs(stats.error, e)
+        self.assertEqual(stats.lines, line_num - 1)
+
+
+@requires_make
+class FailureScanTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.log_file = make_build_log(cls.tmp_dir, failing=True)
+        cls.clean_log_file = make_build_log(cls.tmp_dir, name='clean.log')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_failed_targets(self):
+        # the failed targets dump the same as with -s failed on a full scan
+        target_filter = get_filter(states=[MTST_REMAKE_FAILED])
+        expected = dump_targets(build_log_scan(self.log_file), target_filter)
+        self.assertIn('f3.o', expected)
+        self.assertEqual(dump_targets(build_log_scan_failures(self.log_file), target_filter), expected)
+
+    def test_compressed_log(self):
+        archive_file = self.log_file + '.gz'
+        with open(self.log_file, 'rb') as fp, gzip.open(archive_file, 'wb') as outfp:
+            shutil.copyfileobj(fp, outfp)
+        target_filter = get_filter(states=[MTST_REMAKE_FAILED])
+        self.assertEqual(dump_targets(build_log_scan_failures(archive_file), target_filter),
+                         dump_targets(build_log_scan(self.log_file), target_filter))
+
+    def test_clean_build(self):
+        root = build_log_scan_failures(self.clean_log_file)
+        self.assertFalse(list(find_target(root, get_filter(states=[MTST_REMAKE_FAILED]))))
+
+    def test_command_line(self):
+        output = subprocess.run([sys.executable, SCAN_SCRIPT, '-l', self.log_file,
+                                 '--failures', '-F', 'json'], stdout=subprocess.PIPE, check=True).stdout
+        self.assertEqual([r['name'] for r in json.loads(output)], ['d2', 'f3.o'])
+        # options a failure scan can not honor are rejected before the scan
+        for options in (['-s', 'failed'], ['-C', os.path.join(self.tmp_dir, 'ckpt')], ['-f'], ['--stats'],
+                        ['--share-subtrees'], ['-S', os.path.join(self.tmp_dir, 'failed.mkdb')]):
+            with self.assertRaises(SystemExit) as cm:
+                main(['-l', self.log_file, '--failures'] + options)
+            self.assertEqual(cm.exception.code, -1)
+
+
+@requires_make
+class OutputSpanTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.log_file = make_build_log(cls.tmp_dir, failing=True)
+        cls.root = build_log_scan(cls.log_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_spans(self):
+        # the spans are the recipe output in the build log, job control lines skipped
+        with open(self.log_file, 'rb') as fp:
+            data = fp.read()
+        outputs = {}
+        for target in iter_make_targets(self.root):
+            if target.output_spans:
+                spans = target.output_spans
+                outputs.setdefault(target.name, []).append(
+                    b''.join(data[spans[i]:spans[i + 1]] for i in range(0, len(spans), 2)))
+        self.assertEqual(outputs['f3.o'], [b'cc f3.c\n', b'cc f3.c\n'])
+        self.assertEqual(outputs['lib.a'], [b'ar lib.a\n'])
+        self.assertEqual(outputs['d2'], [b'make -C d2\n'])
+        failed = list(find_target(self.root, get_filter(name=r'^f3\.o$', states=[MTST_REMAKE_FAILED])))
+        self.assertEqual(get_target_output(failed[0]), ['cc f3.c'])
+
+    def test_dump(self):
+        # 'o' dumps the output of failed targets, 'oo' of all targets
+        output = dump_targets(self.root, get_filter(name=r'^f[34]\.o$'), details='o')
+        self.assertEqual(output.count('output:'), 1)
+        output = dump_targets(self.root, get_filter(name=r'^f[34]\.o$'), details='oo')
+        self.assertEqual(output.count('output:'), 3)
+        self.assertIn('cc f4.c', output)
+
+    def test_make_database(self):
+        mkdb_file = os.path.join(self.tmp_dir, 'build.mkdb')
+        save_make_database(mkdb_file, self.root)
+        target_filter = get_filter(states=[MTST_REMAKE_FAILED])
+        self.assertEqual(dump_targets(load_make_database(mkdb_file), target_filter, details='o'),
+                         dump_targets(self.root, target_filter, details='o'))
+
+    def test_missing_log(self):
+        log_file = os.path.join(self.tmp_dir, 'moved.log')
+        copy_log(self.log_file, log_file)
+        root = build_log_scan(log_file)
+        os.remove(log_file)
+        output = dump_targets(root, get_filter(name=r'^f3\.o$', states=[MTST_REMAKE_FAILED]), details='o')
+        self.assertIn('output: not available, build log <{}> not found'.format(log_file), output)
+
+    def test_max_lines(self):
+        log_file = os.path.join(self.tmp_dir, 'output.log')
+        with open(log_file, 'wb') as fp:
+            fp.write(b''.join(b'line %d\n' % i for i in range(100)))
+        invocation = MakeInvocation(1, None, None)
+        invocation.build_log = log_file
+        target = MakeTarget('a.o')
+        target.invocation = invocation
+        # lines 0-4 and 90-99
+        target.output_spans = array('q', [0, 35, 710, 790])
+        self.assertEqual(get_target_output(target, 3), ['line 97', 'line 98', 'line 99'])
+        self.assertEqual(get_target_output(target, 12), ['line 3', 'line 4'] + ['line %d' % i for i in range(90, 100)])
+        self.assertEqual(get_target_output(target, 0), [])
+
+
+class ShareSubtreesTest(object):
+    # mixin, run on generated logs of each make version
+    make_version = None
+    shares_subtrees = True  # make 4.x prunes prereqs considered already, there is nothing to share
+
+    @classmethod
+    def generate(cls, name, failure_rate):
+        params = LogParams()
+        params.make_version = cls.make_version
+        params.failure_rate = failure_rate
+        params.seed = 1
+        log_file = os.path.join(cls.tmp_dir, name)
+        generate_build_log(log_file, params)
+        return log_file
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        # a complete build, and one stopped by a failed recipe
+        cls.log_file = cls.generate('build.log', 0.0)
+        cls.failed_log_file = cls.generate('failed.log', 0.01)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def assert_same_tree(self, log_file):
+        stats = ScanStats()
+        expected = dump_targets(build_log_scan(log_file, stats=stats), details='vvpmoo')
+        shared_stats = ScanStats()
+        root = build_log_scan(log_file, stats=shared_stats, share_subtrees=True)
+        self.assertEqual(dump_targets(root, details='vvpmoo'), expected)
+        shared = sum(1 for target in iter_make_targets(root) if isinstance(target, SharedMakeTarget))
+        self.assertEqual(shared > 0, self.shares_subtrees)
+        # the walk also yields the views below a shared target, which were never allocated
+        self.assertLessEqual(shared_stats.shared_nodes, shared)
+        self.assertEqual(shared_stats.shared_nodes > 0, self.shares_subtrees)
+        self.assertEqual(shared_stats.nodes < stats.nodes, self.shares_subtrees)
+        return root
+
+    def test_share_subtrees(self):
+        self.assert_same_tree(self.log_file)
+
+    def test_failed_build(self):
+        root = self.assert_same_tree(self.failed_log_file)
+        self.assertTrue(list(find_target(root, get_filter(states=[MTST_REMAKE_FAILED]))))
+
+    def test_make_database(self):
+        root = build_log_scan(self.log_file, share_subtrees=True)
+        mkdb_file = os.path.join(self.tmp_dir, 'shared.mkdb')
+        save_make_database(mkdb_file, root)
+        self.assertEqual(dump_targets(load_make_database(mkdb_file)), dump_targets(root))
+
+
+class Make382ShareSubtreesTest(ShareSubtreesTest, unittest.TestCase):
+    make_version = '3.82'
+
+
+class Make41ShareSubtreesTest(ShareSubtreesTest, unittest.TestCase):
+    make_version = '4.1'
+    shares_subtrees = False
+
+
+if __name__ == '__main__':
+    unittest.main()
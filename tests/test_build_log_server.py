@@ -0,0 +1,119 @@
+# tests of build_log_server, a server on a free port of localhost in a thread
+
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+import http.server
+
+from build_logs import requires_make, make_build_log
+from build_log_scan import build_log_scan, save_make_database
+from build_log_server import LoadedBuild, QueryHandler, request
+
+
+@requires_make
+class QueryServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.failed_log = make_build_log(cls.tmp_dir, name='failed.log', failing=True)
+        cls.clean_log = make_build_log(cls.tmp_dir, name='clean.log')
+        cls.log_file = os.path.join(cls.tmp_dir, 'build.log')
+        shutil.copyfile(cls.failed_log, cls.log_file)
+        cls.mkdb_file = os.path.join(cls.tmp_dir, 'clean.mkdb')
+        save_make_database(cls.mkdb_file, build_log_scan(cls.clean_log))
+
+        cls.builds = {'log': LoadedBuild('log', cls.log_file), 'db': LoadedBuild('db', cls.mkdb_file)}
+        for build in cls.builds.values():
+            build.update()
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), QueryHandler)
+        cls.server.daemon_threads = True
+        cls.server.builds = cls.builds
+        cls.port = cls.server.server_address[1]
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.tmp_dir)
+
+    def query(self, build, target=None, state=None, output_format='json'):
+        status, body = request('/targets', [('build', build), ('target', target), ('state', state),
+                                            ('format', output_format)], self.port)
+        self.assertEqual(status, 200, body)
+        return json.loads(body)
+
+    def test_builds(self):
+        status, body = request('/builds', [], self.port)
+        self.assertEqual(status, 200)
+        info = {build['name']: build for build in json.loads(body)}
+        self.assertEqual(info['db']['targets'], 47)
+        self.assertIsNone(info['db']['error'])
+
+    def test_query(self):
+        self.assertEqual([r['name'] for r in self.query('log', state='failed')], ['d2', 'f3.o'])
+        self.assertEqual(self.query('db', state='failed'), [])
+        self.assertEqual(len(self.query('db', target=r'^f3\.o$')), 3)
+
+    def test_errors(self):
+        self.assertEqual(request('/targets', [('target', 'x')], self.port)[0], 400)
+        self.assertEqual(request('/targets', [('build', 'missing')], self.port)[0], 404)
+        self.assertEqual(request('/targets', [('build', 'log'), ('format', 'xml')], self.port)[0], 400)
+        self.assertEqual(request('/targets', [('build', 'log'), ('target', '(')], self.port)[0], 400)
+        self.assertEqual(request('/missing', [], self.port)[0], 404)
+
+    def test_changed_log(self):
+        # queries get the last complete tree, the watcher, here update(), loads a changed file
+        build = self.builds['log']
+        try:
+            shutil.copyfile(self.clean_log, self.log_file)
+            self.assertEqual([r['name'] for r in self.query('log', state='failed')], ['d2', 'f3.o'])
+            build.update()
+            self.assertEqual(self.query('log', state='failed'), [])
+        finally:
+            shutil.copyfile(self.failed_log, self.log_file)
+            build.update()
+        self.assertEqual([r['name'] for r in self.query('log', state='failed')], ['d2', 'f3.o'])
+        self.assertIsNone(build.error)
+
+    def test_follow_growing_log(self):
+        log_file = os.path.join(self.tmp_dir, 'growing.log')
+        with open(self.failed_log, 'rb') as fp:
+            data = fp.read()
+        # ends with a partial line
+        size = data.index(b"Considering target file 'f3.o'") + 5
+        with open(log_file, 'wb') as fp:
+            fp.write(data[:size])
+        build = self.builds['growing'] = LoadedBuild('growing', log_file)
+        try:
+            build.update()
+            self.assertTrue(build.get_info()['following'])
+            status, body = request('/targets', [('build', 'growing'), ('state', 'failed')], self.port)
+            self.assertEqual(status, 503, body)
+            with open(log_file, 'ab') as fp:
+                fp.write(data[size:])
+            build.update()
+            self.assertFalse(build.get_info()['following'])
+            self.assertEqual([r['name'] for r in self.query('growing', state='failed')], ['d2', 'f3.o'])
+        finally:
+            del self.builds['growing']
+
+    def test_changed_database(self):
+        # a make database is loaded once it has not changed for a watch interval
+        mkdb_file = os.path.join(self.tmp_dir, 'changing.mkdb')
+        save_make_database(mkdb_file, build_log_scan(self.clean_log))
+        build = LoadedBuild('changing', mkdb_file)
+        build.update()
+        self.assertEqual(build.target_count, 47)
+        save_make_database(mkdb_file, build_log_scan(self.failed_log))
+        build.update()
+        self.assertEqual(build.target_count, 47)
+        build.update()
+        self.assertEqual(build.target_count, 30)
+
+if __name__ == '__main__':
+    unittest.main()
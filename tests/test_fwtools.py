@@ -0,0 +1,71 @@
+# tests of the fwtools command line and its scripts
+
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+from io import StringIO
+
+from fwtools import COMMANDS, get_verbose_level, run_command, run_script
+
+
+class RunScriptTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmp_dir)
+
+    def get_path(self, name):
+        return os.path.join(self.tmp_dir, name)
+
+    def gen_command(self, name):
+        return 'gen -o {} --targets 2 --depth 0\n'.format(self.get_path(name))
+
+    def get_script(self, failing_line):
+        return StringIO('# generate two logs\n\n' + self.gen_command('a.log') + failing_line +
+                        self.gen_command('b.log'))
+
+    def test_script(self):
+        self.assertEqual(run_script(StringIO(self.gen_command('a.log') + '  # done\n')), 0)
+        self.assertTrue(os.path.isfile(self.get_path('a.log')))
+
+    def test_stop_at_failure(self):
+        # gen without an output file exits with -1
+        self.assertEqual(run_script(self.get_script('gen\n')), -1)
+        self.assertTrue(os.path.isfile(self.get_path('a.log')))
+        self.assertFalse(os.path.exists(self.get_path('b.log')))
+
+    def test_keep_going(self):
+        # the status of the first failed command
+        script = self.get_script('fetch a.log\ngen --bad-option\n')
+        self.assertEqual(run_script(script, keep_going=True), 2)
+        self.assertTrue(os.path.isfile(self.get_path('b.log')))
+
+    def test_raising_command(self):
+        # a scan of a missing log raises, the script goes on with -k
+        script = self.get_script('scan -l {}\n'.format(self.get_path('missing.log')))
+        self.assertEqual(run_script(script, keep_going=True), 1)
+        self.assertTrue(os.path.isfile(self.get_path('b.log')))
+
+    def test_syntax_error(self):
+        self.assertEqual(run_script(self.get_script("gen -o 'a.log\n")), 2)
+        self.assertFalse(os.path.exists(self.get_path('b.log')))
+
+    def test_run_command(self):
+        self.assertEqual(run_command(['gen']), -1)
+        self.assertEqual(run_command(['gen', '--bad-option']), 2)
+        self.assertEqual(run_command(['gen', '-o', self.get_path('a.log'), '--depth', '0']), 0)
+
+    def test_commands(self):
+        self.assertNotIn('run', COMMANDS)
+        self.assertEqual(get_verbose_level('debug'), logging.DEBUG)
+        self.assertEqual(get_verbose_level('15'), 15)
+        self.assertEqual(get_verbose_level(None), logging.INFO)
+
+
+if __name__ == '__main__':
+    unittest.main()